@@ -1,28 +1,171 @@
 # -*- coding:utf-8 -*-
 
+import itertools
+import time
+
+import metrics
+import tracing
+from answer_cache import AnswerCache
 from QuestionClassifier import *
+from tracing import COUNTERS
 
 class QuestionAnswerSystem(object):
-	def __init__(self):
-		self.classifier = QuestionClassifier()
+	def __init__(self, graph_client=None, answer_cache=None, classifier=None):
+		# classifier 可以由多个进程共享（fork 前加载），为空时新建
+		self.classifier = classifier if classifier is not None else QuestionClassifier()
+		# 实体类型取自分类结果的 keywords，与匹配实体时使用同一版本的领域词典（reload 不会使两者不一致）
 		self.question_parser = QuestionParser()
-		self.answer_searcher = AnswerSearcher()
+		if answer_cache is None:
+			answer_cache = AnswerCache.from_env()
+		self.answer_searcher = AnswerSearcher(graph_client, answer_cache)
 
-	def question_answer_main(self,question):
-		answer = "非常抱歉，这个问题超出小医的能力范围！"
+	def prepare(self,question):
+		'''
+		问题分类与解析
+		:return: (classify_res, sql_list)，无法解析的问句返回 ({}, [])
+		'''
+		COUNTERS.incr('questions')
+		# 问题分类
 		classify_res = self.classifier.classify_main(question)
-		print(classify_res)
 		if not classify_res: # 无法解析问句
-			return answer
+			COUNTERS.incr('unanswerable_no_entity')
+			return {}, []
+
+		# 问题解析
+		with tracing.span('parse'):
+			sql_list = self.question_parser.parser_main(classify_res)
+		if metrics.enabled:
+			for question_type in classify_res['question_types']:
+				metrics.QUESTION_TYPES.inc(question_type.value)
+		trace = tracing.current()
+		if trace.sampled:
+			trace.set(entities=list(classify_res['keywords']),
+					  question_types=[question_type.value for question_type in classify_res['question_types']])
+		return classify_res, sql_list
+
+	def question_answer_main(self,question,timeout=None):
+		'''
+		:param timeout: 图数据库查询的截止时间（秒），为空时使用 GraphClient 的默认超时
+		'''
+		answer = "非常抱歉，这个问题超出小医的能力范围！"
+		with tracing.trace('question_answer', question=question):
+			classify_res, res_sql = self.prepare(question)
+			if not classify_res:
+				return answer
+			final_answers = self.answer_searcher.search_main(res_sql, timeout)
+
+			if not final_answers:
+				COUNTERS.incr('unanswerable_no_result')
+				return answer
+			else:
+				return '\n'.join(final_answers)
+
+	async def question_answer_main_async(self,question,timeout=None):
+		'''
+		question_answer_main 的协程版本，供 ASGI 等 asyncio 调用方使用：
+		问句分类与解析在当前线程完成，图数据库查询以 await 方式执行，不阻塞事件循环
+		'''
+		answer = "非常抱歉，这个问题超出小医的能力范围！"
+		with tracing.trace('question_answer', question=question):
+			classify_res, res_sql = self.prepare(question)
+			if not classify_res:
+				return answer
+			final_answers = await self.answer_searcher.search_main_async(res_sql, timeout)
+
+			if not final_answers:
+				COUNTERS.incr('unanswerable_no_result')
+				return answer
+			else:
+				return '\n'.join(final_answers)
+
+	def question_answer_batch(self,questions,chunksize=256,timeout=None):
+		'''
+		批量问答，按输入顺序惰性返回每个问句的 (回答, 是否回答)
+		每 chunksize 个问句合并查询一次图数据库，其中相同的 (问题类型, 实体) 只查询一次
+		:param timeout: 整批的截止时间（秒），从第一次取结果开始计时；为空时每个分块使用 GraphClient 的默认超时
+		:raise GraphTimeout: 超过截止时间，此前的回答已经返回
+		'''
+		no_answer = "非常抱歉，这个问题超出小医的能力范围！"
+		deadline = None if timeout is None else time.monotonic() + timeout
+		questions = iter(questions)
+		while True:
+			chunk = list(itertools.islice(questions, chunksize))
+			if not chunk:
+				break
+			# 每个分块一个追踪，追踪不跨越 yield
+			with tracing.trace('question_answer_batch', questions=len(chunk)):
+				COUNTERS.incr('questions', len(chunk))
+				sql_lists = []
+				for classify_res in self.classifier.classify_batch(chunk):
+					if not classify_res:
+						COUNTERS.incr('unanswerable_no_entity')
+						sql_lists.append([])
+						continue
+					with tracing.span('parse'):
+						sql_lists.append(self.question_parser.parser_main(classify_res))
+					if metrics.enabled:
+						for question_type in classify_res['question_types']:
+							metrics.QUESTION_TYPES.inc(question_type.value)
+				remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+				answers = []
+				for sql_list, final_answers in zip(sql_lists, self.answer_searcher.search_batch(sql_lists, remaining)):
+					if final_answers:
+						answers.append(('\n'.join(final_answers), True))
+					else:
+						if sql_list:
+							COUNTERS.incr('unanswerable_no_result')
+						answers.append((no_answer, False))
+			for answer in answers:
+				yield answer
+
+	def question_answer_structured(self,question,render_text=False,timeout=None):
+		'''
+		结构化回答，见 structured_answer；timeout 同 question_answer_main
+		'''
+		with tracing.trace('question_answer_structured', question=question):
+			classify_res, sql_list = self.prepare(question)
+			answers_list = self.answer_searcher.search_rows(sql_list, timeout)
+			return self.structured_answer(classify_res, sql_list, answers_list, render_text)
+
+	def structured_answer(self,classify_res,sql_list,answers_list,render_text=False):
+		'''
+		:param render_text: 是否同时生成模板回答
+		:return: dict
+		answered : 是否查到了回答
+		question_types : 问题类型
+		entities : [{'name', 'start', 'end', 'types'}] 问句中的实体，end 不含在实体内
+		answers : [{'question_type', 'results'[, 'text']}] 每个查到结果的问题类型，results 见 AnswerSearcher.answer_structured
+		text : 拼接后的模板回答（仅 render_text 时）
+		'''
+		answers = []
+		with tracing.span('prettify'):
+			for sql_dict, rows in zip(sql_list, answers_list):
+				results = self.answer_searcher.answer_structured(sql_dict['question_type'], rows)
+				if not results:
+					continue
+				answer = {'question_type': sql_dict['question_type'].value, 'results': results}
+				if render_text:
+					answer['text'] = self.answer_searcher.answer_prettify(sql_dict['question_type'], rows)
+				answers.append(answer)
+		if classify_res and not answers:
+			COUNTERS.incr('unanswerable_no_result')
 
-		res_sql = self.question_parser.parser_main(classify_res)
-		print(res_sql)
-		final_answers = self.answer_searcher.search_main(res_sql)
+		res = {
+			'answered': bool(answers),
+			'question_types': [question_type.value for question_type in classify_res.get('question_types', [])],
+			'entities': [{'name': word, 'start': start, 'end': end, 'types': [entity_type.value for entity_type in types]}
+						 for word, start, end, types in classify_res.get('entity_spans', [])],
+			'answers': answers,
+		}
+		if render_text:
+			res['text'] = '\n'.join(answer['text'] for answer in answers) or "非常抱歉，这个问题超出小医的能力范围！"
+		return res
 
-		if not final_answers:
-			return answer
-		else:
-			return '\n'.join(final_answers)
+	def graph_reloaded(self, entities=None):
+		'''
+		图谱重新加载后使查询缓存失效，entities 为发生变化的实体，为空时全部失效
+		'''
+		self.answer_searcher.invalidate_cache(entities)
 
 if __name__ == '__main__':
 	handler = QuestionAnswerSystem()
@@ -1,9 +1,21 @@
 
 from cmath import log
 from enum import Enum
-from py2neo import Graph
-import ahocorasick
+import asyncio
+import gc
+import itertools
 import logging
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+
+import metrics
+import tracing
+from graph_client import GraphClient
+from region_index import REGION_DIR, INDEX_PATH, INDEX_VERSION, RegionState, build_in_child, build_trigger_tree, file_stamps, \
+    finish_region_update, load_region_index, read_region_index, rebuild_region_index, region_checksum, update_region_index
 
 class QUESTIONTYPE(Enum):
     '''
@@ -90,54 +102,129 @@ class ENTITYTYPE(Enum):
     FOOD = "food"
     SYMPTOM = "Symptom"
 
+# 领域实体词表（位于 region_dir 下）
+REGION_FILES = [
+    (ENTITYTYPE.DISEASE, 'diseases.txt'),
+    (ENTITYTYPE.DEPARTMENT, 'departments.txt'),
+    (ENTITYTYPE.CHECK, 'checks.txt'),
+    (ENTITYTYPE.DRUG, 'drugs.txt'),
+    (ENTITYTYPE.FOOD, 'foods.txt'),
+    (ENTITYTYPE.SYMPTOM, 'symptoms.txt'),
+]
+REGION_TYPES = [entity_type for entity_type, _ in REGION_FILES]
+
+# 问题类型判断规则，按顺序求值：
+# (触发词类别, 问句需包含的实体类型, 问题类型, 同时命中否定词时的问题类型)
+QUESTION_RULES = [
+    ('symptom', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_TO_SYMPTOM, None),
+    ('symptom', ENTITYTYPE.SYMPTOM, QUESTIONTYPE.SYMPTOM_TO_DISEASE, None),
+    ('cause', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_CAUSE, None),
+    ('complication', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_COMLICATION, None),
+    ('drug', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_DRUG, None),
+    ('food', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_GOOD_FOOD, QUESTIONTYPE.DISEASE_AOID_FOOD),
+    ('check', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_DO_CHECK, None),
+    ('prevent', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_PREVENT, None),
+    ('treat_way', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_TREAT_WAY, None),
+    ('treat_cycle', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_TREAT_CYCLE, None),
+    ('cure_prob', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_CURED_PRO, None),
+    ('belong', ENTITYTYPE.DISEASE, QUESTIONTYPE.DISEASE_TO_DEPARTMENT, None),
+]
+
+# 各问题类型的查询模板，$names 为问句中对应类型的实体列表
+QUERY_TEMPLATES = {
+    # 已知疾病查询症状 disease_symptom
+    QUESTIONTYPE.DISEASE_TO_SYMPTOM: "UNWIND $names AS name MATCH (m:Disease)-[r:has_symptom]->(n:Symptom) "
+                                     "WHERE m.name = name RETURN m.name, r.name, n.name",
+    # 已知症状判断疾病 symptom_disease
+    QUESTIONTYPE.SYMPTOM_TO_DISEASE: "UNWIND $names AS name MATCH (m:Disease)-[r:has_symptom]->(n:Symptom) "
+                                     "WHERE n.name = name RETURN m.name, r.name, n.name",
+    # 疾病原因 disease_cause
+    QUESTIONTYPE.DISEASE_CAUSE: "UNWIND $names AS name MATCH (m:Disease) WHERE m.name = name RETURN m.name, m.cause",
+    # 并发症 disease_complication
+    QUESTIONTYPE.DISEASE_COMLICATION: "UNWIND $names AS name MATCH (m:Disease)-[r:acompany_with]->(n:Disease) "
+                                      "WHERE m.name = name RETURN m.name, r.name, n.name",
+    # 已知疾病查忌口食物 disease_avoid_food
+    QUESTIONTYPE.DISEASE_AOID_FOOD: "UNWIND $names AS name MATCH (m:Disease)-[r:no_eat]->(n:Food) "
+                                    "WHERE m.name = name RETURN m.name, r.name, n.name",
+    # 已知疾病查宜吃食物和推荐食谱 disease_good_food
+    QUESTIONTYPE.DISEASE_GOOD_FOOD: "UNWIND $names AS name MATCH (m:Disease)-[r:do_eat|recommand_eat]->(n:Food) "
+                                    "WHERE m.name = name RETURN m.name, r.name, n.name",
+    # 疾病常用药品 disease_drug
+    QUESTIONTYPE.DISEASE_DRUG: "UNWIND $names AS name MATCH (m:Disease)-[r:common_drug]->(n:Drug) "
+                               "WHERE m.name = name RETURN m.name, r.name, n.name",
+    # 疾病检查项目 disease_check
+    QUESTIONTYPE.DISEASE_DO_CHECK: "UNWIND $names AS name MATCH (m:Disease)-[r:need_check]->(n:Check) "
+                                   "WHERE m.name = name RETURN m.name, r.name, n.name",
+    # 疾病预防 disease_prevent
+    QUESTIONTYPE.DISEASE_PREVENT: "UNWIND $names AS name MATCH (m:Disease) WHERE m.name = name RETURN m.name, m.prevent",
+    # 疾病治疗方法 disease_treat_way
+    QUESTIONTYPE.DISEASE_TREAT_WAY: "UNWIND $names AS name MATCH (m:Disease) WHERE m.name = name RETURN m.name, m.cure_way",
+    # 疾病治愈可能性 disease_cure_prob
+    QUESTIONTYPE.DISEASE_CURED_PRO: "UNWIND $names AS name MATCH (m:Disease) WHERE m.name = name RETURN m.name, m.cured_prob",
+    # 疾病去哪个科室 disease_department
+    QUESTIONTYPE.DISEASE_TO_DEPARTMENT: "UNWIND $names AS name MATCH (m:Disease)-[r:belongs_to]->(n:Department) "
+                                        "WHERE m.name = name RETURN m.name, r.name, n.name",
+    # 疾病治疗周期 disease_treat_cycle
+    QUESTIONTYPE.DISEASE_TREAT_CYCLE: "UNWIND $names AS name MATCH (m:Disease) WHERE m.name = name RETURN m.name, m.cure_lasttime",
+    # 疾病描述 disease_desc
+    QUESTIONTYPE.DISEASE_DESC: "UNWIND $names AS name MATCH (m:Disease) WHERE m.name = name RETURN m.name, m.desc",
+}
+
+# 按问题类型统计图数据库查询耗时
+metrics.QUERY_LABELS.update({template: question_type.value for question_type, template in QUERY_TEMPLATES.items()})
+
+# 查询结果中实体名所在的列，用于把 UNWIND 查询的结果按实体拆分，未列出的为 m.name
+QUERY_KEY_COLUMNS = {
+    QUESTIONTYPE.SYMPTOM_TO_DISEASE: 'n.name',
+}
+
+# 结构化回答中取值所在的列，未列出的为 n.name（关系查询的另一端实体）
+ANSWER_VALUE_COLUMNS = {
+    QUESTIONTYPE.SYMPTOM_TO_DISEASE: 'm.name',
+    QUESTIONTYPE.DISEASE_CAUSE: 'm.cause',
+    QUESTIONTYPE.DISEASE_PREVENT: 'm.prevent',
+    QUESTIONTYPE.DISEASE_TREAT_WAY: 'm.cure_way',
+    QUESTIONTYPE.DISEASE_CURED_PRO: 'm.cured_prob',
+    QUESTIONTYPE.DISEASE_TREAT_CYCLE: 'm.cure_lasttime',
+    QUESTIONTYPE.DISEASE_DESC: 'm.desc',
+}
+
+
+def region_words_property(entity_type):
+    # 词按需从词池中取出，不再常驻内存
+    return property(lambda self: self.region.entity_index.words_of(entity_type))
 
 
 class QuestionClassifier(object):
     '''
     判断器初始化
     '''
-    def __init__(self):
-		# 实体加载
-        # 疾病实体
-        disease_path = ('data/region_words/diseases.txt')
-        # 症状实体
-        symptom_path = ('data/region_words/symptoms.txt')
-        # 科室实体
-        department_path = ('data/region_words/departments.txt')
-        # 检查实体
-        check_path =  ('data/region_words/checks.txt')
-        # 药品实体
-        drug_path = ('data/region_words/drugs.txt')
-        # 食物实体
-        food_path =  ('data/region_words/foods.txt')
-        # 加载特征词
-        print('initialing regional words')
-        print('load diseases...')
-        self.disease_words = [word.strip() for word in open(disease_path, encoding='utf-8') if word.strip()]
-        print('load department...')
-        self.department_words = [word.strip() for word in open(department_path, encoding='utf-8') if word.strip()]
-        print('load check words...')
-        self.check_words = [word.strip() for word in open(check_path, encoding='utf-8') if word.strip()]
-        print('load drug words...')
-        self.drug_words = [word.strip() for word in open(drug_path, encoding='utf-8') if word.strip()]
-        print('load foods words...')
-        self.food_words = [word.strip() for word in open(food_path, encoding='utf-8') if word.strip()]
-        print('load symptom...')
-        self.symptom_words = [word.strip() for word in open(symptom_path, encoding='utf-8') if word.strip()]
-
-        # 构建领域词典
-        self.region_words = set(self.disease_words+self.department_words+self.check_words+self.drug_words+self.food_words+self.symptom_words)
-        # 构建actree
-        print('building actree')
-        self.region_tree= self.build_actree(self.region_words)
-        # 构建实体类型字典
-        self.word_type_dict = self.build_word_type_dict()
+    # 疾病实体
+    disease_words = region_words_property(ENTITYTYPE.DISEASE)
+    # 科室实体
+    department_words = region_words_property(ENTITYTYPE.DEPARTMENT)
+    # 检查实体
+    check_words = region_words_property(ENTITYTYPE.CHECK)
+    # 药品实体
+    drug_words = region_words_property(ENTITYTYPE.DRUG)
+    # 食物实体
+    food_words = region_words_property(ENTITYTYPE.FOOD)
+    # 症状实体
+    symptom_words = region_words_property(ENTITYTYPE.SYMPTOM)
+
+    def __init__(self, region_dir=REGION_DIR, index_path=INDEX_PATH):
+        self.region_dir = region_dir
+        self.index_path = index_path
+        self.region_files = [file_name for _, file_name in REGION_FILES]
+        # 领域词典的更新（reload / update_words）串行执行，读取不加锁
+        self.reload_lock = threading.Lock()
+        # 加载预编译的领域词典（实体词表、实体类型字典、actree），过期时自动重建
+        logging.info('loading region index from %s', region_dir)
+        # 实体类型索引（领域词典）与 actree，更新时整体替换
+        self.region = RegionState(load_region_index(region_dir, index_path, self.region_files), REGION_TYPES)
 
-
-        
         # 加载类型否定词
-        deny_path = ('data/region_words/deny.txt')
-        self.deny_words = [word.strip() for word in open(deny_path, encoding='utf-8') if word.strip()]
+        self.deny_words = self.load_deny_words()
 
         # 构建不同问题类型的问题触发词
         # 用于询问疾病的症状触发词，询问症状对应的疾病触发词
@@ -167,83 +254,215 @@ class QuestionClassifier(object):
         self.check_qwds = ['检查', '检查项目', '查出', '检查', '测出', '试出','怎么查','查什么']
         # 疾病所属科室触发词
         self.belong_qwds = ['属于什么科', '属于', '什么科', '科室','挂号','挂什么','挂什么科室']
-        
-    
+
+        # 所有触发词和否定词编译进同一个actree，一次扫描得到命中的触发词类别
+        self.trigger_words = {
+            'symptom': self.symptom_qwds,
+            'cause': self.cause_qwds,
+            'complication': self.complication_qwds,
+            'food': self.food_qwds,
+            'drug': self.drug_qwds,
+            'prevent': self.prevent_qwds,
+            'treat_cycle': self.treat_cycle_qwds,
+            'treat_way': self.treat_way_qwds,
+            'cure_prob': self.cure_prob_qwds,
+            'check': self.check_qwds,
+            'belong': self.belong_qwds,
+            'deny': self.deny_words,
+        }
+        self.trigger_tree = build_trigger_tree(self.trigger_words)
+
+    @property
+    def entity_index(self):
+        return self.region.entity_index
+
+    @property
+    def region_tree(self):
+        return self.region.actree
+
+    def load_deny_words(self):
+        deny_path = os.path.join(self.region_dir, 'deny.txt')
+        return [word.strip() for word in open(deny_path, encoding='utf-8') if word.strip()]
+
+    def reload(self):
+        '''
+        词表文件变化后重新加载领域词典与否定词，处理中的请求继续使用旧版本
+        其他进程已按新词表写好索引文件时直接读入，否则在子进程中重建（见 region_index.build_in_child）
+        :return: 领域词典是否有变化
+        '''
+        with self.reload_lock:
+            deny_words = self.load_deny_words()
+            if deny_words != self.deny_words:
+                self.trigger_tree = build_trigger_tree(dict(self.trigger_words, deny=deny_words))
+                self.trigger_words['deny'] = self.deny_words = deny_words
+                logging.info('deny words reloaded: %d words', len(deny_words))
+
+            checksum = region_checksum(self.region_dir, self.region_files)
+            if checksum == self.region.checksum:
+                return False
+            start = time.perf_counter()
+            region_index = None
+            try:
+                region_index = read_region_index(self.index_path)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+            if region_index is None or (region_index.get('version'), region_index.get('checksum')) != (INDEX_VERSION, checksum):
+                region_index = build_in_child(rebuild_region_index, (self.region_dir, self.region_files, self.index_path))
+            self.set_region(region_index, time.perf_counter() - start)
+            return True
+
+    def update_words(self, add=None, remove=None, persist=True):
+        '''
+        增删领域词，只改变已有词的类型时不重建 actree
+        :param add: 实体类型 -> 要加入的词列表
+        :param remove: 实体类型 -> 要删除的词列表
+        :param persist: 是否写回词表文件（同时更新索引文件，开启 watch 的其他进程随之更新）；
+                        不写回时，修改在下次 reload 读到新的词表文件前有效
+        '''
+        positions = {entity_type: ind for ind, entity_type in enumerate(REGION_TYPES)}
+        add = {positions[entity_type]: words for entity_type, words in (add or {}).items()}
+        remove = {positions[entity_type]: words for entity_type, words in (remove or {}).items()}
+        with self.reload_lock:
+            start = time.perf_counter()
+            old_index = self.region.region_index
+            region_index = update_region_index(old_index, add, remove)
+            if region_index['actree'] is None or persist:
+                args = (region_index, sorted(set(add) | set(remove)))
+                if persist:
+                    args += (self.region_dir, self.region_files, self.index_path)
+                actree, checksum = build_in_child(finish_region_update, args)
+                if actree is not None:
+                    region_index['actree'] = actree
+                region_index['checksum'] = checksum
+            self.set_region(region_index, time.perf_counter() - start)
+
+    def set_region(self, region_index, seconds):
+        old_size = len(self.region.entity_index)
+        # 一次赋值完成替换，旧版本在最后一个使用它的请求结束后释放
+        self.region = RegionState(region_index, REGION_TYPES)
+        logging.info('region index updated in %.2fs: %d -> %d words', seconds, old_size, len(self.region.entity_index))
+
+    def watch(self, interval):
+        '''
+        启动后台线程，每 interval 秒检查词表文件，有变化时 reload
+        线程不能跨 fork 使用，多进程部署时每个 worker 各自启动
+        '''
+        paths = [os.path.join(self.region_dir, file_name) for file_name in self.region_files + ['deny.txt']]
+        thread = threading.Thread(target=self.watch_loop, args=(paths, interval), name='region-watch', daemon=True)
+        thread.start()
+        return thread
+
+    def watch_loop(self, paths, interval):
+        stamps = None
+        while True:
+            new_stamps = file_stamps(paths)
+            # 第一次检查时也比较校验和：worker 可能由词表变化前加载的 master 进程 fork 而来
+            if new_stamps != stamps:
+                stamps = new_stamps
+                try:
+                    self.reload()
+                except Exception:
+                    logging.exception('failed to reload region words from %s', self.region_dir)
+            time.sleep(interval)
+
     def classify_main(self,question):
         '''
 		:param question:
 		:return: dict
 		keywords : 问题中的关键词以及其对应实体类型（标签）
+		entity_spans : 关键词在问句中的位置，见 get_entity_spans
 		question_types : 根据关键词及问题词（qwds） 判断问句类别（eg。 已知疾病找药物）
 		'''
-        keywords = self.get_keyword_from_question(question)
+        data = self.classify_question(question)
+        if data:
+            logging.debug('本次匹配的entity包括：%s', data['keywords'])
+        return data
+
+    def classify_question(self,question):
+        '''
+        classify_main 的判断逻辑，不输出日志，供批量判断使用
+        '''
+        with tracing.span('entity_match'):
+            entity_spans = self.get_entity_spans(question)
+        keywords = {word:list(types) for word, _, _, types in entity_spans}
 
         if not keywords: # 如果问句中没有匹配的关键词，则无效问题（无法回答）
             return {}
-        
-        logging.info('本次匹配的entity包括：',keywords)
 
         data = {}
         data['keywords'] = keywords
-        types = []
+        data['entity_spans'] = entity_spans
         # 收集问句当中所涉及到的实体类型
+        types = set()
         for type in keywords.values():
-            types += type
-        
-        question_types = []
+            types.update(type)
 
-        #TODO 1 已知疾病，判断症状
-        if self.check_qwds_type(self.symptom_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            question_types.append(QUESTIONTYPE.DISEASE_TO_SYMPTOM)
-        
-        #TODO 2 已知症状,判断疾病
-        if self.check_qwds_type(self.symptom_qwds,question) and (ENTITYTYPE.SYMPTOM in types):
-            question_types.append(QUESTIONTYPE.SYMPTOM_TO_DISEASE)
-        
-        #TODO 3 已知疾病，判断原因
-        if self.check_qwds_type(self.cause_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            question_types.append(QUESTIONTYPE.DISEASE_CAUSE)
-        
-        #TODO 4 已知疾病，判断并发症
-        if self.check_qwds_type(self.complication_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            question_types.append(QUESTIONTYPE.DISEASE_COMLICATION)
+        with tracing.span('trigger_classify'):
+            question_types = self.classify_question_types(question, types)
 
-        #TODO 5 已知疾病，查找药品
-        if self.check_qwds_type(self.drug_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            question_types.append(QUESTIONTYPE.DISEASE_DRUG)
-        
-        #TODO 6 已知疾病，推荐或拒绝食物
-        if self.check_qwds_type(self.food_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            is_deny = self.check_qwds_type(self.deny_words,question)
-            if is_deny:
-                question_types.append(QUESTIONTYPE.DISEASE_AOID_FOOD)
-            else:
-                question_types.append(QUESTIONTYPE.DISEASE_GOOD_FOOD)
-
-        #TODO 7 已知疾病，查询就检查项目
-        if self.check_qwds_type(self.check_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            question_types.append(QUESTIONTYPE.DISEASE_DO_CHECK)
-        
-        #TODO 8 已知疾病，查询预防措施
-        if self.check_qwds_type(self.prevent_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            question_types.append(QUESTIONTYPE.DISEASE_PREVENT)
-        
-        #TODO 9 已知疾病，查找治愈方法
-        if self.check_qwds_type(self.treat_way_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            question_types.append(QUESTIONTYPE.DISEASE_TREAT_WAY)
+        data['question_types'] = question_types
         
-        #TODO 10 已知疾病，查找治愈周期
-        if self.check_qwds_type(self.treat_cycle_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            question_types.append(QUESTIONTYPE.DISEASE_TREAT_CYCLE)
+        return data
+
+    
+    def classify_batch(self,questions,processes=None,chunksize=256):
+        '''
+        批量判断问题类型，按输入顺序惰性返回 classify_main 的结果
+        :param questions: 问句的可迭代对象，可以是文件等流式输入
+        :param processes: 进程数，为空或 1 时在当前进程中执行；
+                          多进程时子进程由 fork 产生，以写时复制的方式共享已加载的 actree
+        :param chunksize: 每次发给子进程的问句数
+        '''
+        if not processes or processes <= 1:
+            for question in questions:
+                yield self.classify_question(question)
+            return
+
+        # fork 前冻结已有对象，避免子进程中的 gc 扫描改写引用计数导致内存页被复制；
+        # 调用方（如 web_server.create_app）此前冻结的对象不能随之解冻，此时本次冻结的对象也保持冻结
+        frozen = gc.get_freeze_count()
+        gc.freeze()
+        try:
+            # 分类器经 initializer 在 fork 时交给子进程，不经过模块全局变量，多个线程同时调用互不影响
+            pool = multiprocessing.get_context('fork').Pool(processes, _init_worker, (self,))
+        finally:
+            if not frozen:
+                gc.unfreeze()
+
+        with pool:
+            # Pool.imap 会一次性读完输入，按窗口分批提交以保持内存平稳
+            questions = iter(questions)
+            window = processes * chunksize * 4
+            while True:
+                batch = list(itertools.islice(questions, window))
+                if not batch:
+                    break
+                for data in pool.imap(_classify_in_worker, batch, chunksize):
+                    yield data
+
+    def get_trigger_categories(self,question):
+        '''
+        :return: set 问句中命中的触发词类别（含否定词类别 deny）
+        '''
+        categories = set()
+        for _, word_categories in self.trigger_tree.iter(question):
+            categories |= word_categories
+        return categories
 
-        #TODO 11 已知疾病，查找治愈可能性
-        if self.check_qwds_type(self.cure_prob_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            question_types.append(QUESTIONTYPE.DISEASE_CURED_PRO)
+    def classify_question_types(self,question,types):
+        '''
+        按 QUESTION_RULES 判断问题类型
+        :param types: 问句中实体的类型集合
+        '''
+        categories = self.get_trigger_categories(question)
+        question_types = []
+        for category, entity_type, question_type, deny_question_type in QUESTION_RULES:
+            if category in categories and entity_type in types:
+                if deny_question_type is not None and 'deny' in categories:
+                    question_types.append(deny_question_type)
+                else:
+                    question_types.append(question_type)
 
-        #TODO 12 已知疾病，查找科室
-        if self.check_qwds_type(self.belong_qwds,question) and (ENTITYTYPE.DISEASE in types):
-            question_types.append(QUESTIONTYPE.DISEASE_TO_DEPARTMENT)
-        
         # 知道疾病，但是无法判断，所以返回描述
         if question_types == [] and (ENTITYTYPE.DISEASE in types):
             question_types.append(QUESTIONTYPE.DISEASE_DESC)
@@ -251,75 +470,50 @@ class QuestionClassifier(object):
         # 知道症状，但是无法判断问题类型,返回疾病对应的症状
         if question_types == [] and (ENTITYTYPE.SYMPTOM in types):
             question_types.append(QUESTIONTYPE.SYMPTOM_TO_DISEASE)
-        
-        data['question_types'] = question_types
-        
-        return data
 
-    
-    def check_qwds_type(self,words,sent):
-        '''基于特征词进行分类'''
-        for word in words:
-            if word in sent:
-                return True
-        return False
+        return question_types
 
     def get_keyword_from_question(self,question):
-        region_words = []
-
-        for item in self.region_tree.iter(question):
-            keyword = item[1][1]
-            region_words.append(keyword)
-        region_words = list(set(region_words))
-
-        # 同时匹配到长实体和短实体时候，去掉短实体，保留长实体
-        stop_words = []
-        for wd1 in region_words:
-            for wd2 in region_words:
-                if wd1 in wd2 and wd1 != wd2:
-                    stop_words.append(wd1)
-        # 去掉短实体
-        final_words = [word for word in region_words if word not in stop_words]
-        final_word_types = {word:self.word_type_dict.get(word) for word in final_words}
-        return final_word_types
-
-    '''
-    :return: dict
-    一个词可能对应多种标签类型 (eg. 肺栓塞 ['Disease', 'Symptom'])
-    '''
-    def build_word_type_dict(self):
-        word_dict = dict()
+        '''
+        :return: dict 实体 -> 实体类型列表
+        '''
+        return {word:list(types) for word, _, _, types in self.get_entity_spans(question)}
 
-        for word in self.region_words:
-            word_dict[word] = []
-            if word in self.disease_words:
-                word_dict[word].append(ENTITYTYPE.DISEASE)
+    def get_entity_spans(self,question):
+        '''
+        最左最长匹配：重叠的实体只保留起点最靠左的，起点相同时保留最长的
+        :return: [(实体, 起始位置, 结束位置(不含), 实体类型元组)]，按出现位置排序
+        '''
+        entity_index = self.region.entity_index
+        offsets = entity_index.pool.offsets
+        spans = []
+        # actree.iter 按结束位置递增给出命中（值为词 ID），新命中的结束位置不小于已保留的任何实体：
+        # 起点不早于新命中的那些实体（spans[keep:]）会被它整体覆盖，但只有当它与更靠左的实体不重叠时才替换它们，
+        # 否则丢弃新命中、保留原有实体
+        for end, ind in entity_index.actree.iter(question):
+            start = end - (offsets[ind + 1] - offsets[ind]) + 1
+            keep = len(spans)
+            while keep and spans[keep - 1][1] >= start:
+                keep -= 1
+            if keep and spans[keep - 1][2] > start:
+                continue
+            del spans[keep:]
+            spans.append((ind, start, end + 1))
+        mask_types, word_types = entity_index.mask_types, entity_index.word_types
+        return [(question[start:end], start, end, mask_types[word_types[ind]]) for ind, start, end in spans]
 
-            if word in self.department_words:
-                word_dict[word].append(ENTITYTYPE.DEPARTMENT)
 
-            if word in self.check_words:
-                word_dict[word].append(ENTITYTYPE.DEPARTMENT)
+# classify_batch 多进程模式下子进程使用的分类器，只在子进程中由 _init_worker 设置
+_worker_classifier = None
 
-            if word in self.drug_words:
-                word_dict[word].append(ENTITYTYPE.DRUG)
 
-            if word in self.food_words:
-                word_dict[word].append(ENTITYTYPE.FOOD)
+def _init_worker(classifier):
+    global _worker_classifier
+    _worker_classifier = classifier
 
-            if word in self.symptom_words:
-                word_dict[word].append(ENTITYTYPE.SYMPTOM)
-        return word_dict
 
-    '''
-    构建actree
-    '''
-    def build_actree(self,word_list):
-        actree = ahocorasick.Automaton()
-        for ind, word in enumerate(word_list):
-            actree.add_word(word, (ind, word))
-            actree.make_automaton()
-        return actree
+def _classify_in_worker(question):
+    return _worker_classifier.classify_question(question)
 
 
 class QuestionParser:
@@ -334,7 +528,7 @@ class QuestionParser:
 
         sql_list = []
         for question_type in question_type_list:
-            sql = []
+            sql = None
             # 已知疾病，查询症状
             if question_type == QUESTIONTYPE.DISEASE_TO_SYMPTOM :
                 sql = self.sql_transfer(question_type,entity_dict.get(ENTITYTYPE.DISEASE))
@@ -381,79 +575,19 @@ class QuestionParser:
             sql_dict = {}
             sql_dict['question_type'] = question_type
             if sql:
-                sql_dict['sql'] = sql
+                sql_dict['sql'], sql_dict['params'] = sql
                 sql_list.append(sql_dict)
-            
-            return sql_list
+
+        return sql_list
     
     def sql_transfer(self,question_type,entities):
-        if not entities:
-            return []
-        
-        sql = []
-        #TODO 1 已知疾病查询症状 disease_symptom
-        if question_type == QUESTIONTYPE.DISEASE_TO_SYMPTOM:
-            sql = ["MATCH (m:Disease)-[r:has_symptom]->(n:Symptom) where m.name = '{0}' " \
-				   "return m.name, r.name, n.name".format(i) for i in entities]
-
-		#TODO 2 已知症状判断疾病 symptom_disease
-        elif question_type == QUESTIONTYPE.SYMPTOM_TO_DISEASE:
-            sql = ["MATCH (m:Disease)-[r:has_symptom]->(n:Symptom) where n.name = '{0}' " \
-				   "return m.name, r.name, n.name".format(i) for i in entities]
-
-		#TODO 3 疾病原因 disease_cause
-        elif question_type == QUESTIONTYPE.DISEASE_CAUSE:
-            sql = ["MATCH (m:Disease) where m.name = '{0}' " \
-				   "return m.name, m.cause".format(i) for i in entities]
-
-		#TODO 4 并发症 disease_complication
-        elif question_type == QUESTIONTYPE.DISEASE_COMLICATION:
-            sql = ["MATCH (m:Disease)-[r:acompany_with]->(n:Disease) where m.name = '{0}' " \
-				   "return m.name, r.name, n.name".format(i) for i in entities]
-
-		#TODO 5 已知疾病查忌口食物 disease_avoid_food
-        elif question_type == QUESTIONTYPE.DISEASE_AOID_FOOD:
-            sql = ["MATCH (m:Disease)-[r:no_eat]->(n:Food) where m.name = '{0}' return m.name, r.name, n.name".format(i) for i in entities]
-
-		#TODO 已知疾病查推荐食物  disease_good_food
-        elif question_type == QUESTIONTYPE.DISEASE_GOOD_FOOD:
-            sql1 = ["MATCH (m:Disease)-[r:do_eat]->(n:Food) where m.name = '{0}' return m.name, r.name, n.name".format(i) for i in entities]
-            sql2 = ["MATCH (m:Disease)-[r:recommand_eat]->(n:Food) where m.name = '{0}' return m.name, r.name, n.name".format(i) for i in entities]
-            sql = sql1 + sql2
-
-		#TODO 7 疾病常用药品 disease_drug
-        elif question_type == QUESTIONTYPE.DISEASE_DRUG:
-            sql = ["MATCH (m:Disease)-[r:common_drug]->(n:Drug) where m.name = '{0}' return m.name, r.name, n.name".format(i) for i in entities]
-
-		#TODO 8 疾病检查项目 disease_check
-        elif question_type == QUESTIONTYPE.DISEASE_DO_CHECK :
-            sql = ["MATCH (m:Disease)-[r:need_check]->(n:Check) where m.name = '{0}' return m.name, r.name, n.name".format(i) for i in entities]
-
-		#TODO 11 疾病预防 disease_prevent
-        elif question_type == QUESTIONTYPE.DISEASE_PREVENT:
-            sql = ["MATCH (m:Disease) where m.name = '{0}' return m.name, m.prevent".format(i) for i in entities]
-
-		#TODO 12 疾病治疗方法 disease_treat_way
-        elif question_type == QUESTIONTYPE.DISEASE_TREAT_WAY:
-            sql = ["MATCH (m:Disease) where m.name = '{0}' return m.name, m.cure_way".format(i) for i in entities]
-
-		#TODO 13 疾病治愈可能性 disease_cure_prob
-        elif question_type == QUESTIONTYPE.DISEASE_CURED_PRO:
-            sql = ["MATCH (m:Disease) where m.name = '{0}' return m.name, m.cured_prob".format(i) for i in entities]
-
-		#TODO 14 疾病去哪个科室 disease_department
-        elif question_type == QUESTIONTYPE.DISEASE_TO_DEPARTMENT:
-            sql = ["MATCH (m:Disease)-[r:belongs_to]->(n:Department) where m.name = '{0}' return m.name,r.name,n.name".format(i) for i in entities]
-
-		#TODO 15 疾病治疗周期 disease_treat_cycle
-        elif question_type == QUESTIONTYPE.DISEASE_TREAT_CYCLE:
-            sql = ["MATCH (m:Disease) where m.name = '{0}' return m.name, m.cure_lasttime".format(i) for i in entities]
-
-		# TODO 16 疾病描述 
-        elif question_type == QUESTIONTYPE.DISEASE_DESC:
-            sql = ["MATCH (m:Disease) where m.name = '{0}' return m.name, m.desc".format(i) for i in entities]
-
-        return sql
+        '''
+        :return: (cypher, 参数) 同一问题类型的全部实体通过 UNWIND 合并为一次参数化查询，
+                 实体名不再拼进语句，查询计划可被 Neo4j 缓存复用
+        '''
+        if not entities or question_type not in QUERY_TEMPLATES:
+            return None
+        return QUERY_TEMPLATES[question_type], {'names': list(entities)}
 
     def extract_entity(self,keywords):
         '''
@@ -471,28 +605,188 @@ class QuestionParser:
 
 
 class AnswerSearcher(object):
-    def __init__(self):
-        self.g = Graph(password="0314")
+    def __init__(self, client=None, cache=None):
+        '''
+        :param client: GraphClient，为空时按 GraphConfig（环境变量）连接 Neo4j
+        :param cache: AnswerCache，按 (问题类型, 实体) 缓存查询结果，为空时不缓存
+        '''
+        self.client = client if client is not None else GraphClient.from_config()
+        self.cache = cache
         self.num_limit = 20
 
+    def search_main(self,sql_list,timeout=None):
+        return self.prettify_all(sql_list, self.search_rows(sql_list, timeout))
+
+    def search_rows(self,sql_list,timeout=None):
+        '''
+        :param timeout: 本问句全部查询的截止时间（秒），为空时使用 GraphClient 的默认超时
+        :return: 与 sql_list 对齐的每个问题类型的结果行
+        '''
+        # 一个问句的多个问题类型的查询在连接池上并发执行，结果按 sql_list 的顺序返回；
+        # 一个查询失败（超时、队列已满）时同一问句的其他查询随之取消，不再占用连接
+        rows_list, queries = self.plan_queries(sql_list)
+        results = self.client.run_many([(cypher, params) for _, cypher, params in queries], timeout)
+        return self.merge_answers(sql_list, rows_list, queries, results)
+
+    async def search_main_async(self,sql_list,timeout=None):
+        return self.prettify_all(sql_list, await self.search_rows_async(sql_list, timeout))
+
+    async def search_rows_async(self,sql_list,timeout=None):
+        '''
+        search_rows 的协程版本，供 asyncio 调用方使用，查询同样在 GraphClient 的连接池上并发执行
+        '''
+        rows_list, queries = self.plan_queries(sql_list)
+        tasks = [asyncio.ensure_future(self.client.run_async(cypher, params, timeout)) for _, cypher, params in queries]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # 一个查询失败（超时、队列已满）时取消同一问句的其他查询，不再占用连接
+            for task in tasks:
+                task.cancel()
+            raise
+        return self.merge_answers(sql_list, rows_list, queries, results)
+
+    def plan_queries(self,sql_list):
+        '''
+        :return: (rows_list, queries)
+        rows_list : 每个问题类型已从缓存取得的 实体 -> 结果行
+        queries : [(下标, cypher, 参数)] 需要查询图数据库的部分，只包含缓存未命中的实体
+        '''
+        rows_list = []
+        queries = []
+        for ind, sql_dict in enumerate(sql_list):
+            rows_by_name = {}
+            missing = sql_dict['params']['names']
+            if self.cache is not None:
+                missing = []
+                for name in sql_dict['params']['names']:
+                    rows = self.cache.get((sql_dict['question_type'], name))
+                    if rows is None:
+                        missing.append(name)
+                    else:
+                        rows_by_name[name] = rows
+            if missing:
+                queries.append((ind, sql_dict['sql'], {'names': missing}))
+            rows_list.append(rows_by_name)
+        return rows_list, queries
+
+    def search_batch(self,sql_lists,timeout=None):
+        '''
+        批量查询多个问句，按输入顺序返回每个问句的 final_answers
+        同一问题类型的实体在整批内去重后合并为一个 UNWIND 查询
+        :param sql_lists: 每个问句的 parser_main 结果
+        :param timeout: 全部查询的截止时间（秒），为空时使用 GraphClient 的默认超时
+        '''
+        merged = self.merge_sql_lists(sql_lists)
+        rows_list, queries = self.plan_queries(merged)
+        results = self.client.run_many([(cypher, params) for _, cypher, params in queries], timeout)
+        self.fill_rows(merged, rows_list, queries, results)
+        rows_by_type = {sql_dict['question_type']: rows_by_name for sql_dict, rows_by_name in zip(merged, rows_list)}
+        return [self.prettify_all(sql_list, [self.collect_rows(sql_dict, rows_by_type[sql_dict['question_type']])
+                                             for sql_dict in sql_list])
+                for sql_list in sql_lists]
+
+    def merge_sql_lists(self,sql_lists):
+        '''
+        :return: 每个问题类型一个 sql_dict，names 为整批中该类型的全部实体（去重，保持首次出现的顺序）
+        '''
+        merged = {}
+        for sql_list in sql_lists:
+            for sql_dict in sql_list:
+                question_type = sql_dict['question_type']
+                if question_type not in merged:
+                    merged[question_type] = {'question_type': question_type, 'sql': sql_dict['sql'],
+                                             'params': {'names': []}, 'seen': set()}
+                target = merged[question_type]
+                for name in sql_dict['params']['names']:
+                    if name not in target['seen']:
+                        target['seen'].add(name)
+                        target['params']['names'].append(name)
+        for sql_dict in merged.values():
+            del sql_dict['seen']
+        return list(merged.values())
+
+    def merge_answers(self,sql_list,rows_list,queries,results):
+        '''
+        查询结果按实体拆分并写入缓存，再按实体顺序拼接出每个问题类型的结果行
+        '''
+        self.fill_rows(sql_list, rows_list, queries, results)
+        return [self.collect_rows(sql_dict, rows_by_name) for sql_dict, rows_by_name in zip(sql_list, rows_list)]
+
+    def fill_rows(self,sql_list,rows_list,queries,results):
+        '''
+        查询结果按实体拆分写入 rows_list 并写入缓存
+        '''
+        for (ind, _, params), rows in zip(queries, results):
+            question_type = sql_list[ind]['question_type']
+            key_column = QUERY_KEY_COLUMNS.get(question_type, 'm.name')
+            rows_by_name = rows_list[ind]
+            for name in params['names']:
+                rows_by_name[name] = []
+            for row in rows:
+                rows_by_name.setdefault(row[key_column], []).append(row)
+            if self.cache is not None:
+                for name in params['names']:
+                    self.cache.put((question_type, name), rows_by_name[name])
+
+    def collect_rows(self,sql_dict,rows_by_name):
+        '''
+        按 sql_dict 中实体的顺序拼接结果行
+        '''
+        return [row for name in sql_dict['params']['names'] for row in rows_by_name.get(name, [])]
 
-    def search_main(self,sql_list):
+    def invalidate_cache(self,entities=None):
+        '''
+        图谱重新加载后调用，entities 为空时清空全部缓存
+        '''
+        if self.cache is None:
+            return
+        if entities is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidate_entities(entities)
+
+    def prettify_all(self,sql_list,answers_list):
         final_answers = []
-        for sql_dict in sql_list:
-            question_type = sql_dict['question_type']
-            querys = sql_dict['sql']
-            answers = []
-            for query in querys:
-                ress = self.g.run(query).data()
-                answers += ress
-            final_answer = self.answer_prettify(question_type,answers)
-            if final_answer:
-                final_answers.append(final_answer)
+        with tracing.span('prettify'):
+            for sql_dict, answers in zip(sql_list, answers_list):
+                final_answer = self.answer_prettify(sql_dict['question_type'],answers)
+                if final_answer:
+                    final_answers.append(final_answer)
         return final_answers
 
+    def answer_structured(self, question_type, answers):
+        '''
+        按实体（关系查询再按关系名）分组的结构化回答，每组最多 num_limit 个取值，去重并保持查询结果的顺序
+        :return: [{'entity': 实体, 'relation': 关系名（仅关系查询）, 'values': [相关实体或属性值]}]
+        '''
+        key_column = QUERY_KEY_COLUMNS.get(question_type, 'm.name')
+        value_column = ANSWER_VALUE_COLUMNS.get(question_type, 'n.name')
+        groups = {}
+        for row in answers:
+            values = groups.setdefault((row[key_column], row.get('r.name')), [])
+            value = row[value_column]
+            # 治疗方法等属性本身是列表
+            for item in value if isinstance(value, list) else [value]:
+                if item is not None and len(values) < self.num_limit and item not in values:
+                    values.append(item)
+
+        results = []
+        for (entity, relation), values in groups.items():
+            if not values:
+                continue
+            result = {'entity': entity, 'values': values}
+            if relation is not None:
+                result['relation'] = relation
+            results.append(result)
+        return results
+
     '''根据对应的qustion_type，调用相应的回复模板'''
     def answer_prettify(self, question_type, answers):
         final_answer = []
+        # 属性缺失（null）的结果行不参与回答
+        value_column = ANSWER_VALUE_COLUMNS.get(question_type, 'n.name')
+        answers = [i for i in answers if i.get(value_column) is not None]
         if not answers:
             return ''
         if question_type == QUESTIONTYPE.DISEASE_TO_SYMPTOM:
@@ -576,34 +870,3 @@ class AnswerSearcher(object):
             final_answer = '{0}所属科室为： {1}'.format(subject, '；'.join(list(set(desc))[:self.num_limit]))
 
         return final_answer
-
-class QuestionAnswerSystem(object):
-	def __init__(self):
-		self.classifier = QuestionClassifier()
-		self.question_parser = QuestionParser()
-		self.answer_searcher = AnswerSearcher()
-
-	def question_answer_main(self,question):
-		answer = "非常抱歉，这个问题超出小医的能力范围！"
-		# 问题分类
-		classify_res = self.classifier.classify_main(question)
-		print(classify_res)
-		if not classify_res: # 无法解析问句
-			return answer
-		
-		# 问题解析
-		res_sql = self.question_parser.parser_main(classify_res)
-		print(res_sql)
-		final_answers = self.answer_searcher.search_main(res_sql)
-
-		if not final_answers:
-			return answer
-		else:
-			return '\n'.join(final_answers)
-
-if __name__=="__main__":
-    handler = QuestionAnswerSystem()
-    while True:
-        question = input("用户:")
-        answer = handler.question_answer_main(question)
-        print(answer)
\ No newline at end of file
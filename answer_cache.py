@@ -0,0 +1,125 @@
+# -*- coding:utf-8 -*-
+'''
+查询结果缓存
+
+图谱在两次重建之间是只读的，按 (问题类型, 实体) 缓存图数据库返回的原始结果行（answer_prettify 之前），
+LRU 淘汰，按估算字节数限制容量，并带过期时间。
+'''
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_size(rows):
+    '''
+    估算结果行占用的字节数
+    '''
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row.values():
+            size += sys.getsizeof(value)
+            if isinstance(value, list):
+                size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class AnswerCache(object):
+    '''
+    :param max_bytes: 缓存容量上限（估算字节数）
+    :param ttl: 过期时间（秒），为空时不过期
+    '''
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        # key -> (rows, size, expire_at)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ=None):
+        '''
+        ANSWER_CACHE_BYTES, ANSWER_CACHE_TTL (秒)
+        '''
+        environ = os.environ if environ is None else environ
+        return cls(int(environ.get('ANSWER_CACHE_BYTES', 64 * 1024 * 1024)),
+                   float(environ.get('ANSWER_CACHE_TTL', 3600)))
+
+    def get(self, key):
+        '''
+        :return: 缓存的结果行，未命中返回 None（已缓存的空结果返回 []）
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, rows):
+        size = estimate_size(rows)
+        if size > self.max_bytes:
+            return
+        expire_at = self.clock() + self.ttl if self.ttl else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (rows, size, expire_at)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self._remove(key)
+
+    def invalidate_entities(self, entities):
+        '''
+        删除与给定实体相关的全部缓存（任意问题类型）
+        '''
+        entities = set(entities)
+        with self.lock:
+            for key in [key for key in self.entries if key[1] in entities]:
+                self._remove(key)
+
+    def clear(self):
+        '''
+        图谱重新加载后清空缓存
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        rows, size, _ = self.entries.pop(key)
+        self.size -= size
@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+'''
+对比 / 接口的文本回答与 /answer 接口的结构化回答：平均响应大小与序列化耗时
+
+python benchmarks/bench_answer_format.py [--questions 2000] [--repeat 5]
+'''
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+from synthetic import make_region_words, write_region_dir, make_fake_graph, make_questions
+from answer_cache import AnswerCache
+from graph_client import GraphClient
+from QA_main import QuestionAnswerSystem
+from QuestionClassifier import QuestionClassifier
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def measure(encode, objects, repeat):
+    '''
+    :return: (平均字节数, 平均每个响应的序列化耗时 us)
+    '''
+    size = sum(len(encode(obj)) for obj in objects) / len(objects)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for obj in objects:
+            encode(obj)
+        best = min(best, time.perf_counter() - start)
+    return size, best * 1e6 / len(objects)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=20000)
+    parser.add_argument('--questions', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        words = make_region_words(args.words)
+        write_region_dir(region_dir, words)
+        classifier = QuestionClassifier(region_dir, os.path.join(tmp_dir, 'region_index.pkl'))
+    handler = QuestionAnswerSystem(GraphClient(make_fake_graph(words)), AnswerCache(), classifier)
+    questions = make_questions(words, args.questions)
+
+    legacy = []
+    for question in questions:
+        answer = handler.question_answer_main(question)
+        legacy.append({"statusCode": 200, "answer": answer,
+                       "valid_answer": "false" if answer == "非常抱歉，这个问题超出小医的能力范围！" else "true"})
+    structured = [handler.question_answer_structured(question) for question in questions]
+    with_text = [handler.question_answer_structured(question, render_text=True) for question in questions]
+
+    # flask jsonify 默认 ensure_ascii 且按键排序
+    encoders = [('text / jsonify', lambda obj: json.dumps(obj, sort_keys=True).encode('ascii'), legacy),
+                ('structured / json', lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                 structured)]
+    if orjson is not None:
+        encoders += [('structured / orjson', orjson.dumps, structured),
+                     ('structured+text / orjson', orjson.dumps, with_text)]
+    print('%26s %12s %12s' % ('', 'bytes', 'encode(us)'))
+    for name, encode, objects in encoders:
+        print('%26s %12.0f %12.2f' % ((name,) + measure(encode, objects, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# -*- coding:utf-8 -*-
+'''
+QuestionClassifier.classify_batch 吞吐量随进程数的变化
+
+python benchmarks/bench_batch.py [--words 50000] [--questions 200000] [--processes 1 2 4 8]
+'''
+import argparse
+import os
+import tempfile
+import time
+
+from synthetic import make_region_words, write_region_dir, make_questions
+from QuestionClassifier import QuestionClassifier
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=50000)
+    parser.add_argument('--questions', type=int, default=200000)
+    parser.add_argument('--processes', type=int, nargs='+',
+                        default=sorted(set([1, 2, 4, os.cpu_count() or 1])))
+    parser.add_argument('--chunksize', type=int, default=256)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        words = make_region_words(args.words)
+        write_region_dir(region_dir, words)
+        classifier = QuestionClassifier(region_dir, os.path.join(tmp_dir, 'region_index.pkl'))
+    questions = make_questions(words, args.questions)
+
+    start = time.perf_counter()
+    for question in questions:
+        classifier.classify_main(question)
+    baseline = len(questions) / (time.perf_counter() - start)
+    print('cpu count: %d' % (os.cpu_count() or 1))
+    print('classify_main loop: %.0f q/s' % baseline)
+
+    print('%10s %14s %8s' % ('processes', 'q/s', 'speedup'))
+    for processes in args.processes:
+        start = time.perf_counter()
+        count = sum(1 for _ in classifier.classify_batch(iter(questions), processes, args.chunksize))
+        throughput = count / (time.perf_counter() - start)
+        print('%10d %14.0f %7.2fx' % (processes, throughput, throughput / baseline))
+
+
+if __name__ == '__main__':
+    main()
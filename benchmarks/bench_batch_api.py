@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+'''
+对比 N 次调用 / 接口与一次调用 /batch 接口的耗时，并检查两者回答一致，
+图数据库用固定延迟的内存图模拟，关闭查询结果缓存
+
+python benchmarks/bench_batch_api.py [--questions 500] [--popular 100] [--latency-ms 2]
+'''
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+from synthetic import make_region_words, write_region_dir, make_fake_graph, make_zipf_questions
+from answer_cache import AnswerCache
+from graph_client import GraphClient
+from QA_main import QuestionAnswerSystem
+from QuestionClassifier import QuestionClassifier
+from web_server import create_app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=20000)
+    parser.add_argument('--questions', type=int, default=500)
+    parser.add_argument('--popular', type=int, default=100, help='问句涉及的疾病数，越小重复的查询越多')
+    parser.add_argument('--latency-ms', type=float, default=2)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        words = make_region_words(args.words)
+        write_region_dir(region_dir, words)
+        classifier = QuestionClassifier(region_dir, os.path.join(tmp_dir, 'region_index.pkl'))
+    graph = make_fake_graph(words, args.latency_ms / 1000)
+    handler = QuestionAnswerSystem(GraphClient(graph), AnswerCache(max_bytes=0), classifier)
+    client = create_app(handler).test_client()
+    questions = make_zipf_questions(words, args.questions, args.popular)
+
+    graph.query_count = 0
+    start = time.perf_counter()
+    sequential = [client.post('/', data={'question': question}).get_json()['answer'] for question in questions]
+    sequential_time = time.perf_counter() - start
+    sequential_queries = graph.query_count
+
+    graph.query_count = 0
+    start = time.perf_counter()
+    response = client.post('/batch', json={'questions': questions})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    batch_time = time.perf_counter() - start
+    batch_queries = graph.query_count
+
+    mismatches = sum(1 for line, answer in zip(lines, sequential) if line['answer'] != answer)
+    print('%12s %10s %10s' % ('', 'time(s)', 'queries'))
+    print('%12s %10.3f %10d' % ('sequential', sequential_time, sequential_queries))
+    print('%12s %10.3f %10d' % ('batch', batch_time, batch_queries))
+    print('speed-up: %.1fx, answers: %d, mismatches: %d' % (sequential_time / batch_time, len(lines), mismatches))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# -*- coding:utf-8 -*-
+'''
+突发流量测试：同时发出一批请求，对比图数据库查询队列有无上限时成功请求的延迟与 503 数量，
+图数据库用固定延迟的内存图模拟，关闭查询结果缓存使每个请求都访问图数据库
+
+python benchmarks/bench_burst.py [--bursts 8 32 128 512] [--latency-ms 20] [--pool-size 4] [--max-pending 16]
+'''
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from werkzeug.serving import make_server
+
+from synthetic import make_region_words, write_region_dir, make_fake_graph, make_questions
+from answer_cache import AnswerCache
+from graph_client import GraphClient
+from QA_main import QuestionAnswerSystem
+from QuestionClassifier import QuestionClassifier
+from web_server import create_app
+
+
+def serve(app):
+    '''
+    在子进程中运行服务，避免与压测线程争用 GIL
+    :return: (子进程, 端口)
+    '''
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    server.socket.listen(1024)
+    process = multiprocessing.Process(target=server.serve_forever, daemon=True)
+    process.start()
+    server.socket.close()
+    return process, server.server_port
+
+
+def burst(url, questions, timeout):
+    '''
+    所有请求线程就绪后同时发出
+    :return: [(状态码, 延迟 ms)]
+    '''
+    barrier = threading.Barrier(len(questions))
+    results = [None] * len(questions)
+
+    def send(ind, question):
+        data = urllib.parse.urlencode({'question': question}).encode('utf-8')
+        request = urllib.request.Request(url, data, headers={'X-Request-Timeout': str(timeout)})
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = None
+        results[ind] = (status, (time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=send, args=(ind, question)) for ind, question in enumerate(questions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))] if sorted_values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=5000)
+    parser.add_argument('--bursts', type=int, nargs='+', default=[8, 32, 128, 512])
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--max-pending', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=10, help='每个请求的截止时间（秒）')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        words = make_region_words(args.words)
+        write_region_dir(region_dir, words)
+        classifier = QuestionClassifier(region_dir, os.path.join(tmp_dir, 'region_index.pkl'))
+    graph = make_fake_graph(words, args.latency_ms / 1000)
+    # 只取单一问题类型的问句，使每个请求恰好对应一次图数据库查询
+    questions = [question for question in make_questions(words, max(args.bursts) * 4)
+                 if question.endswith('有什么症状')]
+
+    print('%12s %8s %8s %8s %8s %10s %10s' % ('mode', 'burst', 'ok', '503', '504', 'p50(ms)', 'p99(ms)'))
+    for mode, max_pending in [('unbounded', 0), ('bounded', args.max_pending)]:
+        client = GraphClient(graph, args.pool_size, args.timeout, max_pending)
+        handler = QuestionAnswerSystem(client, AnswerCache(max_bytes=0), classifier)
+        process, port = serve(create_app(handler))
+        url = 'http://127.0.0.1:%d/' % port
+        for size in args.bursts:
+            results = burst(url, [questions[i % len(questions)] for i in range(size)], args.timeout)
+            ok = sorted(latency for status, latency in results if status == 200)
+            statuses = [status for status, _ in results]
+            print('%12s %8d %8d %8d %8d %10.1f %10.1f' % (mode, size, len(ok), statuses.count(503), statuses.count(504),
+                                                          percentile(ok, 0.5), percentile(ok, 0.99)))
+            # 等待上一批排队的查询全部完成
+            time.sleep(1)
+        process.terminate()
+        process.join()
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
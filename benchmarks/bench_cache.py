@@ -0,0 +1,65 @@
+# -*- coding:utf-8 -*-
+'''
+按 Zipf 分布回放问句日志，对比有无查询结果缓存时的命中率与延迟，图数据库用固定延迟的内存图模拟
+
+python benchmarks/bench_cache.py [--questions 20000] [--popular 500] [--latency-ms 2] [--cache-mb 64]
+'''
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from synthetic import make_region_words, write_region_dir, make_fake_graph, make_zipf_questions
+from answer_cache import AnswerCache
+from graph_client import GraphClient
+from QuestionClassifier import QuestionClassifier, QuestionParser, AnswerSearcher
+
+
+def replay(classifier, question_parser, searcher, questions):
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        classify_res = classifier.classify_question(question)
+        if classify_res:
+            searcher.search_main(question_parser.parser_main(classify_res))
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=20000)
+    parser.add_argument('--questions', type=int, default=20000)
+    parser.add_argument('--popular', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=2)
+    parser.add_argument('--cache-mb', type=float, default=64)
+    parser.add_argument('--ttl', type=float, default=3600)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        words = make_region_words(args.words)
+        write_region_dir(region_dir, words)
+        classifier = QuestionClassifier(region_dir, os.path.join(tmp_dir, 'region_index.pkl'))
+    question_parser = QuestionParser()
+    client = GraphClient(make_fake_graph(words, args.latency_ms / 1000))
+    questions = make_zipf_questions(words, args.questions, args.popular)
+
+    cache = AnswerCache(int(args.cache_mb * 1024 * 1024), args.ttl)
+    runs = [('no cache', AnswerSearcher(client)), ('cache', AnswerSearcher(client, cache))]
+    print('%10s %10s %10s %10s %10s' % ('', 'p50(ms)', 'p99(ms)', 'mean(ms)', 'q/s'))
+    for name, searcher in runs:
+        latencies = replay(classifier, question_parser, searcher, questions)
+        print('%10s %10.3f %10.3f %10.3f %10.0f' % (name, percentile(latencies, 0.5), percentile(latencies, 0.99),
+                                                    statistics.mean(latencies), 1000 * len(latencies) / sum(latencies)))
+    print('cache stats:', cache.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# -*- coding:utf-8 -*-
+'''
+问题类型判断对比，并校验两者输出完全一致：
+    legacy : 每个问题类型单独扫描一遍触发词列表
+    actree : 触发词 actree 一次扫描 + QUESTION_RULES
+
+python benchmarks/bench_classify.py [--words 50000] [--questions 20000]
+'''
+import argparse
+import os
+import tempfile
+import time
+
+from synthetic import make_region_words, write_region_dir, make_questions, make_trigger_questions
+from QuestionClassifier import QuestionClassifier, ENTITYTYPE, QUESTIONTYPE
+
+
+def legacy_question_types(classifier, question, types):
+    '''改造前 classify_main 中的问题类型判断'''
+    def check(words):
+        for word in words:
+            if word in question:
+                return True
+        return False
+
+    question_types = []
+    if check(classifier.symptom_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_TO_SYMPTOM)
+    if check(classifier.symptom_qwds) and (ENTITYTYPE.SYMPTOM in types):
+        question_types.append(QUESTIONTYPE.SYMPTOM_TO_DISEASE)
+    if check(classifier.cause_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_CAUSE)
+    if check(classifier.complication_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_COMLICATION)
+    if check(classifier.drug_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_DRUG)
+    if check(classifier.food_qwds) and (ENTITYTYPE.DISEASE in types):
+        if check(classifier.deny_words):
+            question_types.append(QUESTIONTYPE.DISEASE_AOID_FOOD)
+        else:
+            question_types.append(QUESTIONTYPE.DISEASE_GOOD_FOOD)
+    if check(classifier.check_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_DO_CHECK)
+    if check(classifier.prevent_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_PREVENT)
+    if check(classifier.treat_way_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_TREAT_WAY)
+    if check(classifier.treat_cycle_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_TREAT_CYCLE)
+    if check(classifier.cure_prob_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_CURED_PRO)
+    if check(classifier.belong_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_TO_DEPARTMENT)
+    if question_types == [] and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_DESC)
+    if question_types == [] and (ENTITYTYPE.SYMPTOM in types):
+        question_types.append(QUESTIONTYPE.SYMPTOM_TO_DISEASE)
+    return question_types
+
+
+def entity_types(classifier, question):
+    types = set()
+    for _, _, _, word_types in classifier.get_entity_spans(question):
+        types.update(word_types)
+    return types
+
+
+def run(func, cases):
+    for question, types in cases[:100]:
+        func(question, types)
+    start = time.perf_counter()
+    for question, types in cases:
+        func(question, types)
+    return len(cases) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=50000)
+    parser.add_argument('--questions', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        words = make_region_words(args.words)
+        write_region_dir(region_dir, words)
+        classifier = QuestionClassifier(region_dir, os.path.join(tmp_dir, 'region_index.pkl'))
+
+    questions = make_questions(words, args.questions // 2) + \
+        make_trigger_questions(words, classifier.trigger_words, args.questions - args.questions // 2)
+    cases = [(question, entity_types(classifier, question)) for question in questions]
+
+    mismatches = 0
+    for question, types in cases:
+        if legacy_question_types(classifier, question, types) != classifier.classify_question_types(question, types):
+            mismatches += 1
+            print('mismatch:', question)
+    print('regression corpus: %d questions, %d mismatches' % (len(cases), mismatches))
+
+    legacy = run(lambda q, t: legacy_question_types(classifier, q, t), cases)
+    actree = run(classifier.classify_question_types, cases)
+    print('%16s %16s %8s' % ('legacy(q/s)', 'actree(q/s)', 'speedup'))
+    print('%16.0f %16.0f %7.2fx' % (legacy, actree, actree / legacy))
+
+    start = time.perf_counter()
+    for question in questions:
+        classifier.classify_main(question)
+    print('classify_main end to end: %.0f q/s' % (len(questions) / (time.perf_counter() - start)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# -*- coding:utf-8 -*-
+'''
+对比改造前逐条查询、逐条写入的 MedicalGraph.collect_medical 与按批处理的速度（docs/s），
+检查两者写出的记录一致，并用 tracemalloc 给出不同数据量下的内存峰值（原始记录逐条生成、写入端丢弃记录，只看整理过程本身）
+
+原始记录按 data_spider 的格式合成，写入 mongomock
+
+python benchmarks/bench_collect.py [--docs 5000] [--jc 2000] [--batch-size 500]
+'''
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import mongomock
+
+PREPARE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'prepare_data')
+if PREPARE_DIR not in sys.path:
+    sys.path.insert(0, PREPARE_DIR)
+
+from build_data import MedicalGraph
+from synthetic import make_raw_records
+
+CHARS = [chr(c) for c in range(0x4e00, 0x4e00 + 3000)]
+
+
+class SplitCutter:
+    '''代替 max_cut.CutWords：按空格切分'''
+    def max_biward_cut(self, text):
+        return text.split(' ')
+
+
+class LegacyMedicalGraph(MedicalGraph):
+    '''改造前的 collect_medical：每个检查项一次 find_one，每条记录一次写入'''
+    def collect_medical(self, batch_size=None):
+        count = 0
+        for item in self.col.find():
+            if not item['basic_info']['name']:
+                continue
+            jc_names = {url: self.get_inspect(url) for url in item['inspect_info']}
+            self.db['medical'].insert_one(self.build_record(item, jc_names))
+            count += 1
+        return count
+
+    def get_inspect(self, url):
+        res = self.db['jc'].find_one({'url':url})
+        if not res:
+            return ''
+        else:
+            return res['name']
+
+
+class StreamCollection:
+    '''逐条生成原始记录的读取端（mongomock 的游标会先复制整个集合）'''
+    def __init__(self, records):
+        self.records = records
+
+    def find(self, *args, **kwargs):
+        return self.records
+
+
+class SinkCollection:
+    '''只计数、不保存的写入端'''
+    def __init__(self):
+        self.count = 0
+
+    def insert_many(self, documents, ordered=True):
+        self.count += len(documents)
+        return mongomock.results.InsertManyResult([None] * len(documents), True)
+
+
+class StreamDatabase:
+    '''data 与 medical 换成流式的读取端和写入端，jc 仍在 mongomock 中'''
+    def __init__(self, db, records):
+        self.collections = {'data': StreamCollection(records), 'medical': SinkCollection()}
+        self.db = db
+
+    def __getitem__(self, name):
+        return self.collections[name] if name in self.collections else self.db[name]
+
+
+def name(rng, length):
+    return ''.join(rng.choice(CHARS) for _ in range(length))
+
+
+def make_db(docs, jc, seed=0):
+    rng = random.Random(seed)
+    db = mongomock.MongoClient()['medical']
+    jc_urls = ['http://jck.xywy.com/jc_%d.html' % i for i in range(jc)]
+    db['jc'].insert_many([{'url': url, 'name': name(rng, 4), 'html': ''} for url in jc_urls])
+    if docs:
+        db['data'].insert_many(list(make_raw_records(docs, jc_urls, seed)))
+    return db, jc_urls
+
+
+def strip_ids(records):
+    return sorted((sorted((k, repr(v)) for k, v in record.items() if k != '_id') for record in records))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=5000)
+    parser.add_argument('--jc', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    db, jc_urls = make_db(args.docs, args.jc)
+    print('%12s %8s %10s %8s' % ('', 'time(s)', 'docs/s', 'docs'))
+    outputs = {}
+    for label, cls in [('legacy', LegacyMedicalGraph), ('batched', MedicalGraph)]:
+        db['medical'].drop()
+        graph = cls(db=db, stop_words=[], cuter=SplitCutter())
+        start = time.perf_counter()
+        count = graph.collect_medical(args.batch_size)
+        elapsed = time.perf_counter() - start
+        print('%12s %8.2f %10.0f %8d' % (label, elapsed, count / elapsed, count))
+        outputs[label] = strip_ids(db['medical'].find())
+    print('identical output:', outputs['legacy'] == outputs['batched'])
+
+    print('\n%12s %14s' % ('docs', 'peak(MB)'))
+    for docs in [args.docs // 4, args.docs, args.docs * 4]:
+        stream_db = StreamDatabase(db, make_raw_records(docs, jc_urls))
+        graph = MedicalGraph(db=stream_db, stop_words=[], cuter=SplitCutter())
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        graph.collect_medical(args.batch_size)
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        print('%12d %14.1f' % (stream_db['medical'].count, peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
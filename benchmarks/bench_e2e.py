@@ -0,0 +1,192 @@
+# -*- coding:utf-8 -*-
+'''
+端到端基准：合成 10k/100k/1M 词的领域词典和按问题类型生成的问句，依次测量
+    startup_build : 从词表构建并写出索引的 QuestionClassifier 初始化
+    startup_load  : 从索引文件加载的 QuestionClassifier 初始化
+    classify      : QuestionClassifier.classify_main
+    parse         : QuestionParser.parser_main
+    search        : AnswerSearcher.search_main（内存图，不使用查询结果缓存）
+输出各阶段及各问题类型的吞吐、p50/p99 延迟和进程峰值内存，结果写入 JSON，
+用 --compare 与之前提交的结果对比
+
+python benchmarks/bench_e2e.py [--sizes 10000 100000 1000000] [--per-type 500] [--output results.json] [--compare old.json]
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic import make_region_words, write_region_dir, make_fake_graph, make_typed_questions
+from graph_client import GraphClient
+from QuestionClassifier import QuestionClassifier, QuestionParser, AnswerSearcher, ENTITYTYPE
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def peak_rss_mb():
+    # Linux 下 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(latencies):
+    '''
+    :param latencies: 每个问句的耗时（秒）
+    '''
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        'count': len(latencies),
+        'qps': len(latencies) / total if total else 0.0,
+        'p50_us': latencies[len(latencies) // 2] * 1e6,
+        'p99_us': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6,
+        'mean_us': total / len(latencies) * 1e6,
+    }
+
+
+def run_size(size, per_type, degree, graph_diseases=2000):
+    '''
+    在独立进程中执行，使峰值内存只反映该规模
+    '''
+    result = {'size': size}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        index_path = os.path.join(tmp_dir, 'region_index.pkl')
+        words = make_region_words(size)
+        write_region_dir(region_dir, words)
+        del words
+
+        start = time.perf_counter()
+        QuestionClassifier(region_dir, index_path)
+        result['startup_build_s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        classifier = QuestionClassifier(region_dir, index_path)
+        result['startup_load_s'] = time.perf_counter() - start
+        result['rss_after_startup_mb'] = peak_rss_mb()
+
+    words = {entity_type: classifier.entity_index.words_of(entity_type) for entity_type in classifier.entity_index.types}
+    # 内存图只覆盖部分疾病，问句中的疾病与症状都从图中取，使每个查询都有结果
+    diseases = [word for word in words[ENTITYTYPE.DISEASE] if len(classifier.entity_index.lookup(word)) == 1]
+    words[ENTITYTYPE.DISEASE] = diseases[:graph_diseases]
+    graph = make_fake_graph(words, degree=degree, diseases=words[ENTITYTYPE.DISEASE])
+    words[ENTITYTYPE.SYMPTOM] = list(graph.in_edges['has_symptom'])
+    typed_questions = make_typed_questions(words, classifier, per_type)
+    del words
+    question_parser = QuestionParser()
+    searcher = AnswerSearcher(GraphClient(graph))
+
+    stages = {'classify': [], 'parse': [], 'search': [], 'total': []}
+    per_type = {}
+    for question_type, questions in typed_questions.items():
+        latencies = per_type.setdefault(question_type.value, [])
+        for question in questions:
+            start = time.perf_counter()
+            classify_res = classifier.classify_main(question)
+            classified = time.perf_counter()
+            sql_list = question_parser.parser_main(classify_res) if classify_res else []
+            parsed = time.perf_counter()
+            searcher.search_main(sql_list)
+            end = time.perf_counter()
+            stages['classify'].append(classified - start)
+            stages['parse'].append(parsed - classified)
+            stages['search'].append(end - parsed)
+            stages['total'].append(end - start)
+            latencies.append(end - start)
+
+    result['stages'] = {name: summarize(latencies) for name, latencies in stages.items()}
+    result['question_types'] = {name: summarize(latencies) for name, latencies in per_type.items()}
+    result['graph_queries'] = graph.query_count
+    result['peak_rss_mb'] = peak_rss_mb()
+    searcher.client.close()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def flatten(result, prefix=''):
+    '''
+    把一个规模的结果展开为 指标路径 -> 数值，便于对比
+    '''
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and key not in ('size', 'count'):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(baseline, current):
+    print('\n%-44s %14s %14s %8s' % ('metric', 'baseline', 'current', 'ratio'))
+    for size, result in current['results'].items():
+        if size not in baseline['results']:
+            continue
+        old = flatten(baseline['results'][size])
+        new = flatten(result)
+        for key in sorted(new):
+            if key in old and (key.startswith('stages.') or not key.startswith('question_types.')):
+                ratio = new[key] / old[key] if old[key] else float('nan')
+                print('%-44s %14.2f %14.2f %8.2f' % ('%s %s' % (size, key), old[key], new[key], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--per-type', type=int, default=500, help='每个问题类型的问句数')
+    parser.add_argument('--degree', type=int, default=8, help='内存图中每个疾病每种关系的边数')
+    parser.add_argument('--output', help='结果文件，默认 benchmarks/results/e2e-<commit>.json')
+    parser.add_argument('--compare', help='之前的结果文件')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(run_size(args.child, args.per_type, args.degree), sys.stdout)
+        return
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'per_type': args.per_type,
+        'degree': args.degree,
+        'results': {},
+    }
+    print('%10s %10s %10s %10s %10s %10s %10s %10s' % ('size', 'build(s)', 'load(s)', 'qps', 'p50(us)', 'p99(us)',
+                                                       'rss(MB)', 'peak(MB)'))
+    for size in args.sizes:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', str(size),
+                                          '--per-type', str(args.per_type), '--degree', str(args.degree)])
+        result = json.loads(output)
+        report['results'][str(size)] = result
+        total = result['stages']['total']
+        print('%10d %10.2f %10.3f %10.0f %10.1f %10.1f %10.1f %10.1f' % (
+            size, result['startup_build_s'], result['startup_load_s'], total['qps'], total['p50_us'], total['p99_us'],
+            result['rss_after_startup_mb'], result['peak_rss_mb']))
+        for name, stage in result['stages'].items():
+            print('%22s %10.0f %10.1f %10.1f' % (name, stage['qps'], stage['p50_us'], stage['p99_us']))
+
+    output_path = args.output or os.path.join(BENCH_DIR, 'results', 'e2e-%s.json' % commit)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('results saved to', output_path)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
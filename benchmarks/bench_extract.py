@@ -0,0 +1,64 @@
+# -*- coding:utf-8 -*-
+'''
+实体抽取对比：
+    legacy : 收集全部命中后两两做子串判断去掉短实体
+    spans  : get_entity_spans 单趟最左最长匹配
+
+python benchmarks/bench_extract.py [--words 50000] [--questions 2000] [--symptoms 4 12 40]
+'''
+import argparse
+import os
+import tempfile
+import time
+
+from synthetic import make_region_words, write_region_dir, make_questions, make_long_questions
+from QuestionClassifier import QuestionClassifier
+
+
+def legacy_keywords(classifier, question):
+    '''改造前的 get_keyword_from_question'''
+    pool = classifier.entity_index.pool
+    region_words = list(set(pool[item[1]] for item in classifier.region_tree.iter(question)))
+    stop_words = []
+    for wd1 in region_words:
+        for wd2 in region_words:
+            if wd1 in wd2 and wd1 != wd2:
+                stop_words.append(wd1)
+    final_words = [word for word in region_words if word not in stop_words]
+    return {word: list(classifier.entity_index.lookup(word)) for word in final_words}
+
+
+def run(func, questions):
+    for question in questions[:100]:
+        func(question)
+    start = time.perf_counter()
+    for question in questions:
+        func(question)
+    return len(questions) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=50000)
+    parser.add_argument('--questions', type=int, default=2000)
+    parser.add_argument('--symptoms', type=int, nargs='+', default=[4, 12, 40], help='长问句中的症状数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        words = make_region_words(args.words)
+        write_region_dir(region_dir, words)
+        classifier = QuestionClassifier(region_dir, os.path.join(tmp_dir, 'region_index.pkl'))
+
+    corpora = [('short', make_questions(words, args.questions))]
+    for symptoms in args.symptoms:
+        corpora.append(('long-%d' % symptoms, make_long_questions(words, args.questions, symptoms)))
+    print('%8s %16s %16s %8s' % ('corpus', 'legacy(q/s)', 'spans(q/s)', 'speedup'))
+    for name, questions in corpora:
+        legacy = run(lambda q: legacy_keywords(classifier, q), questions)
+        spans = run(classifier.get_keyword_from_question, questions)
+        print('%8s %16.0f %16.0f %7.2fx' % (name, legacy, spans, spans / legacy))
+
+
+if __name__ == '__main__':
+    main()
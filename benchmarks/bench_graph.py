@@ -0,0 +1,163 @@
+# -*- coding:utf-8 -*-
+'''
+build_graph 的装载耗时：合成与线上规模相当的疾病记录（默认 11k 种疾病）写入 mongomock，测量
+    read     : read_graph 读取全部记录并得到节点与关系
+    csv      : write_csv 写出 neo4j-admin import 的 CSV
+    per-node : 改造前的做法，每个节点、每条关系一条语句
+    unwind   : load_cypher，UNWIND ... MERGE 每批 --batch-size 行一条语句
+    increment: 修改 --changed 比例的疾病记录、增删少量疾病后 update_incremental，只写入差异
+没有 Neo4j 时两种写入方式用只计数的 runner 执行，按 --rtt-ms 估算每条语句一次往返的耗时；
+加 --neo4j-scratch 时真正写入 NEO4J_URI 指向的库（会先清空该库，只能用于测试库）。
+最后把图装入 FakeGraphBackend，用问答系统的查询模板核对一部分疾病的答案
+
+python benchmarks/bench_graph.py [--diseases 11000] [--batch-size 1000] [--rtt-ms 1] [--changed 0.01] [--neo4j-scratch]
+'''
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import mongomock
+
+from synthetic import make_disease_records, modify_disease_records
+from graph_client import FakeGraphBackend
+from QuestionClassifier import QUERY_TEMPLATES, QUESTIONTYPE
+
+PREPARE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'prepare_data')
+if PREPARE_DIR not in sys.path:
+    sys.path.insert(0, PREPARE_DIR)
+
+from build_graph import (LABELS, read_graph, read_records, build_graph, write_csv, write_region_words, load_cypher,
+                         connect_graph, save_state, load_state, update_incremental)
+
+
+class CountingRunner:
+    '''只计数、不执行的 run(cypher, params)'''
+    def __init__(self):
+        self.statements = 0
+
+    def __call__(self, cypher, params):
+        self.statements += 1
+
+
+def load_per_node(run, graph):
+    '''改造前的做法：每个节点、每条关系一条语句'''
+    for label in LABELS:
+        for row in graph.node_rows(label):
+            run('MERGE (n:%s {name: $name}) SET n += $props' % label, {'name': row['name'], 'props': row})
+    for (src_label, rel_type, dst_label, rel_name) in graph.edges:
+        cypher = ('MATCH (m:%s {name: $src}), (n:%s {name: $dst}) MERGE (m)-[r:%s]->(n) SET r.name = $name'
+                  % (src_label, dst_label, rel_type))
+        for src, dst in graph.edge_rows((src_label, rel_type, dst_label, rel_name)):
+            run(cypher, {'src': src, 'dst': dst, 'name': rel_name})
+
+
+def timed(label, load, rtt, statements=None):
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    statements = statements() if statements else 0
+    print('%10s %10.2f %12d %14.1f' % (label, elapsed, statements, elapsed + statements * rtt))
+    return result
+
+
+def check_answers(graph, records, count=200):
+    '''
+    用问答系统的查询模板在 FakeGraphBackend 上核对 count 种疾病的答案
+    :return: 不一致的查询数
+    '''
+    backend = FakeGraphBackend()
+    graph.feed(backend)
+    diseases = set(record['name'] for record in records)
+    expected = {
+        QUESTIONTYPE.DISEASE_TO_SYMPTOM: lambda record: set(record['symptom']),
+        QUESTIONTYPE.DISEASE_COMLICATION: lambda record: set(record['acompany']) & diseases,
+        QUESTIONTYPE.DISEASE_DRUG: lambda record: set(record['common_drug']),
+        QUESTIONTYPE.DISEASE_AOID_FOOD: lambda record: set(record['not_eat']),
+        QUESTIONTYPE.DISEASE_GOOD_FOOD: lambda record: set(record['do_eat']) | set(record['recommand_eat']),
+        QUESTIONTYPE.DISEASE_DO_CHECK: lambda record: set(record['check']),
+        QUESTIONTYPE.DISEASE_TO_DEPARTMENT: lambda record: {record['cure_department'][-1]},
+        QUESTIONTYPE.DISEASE_CAUSE: lambda record: {record['cause']},
+        QUESTIONTYPE.DISEASE_DESC: lambda record: {record['desc']},
+    }
+    mismatches = 0
+    for record in records[:count]:
+        for question_type, answer in expected.items():
+            rows = backend.run(QUERY_TEMPLATES[question_type], {'names': [record['name']]})
+            values = set(value for row in rows for key, value in row.items() if key not in ('m.name', 'r.name'))
+            mismatches += values != answer(record)
+    return mismatches
+
+
+def check_diff(old, new, diff):
+    '''
+    :return: 旧图加上差异是否等于新图
+    '''
+    for label in LABELS:
+        names = (old.nodes[label].keys() - set(diff.removed_nodes[label])) | set(diff.added_nodes[label])
+        if names != new.nodes[label].keys():
+            return False
+        if any(old.nodes[label][name] == new.nodes[label][name] for name in diff.changed_nodes[label]):
+            return False
+    return all((old.edges[relation] - set(diff.removed_edges[relation])) | set(diff.added_edges[relation])
+               == new.edges[relation] for relation in new.edges)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--diseases', type=int, default=11000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--rtt-ms', type=float, default=1.0, help='没有 Neo4j 时每条语句估算的往返耗时')
+    parser.add_argument('--changed', type=float, default=0.01, help='增量更新前修改的疾病比例')
+    parser.add_argument('--neo4j-scratch', action='store_true', help='写入 NEO4J_URI 指向的测试库（会先清空）')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    records = make_disease_records(args.diseases)
+    db = mongomock.MongoClient()['medical']
+    db['medical'].insert_many([dict(record) for record in records])
+    rtt = 0 if args.neo4j_scratch else args.rtt_ms / 1000
+
+    print('%10s %10s %12s %14s' % ('', 'time(s)', 'statements', 'estimated(s)'))
+    graph = timed('read', lambda: read_graph(db['medical']), 0)
+    print('%10s %s' % ('', graph.counts()))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        timed('csv', lambda: write_csv(graph, os.path.join(tmp_dir, 'csv')), 0)
+        timed('words', lambda: write_region_words(graph, os.path.join(tmp_dir, 'region_words')), 0)
+
+    if args.neo4j_scratch:
+        neo4j = connect_graph()
+        for label, load in [('per-node', lambda run: load_per_node(run, graph)),
+                            ('unwind', lambda run: load_cypher(run, graph, args.batch_size))]:
+            neo4j.run('MATCH (n) DETACH DELETE n')
+            timed(label, lambda: load(neo4j.run), 0)
+    else:
+        runner = CountingRunner()
+        timed('per-node', lambda: load_per_node(runner, graph), rtt, lambda: runner.statements)
+        runner = CountingRunner()
+        timed('unwind', lambda: load_cypher(runner, graph, args.batch_size), rtt, lambda: runner.statements)
+
+    print('mismatched answers:', check_answers(graph, records))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_path = os.path.join(tmp_dir, 'graph_state.pkl')
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        old_records = read_records(db['medical'])
+        save_state(state_path, old_records)
+        modify_disease_records(db, records, args.changed)
+        runner = neo4j.run if args.neo4j_scratch else CountingRunner()
+        start = time.perf_counter()
+        new_records = read_records(db['medical'])
+        diff = update_incremental(new_records, load_state(state_path), runner, region_dir, args.batch_size)
+        elapsed = time.perf_counter() - start
+        statements = 0 if args.neo4j_scratch else runner.statements
+        print('%10s %10.2f %12d %14.1f' % ('increment', elapsed, statements, elapsed + statements * rtt))
+        print('%10s %s, %d changed entities, region files rewritten: %s' % (
+            '', diff.counts(), len(diff.changed_entities()), diff.changed_labels()))
+        print('diff matches rebuilt graph:', check_diff(build_graph(old_records), diff.new, diff))
+
+
+if __name__ == '__main__':
+    main()
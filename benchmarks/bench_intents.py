@@ -0,0 +1,60 @@
+# -*- coding:utf-8 -*-
+'''
+多意图问句的端到端延迟随问题类型数的变化，图数据库用固定延迟的替身模拟
+    sequential : 连接池大小为 1，逐个查询
+    concurrent : 连接池大小为 16，并发查询
+
+python benchmarks/bench_intents.py [--latency-ms 20] [--repeat 20]
+'''
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from synthetic import make_region_words, write_region_dir, make_fake_graph
+from graph_client import GraphClient
+from QuestionClassifier import QuestionClassifier, QuestionParser, AnswerSearcher, QUESTION_RULES
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        words = make_region_words(1000)
+        write_region_dir(region_dir, words)
+        classifier = QuestionClassifier(region_dir, os.path.join(tmp_dir, 'region_index.pkl'))
+    question_parser = QuestionParser()
+    graph = make_fake_graph(words, args.latency_ms / 1000)
+    searchers = [('sequential', AnswerSearcher(GraphClient(graph, pool_size=1))),
+                 ('concurrent', AnswerSearcher(GraphClient(graph, pool_size=16)))]
+
+    # 每个疾病类规则取一个触发词，逐个叠加得到 1..N 个意图的问句
+    disease = words[QUESTION_RULES[0][1]][-1]
+    triggers = []
+    for category, _, _, _ in QUESTION_RULES:
+        word = classifier.trigger_words[category][0]
+        if category != 'symptom' or not triggers:
+            triggers.append(word)
+
+    print('%8s %16s %16s' % ('intents', 'sequential(ms)', 'concurrent(ms)'))
+    for count in range(1, len(triggers) + 1):
+        question = disease + '，'.join(triggers[:count])
+        sql_list = question_parser.parser_main(classifier.classify_main(question))
+        row = [len(sql_list)]
+        for _, searcher in searchers:
+            latencies = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                searcher.search_main(sql_list)
+                latencies.append((time.perf_counter() - start) * 1000)
+            row.append(statistics.median(latencies))
+        print('%8d %16.1f %16.1f' % tuple(row))
+
+
+if __name__ == '__main__':
+    main()
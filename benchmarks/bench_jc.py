@@ -0,0 +1,108 @@
+# -*- coding:utf-8 -*-
+'''
+对比改造前逐条解析、逐条 update 的 MedicalGraph.modify_jc 与按批并行解析、bulk_write 写回的速度，
+并检查重跑时跳过未变化的页面；检查项页面为合成的大页面，写入 mongomock
+
+    legacy   : 改造前的流程
+    workers=N: modify_jc(workers=N)
+    rerun    : 页面都未变化时重跑
+    changed  : 修改一部分页面后重跑
+
+python benchmarks/bench_jc.py [--pages 2000] [--page-kb 60] [--workers 1 4] [--changed 0.1]
+'''
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+import mongomock
+from lxml import etree
+
+PREPARE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'prepare_data')
+if PREPARE_DIR not in sys.path:
+    sys.path.insert(0, PREPARE_DIR)
+
+from build_data import MedicalGraph
+from mongomock_compat import BulkCompatDatabase
+
+CHARS = [chr(c) for c in range(0x4e00, 0x4e00 + 3000)]
+
+
+class LegacyMedicalGraph(MedicalGraph):
+    '''改造前的 modify_jc'''
+    def modify_jc(self, workers=None, batch_size=None):
+        count = 0
+        for item in self.db['jc'].find():
+            url = item['url']
+            content = item['html']
+            selector = etree.HTML(content)
+            name = selector.xpath('//title/text()')[0].split('结果分析')[0]
+            desc = selector.xpath('//meta[@name="description"]/@content')[0].replace('\r\n\t','')
+            self.db['jc'].update_one({'url':url}, {'$set':{'name':name, 'desc':desc}})
+            count += 1
+        return {'parsed': count}
+
+
+def name(rng, length):
+    return ''.join(rng.choice(CHARS) for _ in range(length))
+
+
+def make_page(rng, page_kb):
+    paragraph = '<div class="item"><p>%s</p><a href="/jc_%d.html">%s</a></div>' % (name(rng, 40), rng.randint(1, 3000),
+                                                                                 name(rng, 4))
+    body = paragraph * max(1, page_kb * 1024 // len(paragraph.encode('utf-8')))
+    return ('<html><head><title>%s结果分析</title><meta name="description" content="%s\r\n\t">'
+            '</head><body>%s</body></html>' % (name(rng, 4), name(rng, 40), body))
+
+
+def run(label, graph):
+    start = time.perf_counter()
+    result = graph.modify_jc(graph.workers, 100)
+    elapsed = time.perf_counter() - start
+    print('%12s %8.2f %10.0f %8d %8d %8d' % (label, elapsed, result['parsed'] / elapsed, result['parsed'],
+                                            result.get('skipped', 0), result.get('failed', 0)))
+
+
+def snapshot(db):
+    return sorted((item['url'], item['name'], item['desc']) for item in db['jc'].find({}, {'url': 1, 'name': 1, 'desc': 1}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--page-kb', type=int, default=60)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--changed', type=float, default=0.1, help='重跑前修改的页面比例')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rng = random.Random(0)
+    pages = [{'url': 'http://jck.xywy.com/jc_%d.html' % i, 'html': make_page(rng, args.page_kb)} for i in range(args.pages)]
+    print('%d pages, %.0fKB each, %d cpus' % (args.pages, args.page_kb, os.cpu_count()))
+    print('%12s %8s %10s %8s %8s %8s' % ('', 'time(s)', 'pages/s', 'parsed', 'skipped', 'failed'))
+
+    db = mongomock.MongoClient()['medical']
+    db['jc'].insert_many([dict(page) for page in pages])
+    graph = LegacyMedicalGraph(db=db, stop_words=[])
+    graph.workers = None
+    run('legacy', graph)
+    expected = snapshot(db)
+
+    for workers in args.workers:
+        db = mongomock.MongoClient()['medical']
+        db['jc'].insert_many([dict(page) for page in pages])
+        graph = MedicalGraph(db=BulkCompatDatabase(db), stop_words=[])
+        graph.workers = workers
+        run('workers=%d' % workers, graph)
+        print('%12s identical output: %s' % ('', snapshot(db) == expected))
+
+    run('rerun', graph)
+    for page in rng.sample(pages, int(args.pages * args.changed)):
+        db['jc'].update_one({'url': page['url']}, {'$set': {'html': make_page(rng, args.page_kb)}})
+    run('changed', graph)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+'''
+QuestionClassifier 的领域词典占用的内存：在独立进程中加载预编译索引，统计加载前后的 RSS 之差，
+并给出索引文件大小与每个问句的分类耗时
+
+python benchmarks/bench_memory.py [--sizes 100000] [--questions 5000]
+'''
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic import make_region_words, write_region_dir, make_questions
+from QuestionClassifier import QuestionClassifier
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE / 1024 / 1024
+
+
+def child(region_dir, index_path, questions_path):
+    with open(questions_path, encoding='utf-8') as f:
+        questions = f.read().split('\n')
+    gc.collect()
+    before = rss_mb()
+    classifier = QuestionClassifier(region_dir, index_path)
+    gc.collect()
+    after = rss_mb()
+    for question in questions[:200]:
+        classifier.classify_main(question)
+    start = time.perf_counter()
+    for question in questions:
+        classifier.classify_main(question)
+    elapsed = time.perf_counter() - start
+    return {'rss_mb': after - before, 'classify_us': elapsed / len(questions) * 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000])
+    parser.add_argument('--questions', type=int, default=5000)
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(child(*args.child), sys.stdout)
+        return
+
+    print('%10s %12s %12s %14s' % ('words', 'rss(MB)', 'index(MB)', 'classify(us)'))
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            region_dir = os.path.join(tmp_dir, 'region_words')
+            index_path = os.path.join(tmp_dir, 'region_index.pkl')
+            questions_path = os.path.join(tmp_dir, 'questions.txt')
+            words = make_region_words(size)
+            write_region_dir(region_dir, words)
+            with open(questions_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(make_questions(words, args.questions)))
+            del words
+            # 先在本进程中构建索引文件，子进程只测加载
+            QuestionClassifier(region_dir, index_path)
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                              '--child', region_dir, index_path, questions_path])
+            result = json.loads(output)
+            print('%10d %12.1f %12.1f %14.2f' % (size, result['rss_mb'], os.path.getsize(index_path) / 1024 / 1024,
+                                                 result['classify_us']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding:utf-8 -*-
+'''
+领域词典热更新时对处理中请求的影响：一个线程持续执行 classify_main，另一个线程更新词典，
+统计更新期间相邻两次分类完成的最长间隔（即请求被阻塞的最长时间）、更新耗时以及进程内存（更新前、更新中峰值、更新后）
+
+    thread : 在本进程的线程中重建索引（make_automaton 持有 GIL）
+    reload : QuestionClassifier.reload，子进程重建，本进程读入索引文件
+    add    : QuestionClassifier.update_words 加入一个新词（子进程重建 actree）
+    retype : update_words 给已有词增加一个类型（沿用 actree）
+
+python benchmarks/bench_reload.py [--words 100000] [--questions 2000]
+'''
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from synthetic import make_region_words, write_region_dir, make_questions
+from QuestionClassifier import QuestionClassifier, ENTITYTYPE, REGION_TYPES
+from region_index import RegionState, build_region_index
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE / 1024 / 1024
+
+
+class Prober(threading.Thread):
+    '''
+    不停地对问句做分类，记录相邻两次完成的间隔与内存
+    '''
+    def __init__(self, classifier, questions):
+        threading.Thread.__init__(self, daemon=True)
+        self.classifier = classifier
+        self.questions = questions
+        self.running = True
+        self.gaps = []
+        self.peak_rss = 0
+
+    def run(self):
+        ind = 0
+        last = time.perf_counter()
+        while self.running:
+            self.classifier.classify_main(self.questions[ind % len(self.questions)])
+            now = time.perf_counter()
+            self.gaps.append(now - last)
+            last = now
+            ind += 1
+            if ind % 100 == 0:
+                self.peak_rss = max(self.peak_rss, rss_mb())
+            # 模拟请求之间的等待，让出 GIL
+            time.sleep(0.0005)
+
+
+def rebuild_in_thread(classifier):
+    classifier.region = RegionState(build_region_index(classifier.region_dir, classifier.region_files), REGION_TYPES)
+
+
+def measure(classifier, questions, name, update):
+    before = rss_mb()
+    prober = Prober(classifier, questions)
+    prober.start()
+    time.sleep(0.2)
+    prober.gaps = []
+    start = time.perf_counter()
+    update()
+    elapsed = time.perf_counter() - start
+    # 更新很快时也至少记录到更新后的一次间隔
+    time.sleep(0.05)
+    prober.running = False
+    prober.join()
+    gaps = sorted(prober.gaps)
+    print('%8s %10.2f %10.1f %10.1f %10.1f %10.1f %10.1f' % (
+        name, elapsed, gaps[len(gaps) // 2] * 1e3, gaps[-1] * 1e3,
+        before, max(prober.peak_rss, rss_mb()), rss_mb()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=100000)
+    parser.add_argument('--questions', type=int, default=2000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        region_dir = os.path.join(tmp_dir, 'region_words')
+        words = make_region_words(args.words)
+        write_region_dir(region_dir, words)
+        classifier = QuestionClassifier(region_dir, os.path.join(tmp_dir, 'region_index.pkl'))
+        questions = make_questions(words, args.questions)
+        existing = words[ENTITYTYPE.DISEASE][-1]
+        del words
+
+        print('%8s %10s %10s %10s %10s %10s %10s' % ('', 'time(s)', 'p50(ms)', 'stall(ms)', 'rss0(MB)', 'peak(MB)',
+                                                     'rss1(MB)'))
+        measure(classifier, questions, 'thread', lambda: rebuild_in_thread(classifier))
+        with open(os.path.join(region_dir, 'drugs.txt'), 'a', encoding='utf-8') as f:
+            f.write('热更新测试药\n')
+        measure(classifier, questions, 'reload', classifier.reload)
+        measure(classifier, questions, 'add',
+                lambda: classifier.update_words(add={ENTITYTYPE.DISEASE: ['热更新测试病']}, persist=False))
+        measure(classifier, questions, 'retype',
+                lambda: classifier.update_words(add={ENTITYTYPE.SYMPTOM: [existing]}, persist=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# -*- coding:utf-8 -*-
+'''
+图谱快照：导出合成图谱，逐个问题类型校验快照与内存图的结果一致，并对比查询延迟
+
+python benchmarks/bench_snapshot.py [--words 20000] [--latency-ms 1] [--queries 5000]
+'''
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from synthetic import make_region_words, make_fake_graph
+from graph_snapshot import SnapshotBackend, export_snapshot, compare_backends, template_names
+from QuestionClassifier import QUERY_TEMPLATES
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=20000)
+    parser.add_argument('--latency-ms', type=float, default=1)
+    parser.add_argument('--queries', type=int, default=5000)
+    args = parser.parse_args()
+
+    words = make_region_words(args.words)
+    graph = make_fake_graph(words)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'graph_snapshot.bin')
+        start = time.perf_counter()
+        export_snapshot(graph, path, QUERY_TEMPLATES.values())
+        print('export: %.2fs, %.1f MB' % (time.perf_counter() - start, os.path.getsize(path) / 1024 / 1024))
+
+        start = time.perf_counter()
+        snapshot = SnapshotBackend(path)
+        print('open: %.2f ms' % ((time.perf_counter() - start) * 1000))
+
+        names = template_names(graph, QUERY_TEMPLATES)
+        mismatches = compare_backends(graph, snapshot, QUERY_TEMPLATES, names)
+        print('parity: %d question types, %s' % (len(QUERY_TEMPLATES),
+                                               'all match' if not mismatches else 'mismatches %s' % mismatches))
+
+        rng = random.Random(0)
+        queries = [(cypher, {'names': rng.sample(names[question_type], 1)})
+                   for question_type, cypher in rng.choices(list(QUERY_TEMPLATES.items()), k=args.queries)]
+        graph.latency = args.latency_ms / 1000
+        print('%28s %12s' % ('backend', 'ms/query'))
+        for name, backend in (('memory graph + %.1fms rtt' % args.latency_ms, graph), ('snapshot', snapshot)):
+            start = time.perf_counter()
+            for cypher, params in queries:
+                backend.run(cypher, params)
+            print('%28s %12.4f' % (name, (time.perf_counter() - start) * 1000 / len(queries)))
+        snapshot.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# -*- coding:utf-8 -*-
+'''
+对比改造前逐个 urllib 请求的采集与 CrimeSpider 并发采集的速度，并检查断点续爬和失败重试，
+页面由本地测试服务器（spider_fixture.py）提供，数据写入 mongomock
+
+    legacy     : 改造前的流程，单线程，每个请求新建连接，不重试
+    concurrent : CrimeSpider.spider_main，线程池 + 连接复用
+    resume     : 先抓一半页面，再用同一检查点抓全部，第二次只请求剩余页面
+    faults     : 服务端随机返回 503，靠重试全部完成
+    recrawl    : 在 concurrent 的结果上 recrawl，页面都未变化，全部为 304
+    changed    : 修改 --changed 比例页面的症状子页面后 recrawl，只有这些页面被解析和写入
+    hash-only  : 服务端不返回 ETag / Last-Modified，靠内容哈希跳过解析和写入（仍下载全部内容）
+
+python benchmarks/bench_spider.py [--pages 200] [--latency-ms 20] [--workers 8] [--error-rate 0.05] [--changed 0.1]
+'''
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+import mongomock
+
+from spider_fixture import generate_pages, start_server, change_pages
+
+PREPARE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'prepare_data')
+if PREPARE_DIR not in sys.path:
+    sys.path.insert(0, PREPARE_DIR)
+
+from data_spider import CrimeSpider, PAGE_SECTIONS
+
+
+class LegacySpider(CrimeSpider):
+    '''改造前的 get_html、crawl_page 与 spider_main'''
+    def get_html(self, url):
+        headers = {'User-Agent': 'Mozilla/5.0'}
+        req = urllib.request.Request(url=url, headers=headers)
+        res = urllib.request.urlopen(req)
+        return res.read().decode('gbk')
+
+    def crawl_page(self, page):
+        urls = self.page_urls(page)
+        data = {'url': urls['gaishu']}
+        for name, field, parser in PAGE_SECTIONS:
+            data[field] = getattr(self, parser)(self.get_html(urls[name]))
+        self.col.replace_one({'url': data['url']}, data, upsert=True)
+
+    def spider_main(self, start=1, end=11000, checkpoint_path=None):
+        done = 0
+        for page in range(start, end):
+            try:
+                self.crawl_page(page)
+                done += 1
+            except Exception:
+                pass
+        return {'done': done}
+
+
+def run(name, server, spider, pages, checkpoint_path=None):
+    for key in server.stats:
+        server.stats[key] = 0
+    start = time.perf_counter()
+    result = spider.spider_main(1, pages + 1, checkpoint_path)
+    elapsed = time.perf_counter() - start
+    print('%12s %8.2f %10.1f %8d %9d %8d %8d %8d %8d %8d %10.0f' % (
+        name, elapsed, (result['done'] + result.get('unchanged', 0)) / elapsed, result['done'],
+        result.get('unchanged', 0), result.get('failed', 0), result.get('skipped', 0), server.stats['requests'],
+        server.stats['not_modified'], server.stats['connections'], server.stats['bytes'] / 1024))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--legacy-pages', type=int, default=40, help='legacy 只抓前若干页')
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--changed', type=float, default=0.1, help='recrawl 前修改的页面比例')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = os.path.join(tmp_dir, 'pages')
+        server, base_url = start_server(root, args.latency_ms / 1000)
+        written = generate_pages(root, args.pages, jc_url=base_url)
+        print('%d pages (%d missing), %.0fms latency per request' % (args.pages, args.pages - len(written),
+                                                                      args.latency_ms))
+        print('%12s %8s %10s %8s %9s %8s %8s %8s %8s %8s %10s' % (
+            '', 'time(s)', 'pages/s', 'done', 'unchanged', 'failed', 'skipped', 'requests', '304', 'conns', 'KB'))
+
+        db = mongomock.MongoClient()['medical']
+        run('legacy', server, LegacySpider(base_url, db=db, rate=0), args.legacy_pages)
+
+        crawled_db = mongomock.MongoClient()['medical']
+        run('concurrent', server, CrimeSpider(base_url, db=crawled_db, workers=args.workers, rate=0), args.pages)
+
+        db = mongomock.MongoClient()['medical']
+        checkpoint_path = os.path.join(tmp_dir, 'spider.checkpoint')
+        spider = CrimeSpider(base_url, db=db, workers=args.workers, rate=0)
+        run('resume-1/2', server, spider, args.pages // 2, checkpoint_path)
+        run('resume-all', server, spider, args.pages, checkpoint_path)
+        print('%12s documents: %d, expected: %d' % ('', db['data'].count_documents({}), len(written)))
+
+        db = mongomock.MongoClient()['medical']
+        server.error_rate = args.error_rate
+        spider = CrimeSpider(base_url, db=db, workers=args.workers, rate=0, backoff=0.05)
+        run('faults', server, spider, args.pages)
+        print('%12s documents: %d, expected: %d, retries: %d, injected errors: %d' % (
+            '', db['data'].count_documents({}), len(written), spider.fetcher.stats['retries'], server.stats['errors']))
+
+        server.error_rate = 0
+        spider = CrimeSpider(base_url, db=crawled_db, workers=args.workers, rate=0, recrawl=True)
+        run('recrawl', server, spider, args.pages)
+        changed = change_pages(root, written, args.changed)
+        run('changed', server, spider, args.pages)
+        symptoms = crawled_db['data'].find_one({'url': spider.page_urls(changed[0])['gaishu']})['symptom_info'][0]
+        with open(os.path.join(root, 'il_sii', 'symptom', '%d.htm' % changed[0]), encoding='gbk') as f:
+            html = f.read()
+        print('%12s changed pages: %d, updated: %s' % ('', len(changed), all(symptom in html for symptom in symptoms)))
+        server.conditional = False
+        run('hash-only', server, spider, args.pages)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
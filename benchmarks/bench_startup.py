@@ -0,0 +1,74 @@
+# -*- coding:utf-8 -*-
+'''
+QuestionClassifier 启动耗时对比：
+    legacy : 逐个读词表，每加一个词调用一次 make_automaton，列表扫描构建实体类型字典
+    build  : 预编译索引缺失/过期时的重建路径
+    load   : 直接加载预编译索引
+
+python benchmarks/bench_startup.py [--sizes 1000 5000 50000]
+'''
+import argparse
+import os
+import tempfile
+import time
+
+import ahocorasick
+
+from synthetic import make_region_words, write_region_dir
+from QuestionClassifier import QuestionClassifier, REGION_FILES
+
+
+def legacy_startup(region_dir):
+    '''改造前 QuestionClassifier.__init__ 的词典加载流程'''
+    word_lists = []
+    for _, file_name in REGION_FILES:
+        path = os.path.join(region_dir, file_name)
+        word_lists.append([word.strip() for word in open(path, encoding='utf-8') if word.strip()])
+    region_words = set(word for words in word_lists for word in words)
+    actree = ahocorasick.Automaton()
+    for ind, word in enumerate(region_words):
+        actree.add_word(word, (ind, word))
+        actree.make_automaton()
+    word_dict = {}
+    for word in region_words:
+        word_dict[word] = [entity_type for (entity_type, _), words in zip(REGION_FILES, word_lists) if word in words]
+    return actree, word_dict
+
+
+def timeit(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 50000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--legacy-limit', type=int, default=5000, help='超过该词数不跑 legacy（二次复杂度）')
+    args = parser.parse_args()
+
+    print('%10s %12s %12s %12s' % ('words', 'legacy(s)', 'build(s)', 'load(s)'))
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            region_dir = os.path.join(tmp_dir, 'region_words')
+            index_path = os.path.join(tmp_dir, 'region_index.pkl')
+            write_region_dir(region_dir, make_region_words(size))
+
+            legacy = timeit(lambda: legacy_startup(region_dir), 1) if size <= args.legacy_limit else float('nan')
+
+            def build():
+                if os.path.exists(index_path):
+                    os.remove(index_path)
+                QuestionClassifier(region_dir, index_path)
+
+            build_time = timeit(build, args.repeat)
+            load_time = timeit(lambda: QuestionClassifier(region_dir, index_path), args.repeat)
+            print('%10d %12.4f %12.4f %12.4f' % (size, legacy, build_time, load_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+'''
+问答服务压测：并发发送问句，统计 req/s 与延迟，并读取各 worker 进程的内存占用
+
+    gunicorn -c gunicorn.conf.py "web_server:create_app()" &
+    python benchmarks/load_test.py --url http://127.0.0.1:5000/ --master-pid <gunicorn master pid>
+
+RSS 为进程常驻内存（共享页重复计算），PSS 把共享页按共享进程数均摊，更能反映写时复制的效果
+'''
+import argparse
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from synthetic import QUESTION_TEMPLATES
+
+
+def worker_pids(master_pid):
+    pids = []
+    task_dir = '/proc/%d/task' % master_pid
+    for task in os.listdir(task_dir):
+        with open(os.path.join(task_dir, task, 'children')) as f:
+            pids += [int(pid) for pid in f.read().split()]
+    return pids
+
+
+def memory_kb(pid):
+    '''
+    :return: (rss, pss) 单位 KB
+    '''
+    rss = pss = 0
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+    try:
+        with open('/proc/%d/smaps_rollup' % pid) as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    pss = int(line.split()[1])
+    except OSError:
+        pass
+    return rss, pss
+
+
+def run(url, questions, concurrency, duration):
+    latencies = []
+    # 状态码（连接失败为异常类名）-> 次数
+    errors = {}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def loop(seed):
+        rng = random.Random(seed)
+        while time.time() < deadline:
+            data = urllib.parse.urlencode({'question': rng.choice(questions)}).encode('utf-8')
+            start = time.perf_counter()
+            error = None
+            try:
+                with urllib.request.urlopen(url, data, timeout=30) as response:
+                    response.read()
+            except urllib.error.HTTPError as e:
+                error = e.code
+            except Exception as e:
+                error = type(e).__name__
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if error is None:
+                    latencies.append(elapsed)
+                else:
+                    errors[error] = errors.get(error, 0) + 1
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5000/')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--entities', nargs='+', default=['感冒', '糖尿病', '高血压', '肺炎', '头痛'],
+                        help='问句中使用的实体，需在服务加载的词典中')
+    parser.add_argument('--master-pid', type=int, help='gunicorn master 进程号，用于统计各 worker 内存')
+    args = parser.parse_args()
+
+    questions = [template.format(entity, entity, entity) for template in QUESTION_TEMPLATES for entity in args.entities]
+    latencies, errors = run(args.url, questions, args.concurrency, args.duration)
+    if latencies:
+        print('requests: %d, errors: %d, %.0f req/s' % (len(latencies), sum(errors.values()),
+                                                       len(latencies) / args.duration))
+        print('latency p50 %.1f ms, p99 %.1f ms' % (latencies[len(latencies) // 2],
+                                                   latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]))
+    else:
+        print('no successful requests')
+    if errors:
+        print('errors:', errors)
+
+    if args.master_pid:
+        pids = [args.master_pid] + worker_pids(args.master_pid)
+        print('%10s %12s %12s' % ('pid', 'rss(MB)', 'pss(MB)'))
+        for pid in pids:
+            rss, pss = memory_kb(pid)
+            print('%10d %12.1f %12.1f%s' % (pid, rss / 1024, pss / 1024, '  (master)' if pid == args.master_pid else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+# -*- coding:utf-8 -*-
+'''
+让 build_data 的批量写入可以在 mongomock 上运行，供 benchmarks 下的脚本和 tests 使用
+'''
+from pymongo.results import BulkWriteResult
+
+
+class BulkCompatCollection:
+    '''
+    mongomock 4.3 的 bulk_write 不接受 pymongo 4.9 以后的 UpdateOne（多了 sort 参数），这里逐条执行
+    '''
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, attr):
+        return getattr(self.collection, attr)
+
+    def bulk_write(self, requests, ordered=True):
+        matched = sum(self.collection.update_one(request._filter, request._doc).matched_count for request in requests)
+        return BulkWriteResult({'nMatched': matched, 'nModified': matched}, True)
+
+
+class BulkCompatDatabase:
+    def __init__(self, db):
+        self.db = db
+
+    def __getitem__(self, name):
+        return BulkCompatCollection(self.db[name])
@@ -0,0 +1,221 @@
+# -*- coding:utf-8 -*-
+'''
+data_spider.CrimeSpider 的本地测试服务器：以 GBK 编码返回 root 目录下保存的 HTML 页面，
+目录结构与线上一致（il_sii/gaishu/1.htm ... il_sii/drug/1.htm, jc_1.html），可模拟延迟、随机 503、
+指定路径的错误状态码和重定向；
+响应带 ETag（内容的 md5）和 Last-Modified（文件修改时间），支持 If-None-Match / If-Modified-Since 条件请求（返回 304）
+
+生成合成页面并启动服务：
+    python benchmarks/spider_fixture.py --root /tmp/pages --generate 200 [--port 8000] [--latency-ms 20]
+然后：
+    python prepare_data/data_spider.py --base-url http://127.0.0.1:8000 --jc-url http://127.0.0.1:8000 --end 201
+'''
+import argparse
+import email.utils
+import hashlib
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECTIONS = ['gaishu', 'cause', 'prevent', 'symptom', 'inspect', 'treat', 'food', 'drug']
+CHARS = '肺炎胃溃疡头痛发热咳嗽腹泻贫血哮喘湿疹痛风肝硬化肾结石糖尿病高血压冠心骨折鼻窦中耳'
+
+
+def make_name(rng, length):
+    return ''.join(rng.choice(CHARS) for _ in range(length))
+
+
+def render_pages(page, rng, jc_url):
+    '''
+    :return: 子页面名 -> HTML，结构与 CrimeSpider 各解析方法使用的 xpath 对应
+    '''
+    name = make_name(rng, 3)
+    paragraphs = ''.join('<p>%s</p>' % make_name(rng, 30) for _ in range(5))
+    attributes = ''.join('<p>%s：%s</p>' % (key, make_name(rng, 4))
+                         for key in ['医保疾病', '患病比例', '易感人群', '传染方式', '就诊科室', '治疗方式', '治疗周期', '治愈率'])
+    foods = ''.join('<div class="diet-img clearfix mt20"><div><p>%s</p><p>%s</p></div></div>'
+                    % (make_name(rng, 2), make_name(rng, 2)) for _ in range(3))
+    return {
+        'gaishu': '<title>%s的简介</title><div class="wrap mt10 nav-bar"><a>疾病百科</a><a>内科</a></div>'
+                  '<div class="jib-articl-con jib-lh-articl"><p>%s</p></div><div class="mt20 articl-know">%s</div>'
+                  % (name, make_name(rng, 60), attributes),
+        'cause': paragraphs,
+        'prevent': paragraphs,
+        'symptom': ''.join('<a class="gre" >%s</a>' % make_name(rng, 3) for _ in range(6)) + paragraphs,
+        'inspect': ''.join('<li class="check-item"><a href="%s/jc_%d.html">x</a></li>' % (jc_url, rng.randint(1, 50))
+                           for _ in range(3)),
+        'treat': '<div class="mt20 articl-know">%s</div>' % paragraphs,
+        'food': foods,
+        'drug': ''.join('<div class="fl drug-pic-rec mr30"><p><a>%s</a></p></div>' % make_name(rng, 4) for _ in range(4)),
+    }
+
+
+def generate_pages(root, pages, missing=0.05, jc_pages=50, jc_url='http://jck.xywy.com', seed=0):
+    '''
+    写入 1..pages 的合成页面，其中约 missing 比例的页面 ID 不生成（请求时返回 404）
+    :return: 生成的页面 ID 列表
+    '''
+    rng = random.Random(seed)
+    written = []
+    for section in SECTIONS:
+        os.makedirs(os.path.join(root, 'il_sii', section), exist_ok=True)
+    for page in range(1, pages + 1):
+        if rng.random() < missing:
+            continue
+        for section, body in render_pages(page, rng, jc_url).items():
+            write_html(os.path.join(root, 'il_sii', section, '%d.htm' % page), body)
+        written.append(page)
+    for page in range(1, jc_pages + 1):
+        name = make_name(rng, 4)
+        write_html(os.path.join(root, 'jc_%d.html' % page),
+                   '<title>%s结果分析</title><meta name="description" content="%s">' % (name, make_name(rng, 40)))
+    return written
+
+
+def write_html(path, body):
+    with open(path, 'w', encoding='gbk') as f:
+        f.write('<html><head><meta charset="gbk"></head><body>%s</body></html>' % body)
+
+
+def change_pages(root, pages, ratio, seed=1):
+    '''
+    改写 ratio 比例页面的症状子页面，修改时间推后 2 秒
+    :return: 被修改的页面 ID
+    '''
+    rng = random.Random(seed)
+    changed = sorted(rng.sample(pages, int(len(pages) * ratio)))
+    for page in changed:
+        path = os.path.join(root, 'il_sii', 'symptom', '%d.htm' % page)
+        write_html(path, ''.join('<a class="gre" >%s</a>' % make_name(rng, 3) for _ in range(6)))
+        mtime = os.path.getmtime(path) + 2
+        os.utime(path, (mtime, mtime))
+    return changed
+
+
+class FixtureServer(ThreadingHTTPServer):
+    '''
+    :param latency: 每个请求的延迟（秒）
+    :param error_rate: 随机返回 503 的比例
+    :param conditional: 为 False 时不返回 ETag / Last-Modified，也不处理条件请求
+    faults: 路径 -> 依次返回的错误状态码列表，用完后正常返回
+    redirects: 路径 -> (状态码, Location)
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, root, latency=0.0, error_rate=0.0, seed=0, conditional=True):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.conditional = conditional
+        self.rng = random.Random(seed)
+        self.faults = {}
+        self.redirects = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'connections': 0, 'errors': 0, 'not_found': 0, 'not_modified': 0, 'bytes': 0}
+        ThreadingHTTPServer.__init__(self, address, FixtureHandler)
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def inject_error(self, path):
+        '''
+        :return: 要返回的错误状态码，不出错时为 None
+        '''
+        with self.lock:
+            if self.faults.get(path):
+                return self.faults[path].pop(0)
+            if self.rng.random() < self.error_rate:
+                return 503
+        return None
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 默认保持连接，客户端可以复用
+    protocol_version = 'HTTP/1.1'
+    # 响应头与响应体分两次写出，保持连接时 Nagle 算法与客户端的延迟确认叠加会使每个请求多等约 40ms
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.count('connections')
+
+    def do_GET(self):
+        self.server.count('requests')
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url_path = self.path.split('?')[0]
+        status = self.server.inject_error(url_path)
+        if status:
+            self.server.count('errors')
+            return self.reply(status, b'')
+        if url_path in self.server.redirects:
+            status, location = self.server.redirects[url_path]
+            return self.reply(status, b'', {'Location': location})
+        path = os.path.normpath(os.path.join(self.server.root, url_path.lstrip('/')))
+        if not path.startswith(self.server.root) or not os.path.isfile(path):
+            self.server.count('not_found')
+            return self.reply(404, b'')
+        with open(path, 'rb') as f:
+            body = f.read()
+        if not self.server.conditional:
+            return self.reply(200, body)
+        headers = {'ETag': '"%s"' % hashlib.md5(body).hexdigest(),
+                   'Last-Modified': email.utils.formatdate(int(os.path.getmtime(path)), usegmt=True)}
+        if self.not_modified(headers):
+            self.server.count('not_modified')
+            return self.reply(304, b'', headers)
+        self.reply(200, body, headers)
+
+    def not_modified(self, headers):
+        if 'If-None-Match' in self.headers:
+            return self.headers['If-None-Match'] == headers['ETag']
+        since = self.headers.get('If-Modified-Since')
+        if since:
+            try:
+                return email.utils.parsedate_to_datetime(since) >= email.utils.parsedate_to_datetime(headers['Last-Modified'])
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=gbk')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count('bytes', len(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(root, latency=0.0, error_rate=0.0, port=0, conditional=True):
+    '''
+    在后台线程中启动服务
+    :return: (server, base_url)
+    '''
+    server = FixtureServer(('127.0.0.1', port), root, latency, error_rate, conditional=conditional)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', required=True, help='保存的页面目录')
+    parser.add_argument('--generate', type=int, default=0, help='先生成指定数量的合成页面')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    args = parser.parse_args()
+
+    base_url = 'http://127.0.0.1:%d' % args.port
+    if args.generate:
+        generate_pages(args.root, args.generate, jc_url=base_url)
+    server = FixtureServer(('127.0.0.1', args.port), args.root, args.latency_ms / 1000, args.error_rate)
+    print('serving %s on %s' % (args.root, base_url))
+    server.serve_forever()
@@ -0,0 +1,270 @@
+# -*- coding:utf-8 -*-
+'''
+合成领域词典、问句与疾病记录，供 benchmarks 下的脚本和 tests 使用
+'''
+import os
+import random
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from QuestionClassifier import REGION_FILES, ENTITYTYPE
+from graph_client import FakeGraphBackend
+
+# 常用汉字区间，用来拼合成实体词
+_CHARS = [chr(c) for c in range(0x4e00, 0x4e00 + 3000)]
+
+# 各实体类型占词典的比例
+_TYPE_RATIO = {
+    ENTITYTYPE.DISEASE: 0.25,
+    ENTITYTYPE.SYMPTOM: 0.25,
+    ENTITYTYPE.DRUG: 0.25,
+    ENTITYTYPE.FOOD: 0.12,
+    ENTITYTYPE.CHECK: 0.12,
+    ENTITYTYPE.DEPARTMENT: 0.01,
+}
+
+# data_spider 抓取的疾病属性（basic_info.attributes）
+RAW_ATTRIBUTES = ['医保疾病', '患病比例', '易感人群', '传染方式', '就诊科室', '治疗方式', '治疗周期', '治愈率', '常用药品',
+                  '治疗费用', '并发症']
+
+DENY_WORDS = ['不', '没', '别', '勿', '忌', '不要', '不能', '不可以', '禁止', '避免']
+
+QUESTION_TEMPLATES = [
+    '{0}有什么症状', '{0}是什么原因引起的', '{0}的并发症有哪些', '{0}吃什么药好',
+    '{0}不能吃什么', '{0}吃什么好', '{0}要做哪些检查', '{0}怎么预防',
+    '{0}怎么治疗', '{0}治疗周期多久', '{0}能治好吗，治愈几率多大', '{0}挂什么科室',
+    '{0}', '最近总是{1}是怎么回事', '{1}和{2}是什么症状',
+]
+
+
+def random_word(rng, min_len=2, max_len=6):
+    return ''.join(rng.choice(_CHARS) for _ in range(rng.randint(min_len, max_len)))
+
+
+def make_region_words(size, seed=0, overlap=0.02, nested=0.3):
+    '''
+    :param size: 词典总词数
+    :param overlap: 同时属于疾病和症状的词所占比例
+    :param nested: 由同类已有词加前缀构成的词所占比例（如 头痛 / 剧烈头痛）
+    :return: 实体类型 -> 词列表
+    '''
+    rng = random.Random(seed)
+    words = {entity_type: [] for entity_type, _ in REGION_FILES}
+    seen = set()
+    for entity_type, ratio in _TYPE_RATIO.items():
+        target = max(1, int(size * ratio))
+        while len(words[entity_type]) < target:
+            if words[entity_type] and rng.random() < nested:
+                word = random_word(rng, 1, 3) + rng.choice(words[entity_type])
+            else:
+                word = random_word(rng)
+            if word not in seen:
+                seen.add(word)
+                words[entity_type].append(word)
+    shared = words[ENTITYTYPE.DISEASE][:int(size * overlap)]
+    words[ENTITYTYPE.SYMPTOM].extend(shared)
+    return words
+
+
+def write_region_dir(region_dir, words):
+    os.makedirs(region_dir, exist_ok=True)
+    for entity_type, file_name in REGION_FILES:
+        with open(os.path.join(region_dir, file_name), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(words[entity_type]) + '\n')
+    with open(os.path.join(region_dir, 'deny.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(DENY_WORDS) + '\n')
+
+
+def make_questions(words, count, seed=1):
+    rng = random.Random(seed)
+    diseases = words[ENTITYTYPE.DISEASE]
+    symptoms = words[ENTITYTYPE.SYMPTOM]
+    questions = []
+    for _ in range(count):
+        template = rng.choice(QUESTION_TEMPLATES)
+        questions.append(template.format(rng.choice(diseases), rng.choice(symptoms), rng.choice(symptoms)))
+    return questions
+
+
+def make_long_questions(words, count, symptoms_per_question=12, seed=2):
+    '''
+    症状描述较多的长问句，模拟用户一次性描述病情
+    '''
+    rng = random.Random(seed)
+    diseases = words[ENTITYTYPE.DISEASE]
+    symptoms = words[ENTITYTYPE.SYMPTOM]
+    fillers = ['最近', '经常', '有点', '晚上', '而且', '还会', '偶尔', '一直']
+    questions = []
+    for _ in range(count):
+        parts = [rng.choice(fillers) + rng.choice(symptoms) for _ in range(symptoms_per_question)]
+        questions.append('，'.join(parts) + '，是不是得了' + rng.choice(diseases) + '，该怎么治疗')
+    return questions
+
+
+def make_trigger_questions(words, trigger_words, count, seed=3):
+    '''
+    实体 + 随机触发词/否定词组合的问句，覆盖各问题类型及其组合
+    :param trigger_words: 类别 -> 触发词列表，见 QuestionClassifier.trigger_words
+    '''
+    rng = random.Random(seed)
+    entities = words[ENTITYTYPE.DISEASE] + words[ENTITYTYPE.SYMPTOM] + words[ENTITYTYPE.DRUG]
+    triggers = [word for category_words in trigger_words.values() for word in category_words]
+    questions = []
+    for _ in range(count):
+        parts = [rng.choice(entities) for _ in range(rng.randint(1, 2))]
+        parts += [rng.choice(triggers) for _ in range(rng.randint(0, 3))]
+        rng.shuffle(parts)
+        questions.append('的'.join(parts))
+    return questions
+
+
+def make_fake_graph(words, latency=0.0, degree=8, seed=4, diseases=None):
+    '''
+    按词典生成内存图：每个疾病带文本属性，并随机连接症状、药品、食物、检查、科室和并发症
+    :param diseases: 只为这些疾病建图（大词典下只覆盖问句用到的疾病），为空时为全部疾病建图
+    '''
+    rng = random.Random(seed)
+    graph = FakeGraphBackend(latency)
+    # (关系类型, 关系名, 终点标签, 终点实体类型)
+    relations = [
+        ('has_symptom', '症状', 'Symptom', ENTITYTYPE.SYMPTOM),
+        ('acompany_with', '并发症', 'Disease', ENTITYTYPE.DISEASE),
+        ('common_drug', '常用药品', 'Drug', ENTITYTYPE.DRUG),
+        ('no_eat', '忌吃', 'Food', ENTITYTYPE.FOOD),
+        ('do_eat', '宜吃', 'Food', ENTITYTYPE.FOOD),
+        ('recommand_eat', '推荐食谱', 'Food', ENTITYTYPE.FOOD),
+        ('need_check', '诊断检查', 'Check', ENTITYTYPE.CHECK),
+        ('belongs_to', '所属科室', 'Department', ENTITYTYPE.DEPARTMENT),
+    ]
+    for disease in words[ENTITYTYPE.DISEASE] if diseases is None else diseases:
+        graph.add_node('Disease', disease, desc=disease + '的简介', cause=disease + '的成因',
+                       prevent=disease + '的预防措施', cure_way=['药物治疗', '手术治疗'],
+                       cured_prob='85%', cure_lasttime='1-2个月')
+        for rel_type, rel_name, dst_label, dst_type in relations:
+            for dst in rng.sample(words[dst_type], min(degree, len(words[dst_type]))):
+                graph.add_edge('Disease', disease, rel_type, rel_name, dst_label, dst)
+    return graph
+
+
+def make_zipf_questions(words, count, popular=500, exponent=1.1, seed=5):
+    '''
+    疾病热度服从 Zipf 分布的问句日志
+    :param popular: 参与采样的疾病数（按热度排序）
+    '''
+    rng = random.Random(seed)
+    diseases = words[ENTITYTYPE.DISEASE][-popular:]
+    weights = [1.0 / (rank ** exponent) for rank in range(1, len(diseases) + 1)]
+    templates = QUESTION_TEMPLATES[:13]
+    questions = []
+    for disease in rng.choices(diseases, weights, k=count):
+        questions.append(rng.choice(templates).format(disease))
+    return questions
+
+
+def make_typed_questions(words, classifier, count, seed=6):
+    '''
+    按问题类型生成问句：对应类型的实体 + 只属于该类别的触发词（忌口问句再加否定词），疾病描述问句只有实体
+    :param classifier: QuestionClassifier，提供触发词，并用于排除同时命中多个类别的触发词
+    :return: 问题类型 -> 问句列表
+    '''
+    from QuestionClassifier import QUESTION_RULES, QUESTIONTYPE
+
+    rng = random.Random(seed)
+    entities = {entity_type: [word for word in type_words if len(classifier.entity_index.lookup(word)) == 1]
+                for entity_type, type_words in words.items()}
+    questions = {}
+    for category, entity_type, question_type, deny_question_type in QUESTION_RULES:
+        triggers = [word for word in classifier.trigger_words[category]
+                    if classifier.get_trigger_categories(word) == {category}]
+        # (问题类型, 否定词)
+        variants = [(question_type, [])]
+        if deny_question_type is not None:
+            variants.append((deny_question_type, [word for word in classifier.deny_words
+                                                  if classifier.get_trigger_categories(word) == {'deny'}]))
+        for target_type, deny_words in variants:
+            typed = questions.setdefault(target_type, [])
+            for _ in range(count):
+                prefix = rng.choice(deny_words) if deny_words else ''
+                typed.append(rng.choice(entities[entity_type]) + prefix + rng.choice(triggers))
+    questions[QUESTIONTYPE.DISEASE_DESC] = [rng.choice(entities[ENTITYTYPE.DISEASE]) for _ in range(count)]
+    return questions
+
+
+def make_disease_records(diseases, seed=0):
+    '''
+    与 build_data.MedicalGraph.build_record 输出格式相同的疾病记录，各类实体数与每种疾病的关系数接近线上数据
+    '''
+    rng = random.Random(seed)
+
+    def pool(size):
+        return list({random_word(rng, 2, 6) for _ in range(size)})
+
+    names = pool(diseases)
+    symptoms, drugs, foods, checks = pool(6000), pool(3800), pool(4900), pool(3300)
+    departments = [[big] + [random_word(rng, 3, 5) for _ in range(6)] for big in pool(8)]
+    records = []
+    for name in names:
+        group = rng.choice(departments)
+        records.append({
+            'name': name,
+            'desc': random_word(rng, 80, 200),
+            'cause': random_word(rng, 80, 200),
+            'prevent': random_word(rng, 80, 200),
+            'easy_get': random_word(rng, 4, 10),
+            'cure_lasttime': random_word(rng, 2, 4),
+            'cured_prob': random_word(rng, 2, 4),
+            'cure_department': [group[0], rng.choice(group[1:])] if rng.random() < 0.7 else [group[0]],
+            'cure_way': rng.sample(['药物治疗', '手术治疗', '支持性治疗', '康复治疗'], 2),
+            'symptom': rng.sample(symptoms, rng.randint(3, 8)),
+            'acompany': rng.sample(names, rng.randint(0, 3)),
+            'common_drug': rng.sample(drugs, rng.randint(0, 4)),
+            'not_eat': rng.sample(foods, 4),
+            'do_eat': rng.sample(foods, 4),
+            'recommand_eat': rng.sample(foods, 6),
+            'check': rng.sample(checks, rng.randint(1, 6)),
+        })
+    return records
+
+
+def modify_disease_records(db, records, changed, seed=1):
+    '''
+    修改 changed 比例的记录的症状和简介，删除与新增各 20 种疾病
+    '''
+    rng = random.Random(seed)
+    symptoms = sorted(set(symptom for record in records for symptom in record['symptom']))
+    for record in rng.sample(records, int(len(records) * changed)):
+        db['medical'].update_one({'name': record['name']}, {'$set': {
+            'symptom': record['symptom'][1:] + [rng.choice(symptoms)], 'desc': random_word(rng, 80, 200)}})
+    for record in records[-20:]:
+        db['medical'].delete_one({'name': record['name']})
+    added = make_disease_records(20, seed=seed)
+    db['medical'].insert_many([dict(record, name=record['name'] + '新') for record in added])
+
+
+def make_raw_records(docs, jc_urls, seed=0):
+    '''
+    按 data_spider 写入 medical.data 的格式逐条生成原始记录
+    :param jc_urls: 检查项页面 url，每条记录引用其中 3 个，每 50 条中有一条另外引用不存在的检查项
+    '''
+    rng = random.Random(seed)
+
+    def name(length):
+        return random_word(rng, length, length)
+
+    for i in range(docs):
+        attributes = ['%s：%s' % (key, ' '.join(name(3) for _ in range(3))) for key in RAW_ATTRIBUTES]
+        yield {
+            'url': 'http://jib.xywy.com/il_sii/gaishu/%d.htm' % i,
+            'basic_info': {'name': name(3), 'desc': [name(60)], 'category': ['疾病百科', '内科'],
+                           'attributes': attributes},
+            'cause_info': name(100),
+            'prevent_info': name(100),
+            'symptom_info': [[name(3) for _ in range(6)], [name(30)]],
+            'inspect_info': rng.sample(jc_urls, 3) + (['http://jck.xywy.com/jc_missing.html'] if i % 50 == 0 else []),
+            'treat_info': [name(10)],
+            'food_info': {'good': [name(2)], 'bad': [name(2)], 'recommand': [name(4)]},
+            'drug_info': ['%s(%s)' % (name(4), name(4)) for _ in range(4)],
+        }
@@ -0,0 +1,83 @@
+# -*- coding:utf-8 -*-
+'''
+多个 worker 进程共享的变更日志
+
+管理接口的请求只由一个 worker 处理：该 worker 在本进程应用变更后，把变更作为一行 JSON 追加到日志文件；
+其他 worker 在处理请求前检查文件是否变长，读出新增的行各自应用（见 web_server.apply_changes）。
+因此管理接口返回后，任何 worker 处理的请求都不会再读到已失效的缓存。
+
+日志只追加，可以在服务停止时删除；被截断后从头读起（重复应用失效缓存或 reload 没有副作用）。
+'''
+import fcntl
+import json
+import logging
+import os
+import threading
+
+
+class ChangeFeed(object):
+    '''
+    :param path: 日志文件，同一服务的各 worker 必须使用同一个文件
+    创建时从文件末尾开始读（此前的变更已反映在启动时加载的词典中，缓存也是空的）；
+    gunicorn 的 worker 继承 master 中创建时的位置，重启的 worker 会重放 master 启动以来的全部变更
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offset = self.size()
+
+    @property
+    def source(self):
+        '''
+        写入者标识，读到自己写入的变更时跳过（已在写入前应用）；fork 出的 worker 各不相同
+        '''
+        return '%d-%x' % (os.getpid(), id(self))
+
+    def size(self):
+        try:
+            return os.stat(self.path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, change):
+        '''
+        :param change: 可 JSON 序列化的 dict
+        '''
+        line = (json.dumps(dict(change, source=self.source), ensure_ascii=False) + '\n').encode('utf-8')
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'ab') as f:
+            # 一次写入整行，加锁避免多个 worker 同时写入时交错
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line)
+
+    def poll(self):
+        '''
+        :return: 上次 poll 以来其他写入者追加的变更，按写入顺序；没有变化时只有一次 stat
+        '''
+        if self.size() == self.offset:
+            return []
+        with self.lock:
+            size = self.size()
+            if size < self.offset:
+                logging.warning('change log %s was truncated, reading from the start', self.path)
+                self.offset = 0
+            if size == self.offset:
+                return []
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read(size - self.offset)
+            # 最后一行可能还没写完，留到下次
+            end = data.rfind(b'\n') + 1
+            self.offset += end
+        changes = []
+        for line in data[:end].splitlines():
+            try:
+                change = json.loads(line)
+            except ValueError:
+                logging.warning('skipping malformed line in change log %s', self.path)
+                continue
+            if change.pop('source', None) != self.source:
+                changes.append(change)
+        return changes
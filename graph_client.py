@@ -0,0 +1,318 @@
+# -*- coding:utf-8 -*-
+'''
+图数据库连接层
+
+GraphClient 在固定大小的线程池上执行查询：线程数即同时占用的连接数上限，
+排队中与执行中的查询总数受 max_pending 限制，超出时立即抛出 GraphBusy 而不是无限排队；
+每个查询带超时，一次提交的多个查询共用同一个截止时间；截止时间同时传给后端，
+在排队中过期的查询不再执行，已在执行的查询由数据库按事务超时终止，不会在调用方放弃等待后继续占用连接。
+具体的数据库由后端实现：
+    Neo4jBackend     : neo4j 官方驱动（未安装时退回 py2neo）连接 Neo4j
+    SnapshotBackend  : 读取离线导出的图谱快照，见 graph_snapshot.py
+    FakeGraphBackend : 进程内的内存图，用于在没有数据库的环境下测试整个查询链路
+'''
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import tracing
+from tracing import COUNTERS
+
+
+class GraphTimeout(Exception):
+    '''查询超时'''
+
+
+class GraphBusy(Exception):
+    '''查询队列已满'''
+
+
+class GraphConfig(object):
+    '''
+    图数据库配置，未指定的项从环境变量读取：
+        GRAPH_BACKEND (neo4j | snapshot), GRAPH_SNAPSHOT (快照路径)
+        NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD, NEO4J_POOL_SIZE, NEO4J_TIMEOUT (秒)
+        NEO4J_MAX_PENDING (排队与执行中的查询数上限，默认为 pool_size 的 4 倍，0 表示不限)
+    '''
+    def __init__(self, uri=None, user=None, password=None, pool_size=None, timeout=None,
+                 backend=None, snapshot_path=None, max_pending=None, environ=None):
+        environ = os.environ if environ is None else environ
+        self.backend = backend or environ.get('GRAPH_BACKEND', 'neo4j')
+        self.snapshot_path = snapshot_path or environ.get('GRAPH_SNAPSHOT', 'data/graph_snapshot.bin')
+        self.uri = uri or environ.get('NEO4J_URI', 'bolt://localhost:7687')
+        self.user = user or environ.get('NEO4J_USER', 'neo4j')
+        self.password = password or environ.get('NEO4J_PASSWORD', '0314')
+        self.pool_size = int(environ.get('NEO4J_POOL_SIZE', 8) if pool_size is None else pool_size)
+        self.timeout = float(environ.get('NEO4J_TIMEOUT', 5) if timeout is None else timeout)
+        if max_pending is None:
+            max_pending = environ.get('NEO4J_MAX_PENDING', self.pool_size * 4)
+        self.max_pending = int(max_pending)
+
+
+class Neo4jBackend(object):
+    '''
+    优先使用 neo4j 官方驱动，查询的剩余时间作为事务超时发给服务端；
+    py2neo 不支持事务超时，退回 py2neo 时超时的查询仍会执行到结束
+    '''
+    def __init__(self, config):
+        # 只有真正连接 Neo4j 时才需要驱动
+        try:
+            import neo4j
+        except ImportError:
+            neo4j = None
+        self.neo4j = neo4j
+        if neo4j is not None:
+            self.driver = neo4j.GraphDatabase.driver(config.uri, auth=(config.user, config.password),
+                                                     max_connection_pool_size=config.pool_size)
+        else:
+            logging.warning('neo4j driver not installed, falling back to py2neo without server-side query timeouts')
+            from py2neo import Graph
+            self.graph = Graph(config.uri, auth=(config.user, config.password), max_size=config.pool_size)
+
+    def run(self, cypher, params, timeout=None):
+        '''
+        :param timeout: 事务超时（秒），为空时使用服务端的 db.transaction.timeout
+        :raise GraphTimeout: 服务端因超时终止了查询
+        '''
+        if self.neo4j is None:
+            return self.graph.run(cypher, params).data()
+        try:
+            with self.driver.session() as session:
+                return session.run(self.neo4j.Query(cypher, timeout=timeout), params).data()
+        except self.neo4j.exceptions.ClientError as e:
+            if (e.code or '').startswith('Neo.ClientError.Transaction.TransactionTimedOut'):
+                raise GraphTimeout('graph query timed out on the server')
+            raise
+
+
+class GraphClient(object):
+    '''
+    :param max_pending: 排队与执行中的查询数上限，为 0 时不限
+    '''
+    def __init__(self, backend, pool_size=8, timeout=5.0, max_pending=0):
+        self.backend = backend
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.slots = threading.BoundedSemaphore(max_pending) if max_pending else None
+        # 排队与执行中的查询数、正在执行的查询数，用于监控连接池占用
+        self.pending = 0
+        self.active = 0
+        self.count_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='graph')
+
+    @classmethod
+    def from_config(cls, config=None):
+        config = config or GraphConfig()
+        if config.backend == 'snapshot':
+            from graph_snapshot import SnapshotBackend
+            backend = SnapshotBackend(config.snapshot_path)
+        elif config.backend == 'neo4j':
+            backend = Neo4jBackend(config)
+        else:
+            raise ValueError('unknown graph backend: %s' % config.backend)
+        return cls(backend, config.pool_size, config.timeout, config.max_pending)
+
+    def submit(self, cypher, params=None, timeout=None):
+        '''
+        :param timeout: 查询的截止时间（秒），为空时为 self.timeout；排队超过截止时间的查询不再执行，
+                        执行中的查询以剩余时间作为后端的超时
+        :raise GraphBusy: 排队的查询已达 max_pending
+        '''
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        if self.slots is not None and not self.slots.acquire(blocking=False):
+            COUNTERS.incr('graph_busy')
+            raise GraphBusy('graph query queue is full')
+        with self.count_lock:
+            self.pending += 1
+        try:
+            # 查询在线程池中执行，追踪需要显式传入
+            future = self.executor.submit(self.execute, tracing.current(), cypher, params or {}, deadline)
+        except BaseException:
+            self.release()
+            raise
+        # 查询完成或被取消时归还名额
+        future.add_done_callback(self.release)
+        return future
+
+    def release(self, future=None):
+        with self.count_lock:
+            self.pending -= 1
+        if self.slots is not None:
+            self.slots.release()
+
+    def execute(self, trace, cypher, params, deadline=None):
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            # 调用方已经放弃等待，不再占用连接
+            raise GraphTimeout('graph query expired in queue')
+        COUNTERS.incr('graph_queries')
+        with self.count_lock:
+            self.active += 1
+        start = time.perf_counter()
+        try:
+            with trace.span('graph_query', cypher=cypher) as span:
+                rows = self.backend.run(cypher, params, remaining)
+                span.set(names=len(params.get('names', ())), rows=len(rows))
+        finally:
+            with self.count_lock:
+                self.active -= 1
+        if metrics.enabled:
+            metrics.GRAPH_QUERY_SECONDS.observe(time.perf_counter() - start, metrics.query_label(cypher))
+        return rows
+
+    def saturated(self):
+        '''
+        排队的查询是否已达 max_pending，供调用方在开始处理请求前快速拒绝
+        '''
+        return bool(self.max_pending) and self.pending >= self.max_pending
+
+    def result(self, future, timeout=None):
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            COUNTERS.incr('graph_timeouts')
+            raise GraphTimeout('graph query timed out')
+
+    def run(self, cypher, params=None, timeout=None):
+        return self.result(self.submit(cypher, params, timeout), timeout)
+
+    async def run_async(self, cypher, params=None, timeout=None):
+        '''await 被取消（如请求超过截止时间）时，尚未开始执行的查询随之取消'''
+        future = asyncio.wrap_future(self.submit(cypher, params, timeout))
+        try:
+            return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            COUNTERS.incr('graph_timeouts')
+            raise GraphTimeout('graph query timed out')
+
+    def run_many(self, queries, timeout=None):
+        '''
+        并发执行多个查询，按输入顺序返回结果
+        :param queries: [(cypher, params)]
+        :param timeout: 全部查询的截止时间（秒），为空时为 self.timeout；超时后尚未完成的查询随之取消
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        futures = []
+        try:
+            for cypher, params in queries:
+                futures.append(self.submit(cypher, params, max(0.0, deadline - time.monotonic())))
+        except GraphBusy:
+            for future in futures:
+                future.cancel()
+            raise
+        try:
+            return [self.result(future, max(0.0, deadline - time.monotonic())) for future in futures]
+        except GraphTimeout:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+# 系统中的查询都是以节点名为条件的一跳查询，内存图只需支持这一种形式：
+# [UNWIND $names AS name] MATCH (m:Label)[-[r:type|type]->(n:Label)] [WHERE x.name = name] RETURN x.attr, ...
+ONE_HOP_PATTERN = re.compile(
+    r'^\s*(?:UNWIND \$(?P<param>\w+) AS (?P<var>\w+)\s+)?'
+    r'MATCH \((?P<src>\w+):(?P<src_label>\w+)\)'
+    r'(?:-\[(?P<rel>\w+):(?P<rel_types>[\w|]+)\]->\((?P<dst>\w+):(?P<dst_label>\w+)\))?'
+    r'(?:\s+WHERE (?P<key>\w+)\.name = (?P<value>\w+))?'
+    r'\s+RETURN (?P<columns>.+?)\s*$', re.I | re.S)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_one_hop(cypher):
+    '''
+    :return: dict 查询各部分（结果被缓存，不要修改），无法识别时抛出 ValueError
+    '''
+    match = ONE_HOP_PATTERN.match(cypher)
+    if not match:
+        raise ValueError('unsupported query: %s' % cypher)
+    query = match.groupdict()
+    query['columns'] = [column.strip() for column in query['columns'].split(',')]
+    query['rel_types'] = query['rel_types'].split('|') if query['rel_types'] else []
+    return query
+
+
+class FakeGraphBackend(object):
+    '''
+    进程内内存图
+    :param latency: 每次查询附加的延迟（秒），模拟网络往返
+    '''
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        # 标签 -> 节点名 -> 属性
+        self.nodes = {}
+        # 关系类型 -> 起点名 -> [(关系名, 终点名)]
+        self.out_edges = {}
+        # 关系类型 -> 终点名 -> [(关系名, 起点名)]
+        self.in_edges = {}
+        self.query_count = 0
+
+    def add_node(self, label, name, **props):
+        props['name'] = name
+        self.nodes.setdefault(label, {})[name] = props
+
+    def add_edge(self, src_label, src, rel_type, rel_name, dst_label, dst):
+        self.nodes.setdefault(src_label, {}).setdefault(src, {'name': src})
+        self.nodes.setdefault(dst_label, {}).setdefault(dst, {'name': dst})
+        self.out_edges.setdefault(rel_type, {}).setdefault(src, []).append((rel_name, dst))
+        self.in_edges.setdefault(rel_type, {}).setdefault(dst, []).append((rel_name, src))
+
+    def run(self, cypher, params, timeout=None):
+        self.query_count += 1
+        if self.latency:
+            if timeout is not None and self.latency > timeout:
+                # 与数据库的事务超时一样，超时的查询在截止时间被终止
+                time.sleep(timeout)
+                raise GraphTimeout('graph query timed out on the server')
+            time.sleep(self.latency)
+        query = parse_one_hop(cypher)
+        names = params[query['param']] if query['param'] else [None]
+        rows = []
+        for name in names:
+            for binding in self.match(query, name):
+                rows.append({column: self.column_value(binding, column) for column in query['columns']})
+        return rows
+
+    def match(self, query, name):
+        '''
+        :return: 变量名 -> 节点属性（关系为 {'name': 关系名}）的绑定列表
+        '''
+        src_nodes = self.nodes.get(query['src_label'], {})
+        if not query['rel']:
+            if query['key'] is None:
+                return [{query['src']: props} for props in src_nodes.values()]
+            props = src_nodes.get(name)
+            return [{query['src']: props}] if props else []
+
+        dst_nodes = self.nodes.get(query['dst_label'], {})
+        bindings = []
+        for rel_type in query['rel_types']:
+            if query['key'] == query['dst']:
+                edges = [(src, rel_name, name) for rel_name, src in self.in_edges.get(rel_type, {}).get(name, [])]
+            elif query['key'] == query['src']:
+                edges = [(name, rel_name, dst) for rel_name, dst in self.out_edges.get(rel_type, {}).get(name, [])]
+            else:
+                edges = [(src, rel_name, dst) for src, targets in self.out_edges.get(rel_type, {}).items()
+                         for rel_name, dst in targets]
+            for src, rel_name, dst in edges:
+                if src in src_nodes and dst in dst_nodes:
+                    bindings.append({query['src']: src_nodes[src], query['rel']: {'name': rel_name},
+                                     query['dst']: dst_nodes[dst]})
+        return bindings
+
+    def column_value(self, binding, column):
+        var, attr = column.split('.', 1)
+        return binding[var].get(attr)
@@ -0,0 +1,383 @@
+# -*- coding:utf-8 -*-
+'''
+知识图谱离线快照
+
+问答系统的所有查询都是从 Disease（或 Symptom）节点出发的一跳查询，
+把这些查询用到的节点属性和关系导出成一个只读快照文件，SnapshotBackend 直接以 mmap 方式读取作答，不再访问网络。
+
+文件结构：
+    魔数 | 目录长度 | JSON 目录 | 各数据段（8 字节对齐）
+    strings   : 所有字符串拼接成的 UTF-8 块 + 偏移数组
+    每个标签  : 按 UTF-8 字节序排列的节点名字符串 id（二分查找），以及每个属性的字符串 id 数组
+                （列表属性为 CSR 加是否为空的标记）
+    每种关系  : 正向 CSR（起点 -> 终点）和反向 CSR（终点 -> 起点），附关系名字符串 id
+
+    python graph_snapshot.py export [snapshot_path]   从 Neo4j 导出快照
+    python graph_snapshot.py verify [snapshot_path]   逐个问题类型对比快照与 Neo4j 的查询结果
+'''
+import json
+import mmap
+import struct
+import sys
+from array import array
+from collections import Counter
+
+from graph_client import parse_one_hop
+
+SNAPSHOT_MAGIC = b'QASNAP01'
+SNAPSHOT_PATH = 'data/graph_snapshot.bin'
+# 字符串 id 缺省值（属性为空）
+NULL_ID = 0xFFFFFFFF
+
+
+def snapshot_schema(templates):
+    '''
+    由查询模板得到需要导出的属性和关系
+    :return: (标签 -> 属性列表, [(起点标签, 关系类型, 终点标签)])
+    '''
+    props = {}
+    relations = []
+    for cypher in templates:
+        query = parse_one_hop(cypher)
+        labels = {query['src']: query['src_label'], query['dst']: query['dst_label']}
+        for column in query['columns']:
+            var, attr = column.split('.', 1)
+            if var in labels and labels[var] and attr != 'name':
+                label_props = props.setdefault(labels[var], [])
+                if attr not in label_props:
+                    label_props.append(attr)
+        for rel_type in query['rel_types']:
+            relation = (query['src_label'], rel_type, query['dst_label'])
+            if relation not in relations:
+                relations.append(relation)
+    return props, relations
+
+
+class SnapshotWriter(object):
+    def __init__(self):
+        self.string_ids = {}
+        self.strings = []
+        # 标签 -> 节点名 -> 属性
+        self.nodes = {}
+        # (起点标签, 关系类型, 终点标签) -> [(起点名, 关系名, 终点名)]
+        self.edges = {}
+
+    def string_id(self, value):
+        if value is None:
+            return NULL_ID
+        value = str(value)
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def add_node(self, label, name, **props):
+        self.nodes.setdefault(label, {}).setdefault(name, {}).update(props)
+
+    def add_edge(self, src_label, src, rel_type, rel_name, dst_label, dst):
+        self.nodes.setdefault(src_label, {}).setdefault(src, {})
+        self.nodes.setdefault(dst_label, {}).setdefault(dst, {})
+        self.edges.setdefault((src_label, rel_type, dst_label), []).append((src, rel_name, dst))
+
+    def write(self, path):
+        sections = []
+        directory = {'labels': {}, 'relations': []}
+
+        def add_section(values, typecode='I'):
+            sections.append(array(typecode, values).tobytes())
+            return len(sections) - 1
+
+        node_index = {}
+        for label, nodes in self.nodes.items():
+            names = sorted(nodes, key=lambda name: name.encode('utf-8'))
+            node_index[label] = {name: ind for ind, name in enumerate(names)}
+            label_dir = {'names': add_section([self.string_id(name) for name in names]), 'props': {}}
+            prop_names = []
+            for props in nodes.values():
+                prop_names += [prop for prop in props if prop not in prop_names]
+            for prop in prop_names:
+                values = [nodes[name].get(prop) for name in names]
+                if any(isinstance(value, (list, tuple)) for value in values):
+                    indptr, indices = [0], []
+                    for value in values:
+                        indices += [self.string_id(item) for item in (value or [])]
+                        indptr.append(len(indices))
+                    label_dir['props'][prop] = {'kind': 'list', 'indptr': add_section(indptr),
+                                                'indices': add_section(indices),
+                                                'present': add_section([value is not None for value in values], 'B')}
+                else:
+                    label_dir['props'][prop] = {'kind': 'str', 'values': add_section([self.string_id(v) for v in values])}
+            directory['labels'][label] = label_dir
+
+        for (src_label, rel_type, dst_label), edges in self.edges.items():
+            src_index, dst_index = node_index[src_label], node_index[dst_label]
+            edges = [(src_index[src], self.string_id(rel_name), dst_index[dst]) for src, rel_name, dst in edges]
+            relation_dir = {'src_label': src_label, 'rel_type': rel_type, 'dst_label': dst_label}
+            for direction, key, other, size in (('out', 0, 2, len(src_index)), ('in', 2, 0, len(dst_index))):
+                edges.sort(key=lambda edge: edge[key])
+                indptr = [0] * (size + 1)
+                for edge in edges:
+                    indptr[edge[key] + 1] += 1
+                for ind in range(size):
+                    indptr[ind + 1] += indptr[ind]
+                relation_dir[direction] = {'indptr': add_section(indptr),
+                                           'nodes': add_section([edge[other] for edge in edges]),
+                                           'rel_names': add_section([edge[1] for edge in edges])}
+            directory['relations'].append(relation_dir)
+
+        blob = b''.join(string.encode('utf-8') for string in self.strings)
+        offsets = [0]
+        for string in self.strings:
+            offsets.append(offsets[-1] + len(string.encode('utf-8')))
+        directory['strings'] = {'offsets': add_section(offsets)}
+        sections.append(blob)
+        directory['strings']['blob'] = len(sections) - 1
+
+        # 先确定目录长度再计算各段偏移
+        directory['byteorder'] = sys.byteorder
+        directory['sections'] = [[0, len(section)] for section in sections]
+        header_size = len(SNAPSHOT_MAGIC) + 4 + len(json.dumps(directory)) + 16 * len(sections) + 64
+        header_size = (header_size + 7) // 8 * 8
+        offset = header_size
+        for ind, section in enumerate(sections):
+            directory['sections'][ind] = [offset, len(section)]
+            offset = (offset + len(section) + 7) // 8 * 8
+        directory_bytes = json.dumps(directory).encode('utf-8')
+        assert len(SNAPSHOT_MAGIC) + 4 + len(directory_bytes) <= header_size
+
+        with open(path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC + struct.pack('<I', len(directory_bytes)) + directory_bytes)
+            for (offset, _), section in zip(directory['sections'], sections):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(section)
+
+
+def export_snapshot(backend, path, templates):
+    '''
+    从图数据库后端导出查询模板用到的全部属性和关系
+    '''
+    props, relations = snapshot_schema(templates)
+    writer = SnapshotWriter()
+    for label, label_props in props.items():
+        columns = ', '.join(['m.name'] + ['m.%s' % prop for prop in label_props])
+        for row in backend.run('MATCH (m:%s) RETURN %s' % (label, columns), {}):
+            writer.add_node(label, row['m.name'], **{prop: row['m.%s' % prop] for prop in label_props})
+    for src_label, rel_type, dst_label in relations:
+        cypher = 'MATCH (m:%s)-[r:%s]->(n:%s) RETURN m.name, r.name, n.name' % (src_label, rel_type, dst_label)
+        for row in backend.run(cypher, {}):
+            writer.add_edge(src_label, row['m.name'], rel_type, row['r.name'], dst_label, row['n.name'])
+    writer.write(path)
+    return writer
+
+
+class SnapshotBackend(object):
+    '''
+    以 mmap 方式读取快照作答，接口与 FakeGraphBackend / Neo4jBackend 相同
+    '''
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError('%s is not a graph snapshot' % path)
+        directory_size = struct.unpack_from('<I', self.mm, len(SNAPSHOT_MAGIC))[0]
+        start = len(SNAPSHOT_MAGIC) + 4
+        directory = json.loads(self.mm[start:start + directory_size].decode('utf-8'))
+        if directory['byteorder'] != sys.byteorder:
+            raise ValueError('%s was written on a %s-endian machine' % (path, directory['byteorder']))
+
+        view = memoryview(self.mm)
+        sections = [view[offset:offset + size] for offset, size in directory['sections']]
+
+        def ids(ind):
+            return sections[ind].cast('I')
+
+        self.blob = sections[directory['strings']['blob']]
+        self.offsets = ids(directory['strings']['offsets'])
+        # 标签 -> (节点名字符串 id, 属性 -> 列)
+        self.labels = {}
+        for label, label_dir in directory['labels'].items():
+            props = {}
+            for prop, prop_dir in label_dir['props'].items():
+                if prop_dir['kind'] == 'list':
+                    props[prop] = ('list', ids(prop_dir['indptr']), ids(prop_dir['indices']),
+                                   sections[prop_dir['present']])
+                else:
+                    props[prop] = ('str', ids(prop_dir['values']))
+            self.labels[label] = (ids(label_dir['names']), props)
+        # (关系类型, 方向) -> (起点标签, 终点标签, indptr, 节点, 关系名)
+        self.relations = {}
+        for relation_dir in directory['relations']:
+            for direction in ('out', 'in'):
+                csr = relation_dir[direction]
+                self.relations[(relation_dir['rel_type'], direction)] = (
+                    relation_dir['src_label'], relation_dir['dst_label'],
+                    ids(csr['indptr']), ids(csr['nodes']), ids(csr['rel_names']))
+
+    def string(self, string_id):
+        if string_id == NULL_ID:
+            return None
+        return self.string_bytes(string_id).decode('utf-8')
+
+    def string_bytes(self, string_id):
+        return bytes(self.blob[self.offsets[string_id]:self.offsets[string_id + 1]])
+
+    def find_node(self, label, name):
+        '''
+        :return: 节点在标签内的下标，不存在返回 -1
+        '''
+        if label not in self.labels:
+            return -1
+        names = self.labels[label][0]
+        target = name.encode('utf-8')
+        low, high = 0, len(names)
+        while low < high:
+            mid = (low + high) // 2
+            if self.string_bytes(names[mid]) < target:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(names) and self.string_bytes(names[low]) == target:
+            return low
+        return -1
+
+    def node_value(self, label, ind, attr):
+        names, props = self.labels[label]
+        if attr == 'name':
+            return self.string(names[ind])
+        if attr not in props:
+            return None
+        prop = props[attr]
+        if prop[0] == 'list':
+            if not prop[3][ind]:
+                return None
+            return [self.string(prop[2][i]) for i in range(prop[1][ind], prop[1][ind + 1])]
+        return self.string(prop[1][ind])
+
+    def run(self, cypher, params, timeout=None):
+        # 查询只读内存，不需要超时
+        query = parse_one_hop(cypher)
+        names = params[query['param']] if query['param'] else [None]
+        rows = []
+        for name in names:
+            for binding in self.match(query, name):
+                row = {}
+                for column in query['columns']:
+                    var, attr = column.split('.', 1)
+                    if var == query['rel']:
+                        row[column] = self.string(binding[var]) if attr == 'name' else None
+                    else:
+                        label, ind = binding[var]
+                        row[column] = self.node_value(label, ind, attr)
+                rows.append(row)
+        return rows
+
+    def match(self, query, name):
+        '''
+        :return: 变量名 -> (标签, 节点下标)（关系为关系名字符串 id）的绑定列表
+        '''
+        src, src_label = query['src'], query['src_label']
+        if not query['rel']:
+            if src_label not in self.labels:
+                return []
+            if query['key'] is None:
+                return [{src: (src_label, ind)} for ind in range(len(self.labels[src_label][0]))]
+            ind = self.find_node(src_label, name)
+            return [{src: (src_label, ind)}] if ind >= 0 else []
+
+        dst, dst_label, rel = query['dst'], query['dst_label'], query['rel']
+        bindings = []
+        for rel_type in query['rel_types']:
+            if query['key'] == dst:
+                relation = self.relations.get((rel_type, 'in'))
+                if relation is None or relation[1] != dst_label or relation[0] != src_label:
+                    continue
+                ind = self.find_node(dst_label, name)
+                if ind < 0:
+                    continue
+                indptr, nodes, rel_names = relation[2:]
+                for i in range(indptr[ind], indptr[ind + 1]):
+                    bindings.append({src: (src_label, nodes[i]), rel: rel_names[i], dst: (dst_label, ind)})
+            else:
+                relation = self.relations.get((rel_type, 'out'))
+                if relation is None or relation[0] != src_label or relation[1] != dst_label:
+                    continue
+                indptr, nodes, rel_names = relation[2:]
+                if query['key'] == src:
+                    ind = self.find_node(src_label, name)
+                    sources = [ind] if ind >= 0 else []
+                else:
+                    sources = range(len(indptr) - 1)
+                for ind in sources:
+                    for i in range(indptr[ind], indptr[ind + 1]):
+                        bindings.append({src: (src_label, ind), rel: rel_names[i], dst: (dst_label, nodes[i])})
+        return bindings
+
+    def close(self):
+        self.labels = self.relations = self.blob = self.offsets = None
+        self.mm.close()
+
+
+def compare_backends(backend_a, backend_b, templates, names, batch_size=500):
+    '''
+    对比两个后端在每个查询模板上的结果（结果行作为多重集合比较，与顺序无关）
+    :param templates: 问题类型 -> cypher
+    :param names: 问题类型 -> 要查询的实体名列表
+    :return: 问题类型 -> 结果不一致的实体名列表
+    '''
+    def freeze(row):
+        return tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in row.items()))
+
+    mismatches = {}
+    for question_type, cypher in templates.items():
+        query = parse_one_hop(cypher)
+        key_column = '%s.name' % query['key']
+        type_names = names[question_type]
+        for start in range(0, len(type_names), batch_size):
+            batch = type_names[start:start + batch_size]
+            rows_a = backend_a.run(cypher, {query['param']: batch})
+            rows_b = backend_b.run(cypher, {query['param']: batch})
+            if Counter(map(freeze, rows_a)) == Counter(map(freeze, rows_b)):
+                continue
+            by_name_a, by_name_b = {}, {}
+            for rows, by_name in ((rows_a, by_name_a), (rows_b, by_name_b)):
+                for row in rows:
+                    by_name.setdefault(row[key_column], Counter())[freeze(row)] += 1
+            mismatches.setdefault(question_type, []).extend(
+                name for name in batch if by_name_a.get(name) != by_name_b.get(name))
+    return mismatches
+
+
+def template_names(backend, templates):
+    '''
+    每个查询模板的全部候选实体名（WHERE 条件所在标签的全部节点）
+    '''
+    names = {}
+    for question_type, cypher in templates.items():
+        query = parse_one_hop(cypher)
+        label = query['src_label'] if query['key'] == query['src'] else query['dst_label']
+        names[question_type] = [row['m.name'] for row in backend.run('MATCH (m:%s) RETURN m.name' % label, {})]
+    return names
+
+
+if __name__ == '__main__':
+    from graph_client import GraphConfig, Neo4jBackend
+    from QuestionClassifier import QUERY_TEMPLATES
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'export'
+    path = sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_PATH
+    config = GraphConfig()
+    if command == 'export':
+        export_snapshot(Neo4jBackend(config), path, QUERY_TEMPLATES.values())
+        print('graph snapshot saved to', path)
+    elif command == 'verify':
+        snapshot = SnapshotBackend(path)
+        mismatches = compare_backends(Neo4jBackend(config), snapshot, QUERY_TEMPLATES,
+                                      template_names(snapshot, QUERY_TEMPLATES))
+        for question_type, names in mismatches.items():
+            print(question_type.value, len(names), names[:10])
+        print('snapshot matches neo4j' if not mismatches else 'snapshot differs from neo4j')
+        sys.exit(1 if mismatches else 0)
+    else:
+        print('usage: python graph_snapshot.py export|verify [snapshot_path]')
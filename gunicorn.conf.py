@@ -0,0 +1,18 @@
+# -*- coding:utf-8 -*-
+'''
+gunicorn 配置
+    gunicorn -c gunicorn.conf.py "web_server:create_app()"
+
+preload_app 使 create_app 在 master 进程中执行，actree 与实体索引只加载一次，
+fork 出的 worker 以写时复制方式共享；图数据库连接由每个 worker 自己创建。
+'''
+import multiprocessing
+import os
+
+bind = os.environ.get('QA_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('QA_WORKERS', multiprocessing.cpu_count()))
+# 查询图数据库时线程阻塞在网络 IO 上，每个 worker 开多个线程
+worker_class = 'gthread'
+threads = int(os.environ.get('QA_THREADS', 8))
+preload_app = True
+timeout = int(os.environ.get('QA_TIMEOUT', 30))
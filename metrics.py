@@ -0,0 +1,214 @@
+# -*- coding:utf-8 -*-
+'''
+进程内的 Prometheus 指标，由 web 服务的 /metrics 以文本格式输出
+
+    qa_stage_duration_seconds{stage}                 各阶段耗时（entity_match, trigger_classify, parse, graph_query, prettify）
+    qa_request_duration_seconds{name}                各入口的整体耗时
+    qa_graph_query_duration_seconds{question_type}   按问题类型的图数据库查询耗时
+    qa_question_types_total{question_type}           各问题类型出现的次数
+    qa_unanswerable_total{reason}                    无法回答的问句（no_entity 没有实体 / no_result 没有查到结果）
+    qa_answer_cache_*, qa_graph_pool_*               查询结果缓存命中率、连接池占用
+
+计时默认关闭，只保留计数，由 configure(enable=True) 或环境变量 QA_METRICS=1 开启；
+web 服务（web_server.create_app）默认开启，QA_METRICS=0 时关闭。gunicorn 多 worker 时每个 worker 各自统计。
+'''
+import bisect
+import os
+import threading
+
+# 秒，覆盖从单次词典匹配（微秒级）到慢查询（秒级）
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def enabled_from_env(environ=None, default='0'):
+    '''
+    :param default: 未设置 QA_METRICS 时的取值，脚本与批处理默认 '0'（计时使分类吞吐下降约 10%~15%）
+    '''
+    environ = os.environ if environ is None else environ
+    return environ.get('QA_METRICS', default) == '1'
+
+
+enabled = enabled_from_env()
+
+
+def configure(enable=None):
+    global enabled
+    if enable is not None:
+        enabled = bool(enable)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metric(object):
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def header(self):
+        return ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.type_name)]
+
+    def collect(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return self.header() + ['%s%s %s' % (self.name, format_labels(self.labelnames, labels), format_value(value))
+                                for labels, value in values]
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, *labelvalues, value=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + value
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = value
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        # 每个标签组合: [各桶计数（不累加）..., +Inf 桶计数, 总和]
+        ind = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labelvalues)
+            if counts is None:
+                counts = self.values[labelvalues] = [0] * (len(self.buckets) + 2)
+            counts[ind] += 1
+            counts[-1] += value
+
+    def collect(self):
+        with self.lock:
+            values = sorted((labels, list(counts)) for labels, counts in self.values.items())
+        lines = self.header()
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                lines.append('%s_bucket%s %d' % (self.name, format_labels(self.labelnames, labels, [('le', format_value(bound))]),
+                                                 total))
+            label_text = format_labels(self.labelnames, labels)
+            lines.append('%s_sum%s %s' % (self.name, label_text, repr(counts[-1])))
+            lines.append('%s_count%s %d' % (self.name, label_text, total))
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, extra=()):
+        '''
+        :param extra: 抓取时才计算的指标（计数器快照、缓存与连接池状态）
+        '''
+        lines = []
+        for metric in list(self.metrics) + list(extra):
+            lines += metric.collect()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram('qa_stage_duration_seconds', 'Time spent in each pipeline stage.', ['stage']))
+REQUEST_SECONDS = REGISTRY.register(Histogram('qa_request_duration_seconds', 'Time spent answering, per entry point.',
+                                              ['name']))
+GRAPH_QUERY_SECONDS = REGISTRY.register(Histogram('qa_graph_query_duration_seconds',
+                                                  'Graph query time per question type.', ['question_type']))
+QUESTION_TYPES = REGISTRY.register(Counter('qa_question_types_total', 'Questions classified as each question type.',
+                                           ['question_type']))
+
+# 查询语句 -> 问题类型，由 QuestionClassifier 按 QUERY_TEMPLATES 注册
+QUERY_LABELS = {}
+
+
+def query_label(cypher):
+    return QUERY_LABELS.get(cypher, 'other')
+
+
+def counter_metrics(counts):
+    '''
+    :param counts: tracing.COUNTERS.snapshot()
+    '''
+    questions = Counter('qa_questions_total', 'Questions received.')
+    questions.inc(value=counts.get('questions', 0))
+    unanswerable = Counter('qa_unanswerable_total', 'Questions without an answer.', ['reason'])
+    unanswerable.inc('no_entity', value=counts.get('unanswerable_no_entity', 0))
+    unanswerable.inc('no_result', value=counts.get('unanswerable_no_result', 0))
+    graph_queries = Counter('qa_graph_queries_total', 'Graph queries executed.')
+    graph_queries.inc(value=counts.get('graph_queries', 0))
+    graph_timeouts = Counter('qa_graph_timeouts_total', 'Graph queries that timed out.')
+    graph_timeouts.inc(value=counts.get('graph_timeouts', 0))
+    graph_rejected = Counter('qa_graph_rejected_total', 'Graph queries rejected because the queue was full.')
+    graph_rejected.inc(value=counts.get('graph_busy', 0))
+    return [questions, unanswerable, graph_queries, graph_timeouts, graph_rejected]
+
+
+def cache_metrics(cache):
+    '''
+    :param cache: AnswerCache
+    '''
+    stats = cache.stats()
+    result = []
+    for key, kind, documentation in [('hits', Counter, 'Answer cache hits.'),
+                                     ('misses', Counter, 'Answer cache misses.'),
+                                     ('evictions', Counter, 'Answer cache evictions.'),
+                                     ('hit_ratio', Gauge, 'Answer cache hit ratio since start.'),
+                                     ('entries', Gauge, 'Answer cache entries.'),
+                                     ('bytes', Gauge, 'Estimated answer cache size in bytes.')]:
+        name = 'qa_answer_cache_%s%s' % (key, '_total' if kind is Counter else '')
+        metric = kind(name, documentation)
+        if kind is Counter:
+            metric.inc(value=stats[key])
+        else:
+            metric.set(stats[key])
+        result.append(metric)
+    return result
+
+
+def pool_metrics(client):
+    '''
+    :param client: GraphClient
+    '''
+    result = []
+    for key, value, documentation in [('size', client.pool_size, 'Graph connection pool size.'),
+                                      ('active', client.active, 'Graph queries running.'),
+                                      ('pending', client.pending, 'Graph queries running or queued.'),
+                                      ('max_pending', client.max_pending, 'Graph query queue limit (0 = unbounded).'),
+                                      ('saturation', client.active / client.pool_size,
+                                       'Fraction of pool threads busy.')]:
+        metric = Gauge('qa_graph_pool_%s' % key, documentation)
+        metric.set(value)
+        result.append(metric)
+    return result
@@ -1,20 +1,43 @@
 # coding: utf-8
+'''
+把 data_spider 抓取的原始页面（medical.data）整理成结构化的疾病记录（medical.medical）
 
+    python build_data.py [--batch-size 500] [--modify-jc [--workers 4]]
+
+collect_medical 流式处理：按批读取原始记录，每批用一次 $in 查询取出检查项 url -> 名称，
+再用一次 insert_many 写入，内存占用只与批大小有关。
+--modify-jc 先从检查项页面中解析出名称（collect_medical 用到），页面未变化的不再解析。
+'''
+
+import argparse
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import pymongo
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from lxml import etree
 import os
-from max_cut import *
 
 class MedicalGraph:
-    def __init__(self):
-        self.conn = pymongo.MongoClient()
+    def __init__(self, db=None, stop_words=None, cuter=None):
+        '''
+        :param db: mongo 数据库，为空时连接本机的 medical 库
+        :param stop_words: 症状首字的过滤词，为空时读取 first_name.txt 并加上字母和数字
+        :param cuter: 并发症分词器，为空时在第一次用到时创建 max_cut.CutWords
+        '''
+        if db is None:
+            self.conn = pymongo.MongoClient()
+            db = self.conn['medical']
         cur_dir = '/'.join(os.path.abspath(__file__).split('/')[:-1])
-        self.db = self.conn['medical']
+        self.db = db
         self.col = self.db['data']
-        first_words = [i.strip() for i in open(os.path.join(cur_dir, 'first_name.txt'))]
-        alphabets = ['a','b','c','d','e','f','g','h','i','j','k','l','m','n','o','p','q','r','s','t','u','v','w','x','y', 'z']
-        nums = ['1','2','3','4','5','6','7','8','9','0']
-        self.stop_words = first_words + alphabets + nums
+        if stop_words is None:
+            first_words = [i.strip() for i in open(os.path.join(cur_dir, 'first_name.txt'))]
+            alphabets = ['a','b','c','d','e','f','g','h','i','j','k','l','m','n','o','p','q','r','s','t','u','v','w','x','y', 'z']
+            nums = ['1','2','3','4','5','6','7','8','9','0']
+            stop_words = first_words + alphabets + nums
+        self.stop_words = frozenset(stop_words)
         self.key_dict = {
             '医保疾病' : 'yibao_status',
             "患病比例" : "get_prob",
@@ -40,96 +63,209 @@ class MedicalGraph:
             '治疗费用': 'cost_money',
             '并发症': 'acompany'
         }
-        self.cuter = CutWords()
+        self.cuter = cuter
 
-    def collect_medical(self):
-        cates = []
-        inspects = []
+    def cut_words(self, text):
+        if self.cuter is None:
+            from max_cut import CutWords
+            self.cuter = CutWords()
+        return self.cuter.max_biward_cut(text)
+
+    def collect_medical(self, batch_size=500):
+        '''
+        按批整理全部原始记录并写入 medical 集合
+        :return: 写入的记录数
+        '''
         count = 0
-        for item in self.col.find():
-            data = {}
-            basic_info = item['basic_info']
-            name = basic_info['name']
-            if not name:
+        batch = []
+        for item in self.col.find({}, {'_id': 0, 'url': 0}, batch_size=batch_size):
+            if item['basic_info']['name']:
+                batch.append(item)
+            if len(batch) == batch_size:
+                count += self.collect_batch(batch)
+                batch = []
+        if batch:
+            count += self.collect_batch(batch)
+        return count
+
+    def collect_batch(self, items):
+        '''
+        一批原始记录：一次查询取出其中全部检查项的名称，整理后一次写入
+        '''
+        urls = list(set(url for item in items for url in item['inspect_info']))
+        jc_names = self.get_inspects(urls)
+        records = [self.build_record(item, jc_names) for item in items]
+        try:
+            inserted = len(self.db['medical'].insert_many(records, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            inserted = e.details['nInserted']
+            logging.warning('%d records failed to insert: %s', len(records) - inserted, e.details['writeErrors'][:3])
+        logging.info('%d records inserted', inserted)
+        return inserted
+
+    def build_record(self, item, jc_names):
+        '''
+        :param item: 一条原始记录（一种疾病的各子页面）
+        :param jc_names: 检查项 url -> 名称
+        :return: 结构化的疾病记录
+        '''
+        data = {}
+        basic_info = item['basic_info']
+        # 基本信息
+        data['名称'] = basic_info['name']
+        data['简介'] = '\n'.join(basic_info['desc']).replace('\r\n\t', '').replace('\r\n\n\n','').replace(' ','').replace('\r\n','\n')
+        data['所属类别'] = basic_info['category']
+        attributes = basic_info['attributes']
+        # 成因及预防
+        data['预防措施'] = item['prevent_info']
+        data['成因'] = item['cause_info']
+        # 并发症
+        data['症状'] = list(set([i for i in item["symptom_info"][0] if i[0] not in self.stop_words]))
+        for attr in attributes:
+            attr_pair = attr.split('：')
+            if len(attr_pair) == 2:
+                key = attr_pair[0]
+                value = attr_pair[1]
+                data[key] = value
+        # 检查
+        data['检查'] = [jc_names[inspect] for inspect in item['inspect_info'] if jc_names.get(inspect)]
+        # 食物
+        food_info = item['food_info']
+        if food_info:
+            data['宜食'] = food_info['good']
+            data['忌食'] = food_info['bad']
+            data['推荐'] = food_info['recommand']
+        # 药品
+        drug_info = item['drug_info']
+        data['药品推荐'] = list(set([i.split('(')[-1].replace(')','') for i in drug_info]))
+        data['药品明细'] = drug_info
+        data_modify = {}
+        for attr, value in data.items():
+            attr_en = self.key_dict.get(attr)
+            if attr_en:
+                data_modify[attr_en] = value
+            if attr_en in ['yibao_status', 'get_prob', 'easy_get', 'get_way', "cure_lasttime", "cured_prob"]:
+                data_modify[attr_en] = value.replace(' ','').replace('\t','')
+            elif attr_en in ['cure_department', 'cure_way', 'common_drug']:
+                data_modify[attr_en] = [i for i in value.split(' ') if i]
+            elif attr_en in ['acompany']:
+                acompany = [i for i in self.cut_words(data_modify[attr_en]) if len(i) > 1]
+                data_modify[attr_en] = acompany
+        return data_modify
+
+    def get_inspects(self, urls):
+        '''
+        :return: 检查项 url -> 名称，只含已有名称的检查项
+        '''
+        if not urls:
+            return {}
+        return {res['url']: res['name'] for res in self.db['jc'].find({'url': {'$in': urls}}, {'_id': 0, 'url': 1, 'name': 1})
+                if res.get('name')}
+
+    def modify_jc(self, workers=None, batch_size=100):
+        '''
+        从保存的检查项页面中解析名称和简介：按批交给进程池解析，结果用无序 bulk_write 写回，
+        页面内容的哈希与上次解析时相同的跳过；同时在途的批数不超过 workers 的两倍
+        :param workers: 进程数，为空时取 CPU 数，为 1 时在本进程中解析
+        :return: dict 各结果的页面数 parsed / skipped / failed
+        '''
+        workers = workers or os.cpu_count() or 1
+        result = {'parsed': 0, 'skipped': 0, 'failed': 0}
+        pending = set()
+
+        def finish(future):
+            pending.discard(future)
+            self.save_jc(future.result(), result)
+
+        def batches():
+            batch = []
+            for item in self.db['jc'].find({}, {'html': 1, 'html_hash': 1}, batch_size=batch_size):
+                html = item.get('html') or ''
+                html_hash = hashlib.md5(html.encode('utf-8')).hexdigest()
+                if item.get('html_hash') == html_hash:
+                    result['skipped'] += 1
+                    continue
+                batch.append((item['_id'], html, html_hash))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        if workers == 1:
+            for batch in batches():
+                self.save_jc(parse_jc_batch(batch), result)
+            return result
+        with ProcessPoolExecutor(workers) as executor:
+            for batch in batches():
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future)
+                pending.add(executor.submit(parse_jc_batch, batch))
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+        return result
+
+    def save_jc(self, parsed, result):
+        '''
+        :param parsed: parse_jc_batch 的结果
+        '''
+        requests = []
+        for _id, fields in parsed:
+            if fields is None:
+                result['failed'] += 1
                 continue
-            # 基本信息
-            data['名称'] = name
-            data['简介'] = '\n'.join(basic_info['desc']).replace('\r\n\t', '').replace('\r\n\n\n','').replace(' ','').replace('\r\n','\n')
-            category = basic_info['category']
-            data['所属类别'] = category
-            cates += category
-            inspect = item['inspect_info']
-            inspects += inspect
-            attributes = basic_info['attributes']
-            # 成因及预防
-            data['预防措施'] = item['prevent_info']
-            data['成因'] = item['cause_info']
-            # 并发症
-            data['症状'] = list(set([i for i in item["symptom_info"][0] if i[0] not in self.stop_words]))
-            for attr in attributes:
-                attr_pair = attr.split('：')
-                if len(attr_pair) == 2:
-                    key = attr_pair[0]
-                    value = attr_pair[1]
-                    data[key] = value
-            # 检查
-            inspects = item['inspect_info']
-            jcs = []
-            for inspect in inspects:
-                jc_name = self.get_inspect(inspect)
-                if jc_name:
-                    jcs.append(jc_name)
-            data['检查'] = jcs
-            # 食物
-            food_info = item['food_info']
-            if food_info:
-                data['宜食'] = food_info['good']
-                data['忌食'] = food_info['bad']
-                data['推荐'] = food_info['recommand']
-            # 药品
-            drug_info = item['drug_info']
-            data['药品推荐'] = list(set([i.split('(')[-1].replace(')','') for i in drug_info]))
-            data['药品明细'] = drug_info
-            data_modify = {}
-            for attr, value in data.items():
-                attr_en = self.key_dict.get(attr)
-                if attr_en:
-                    data_modify[attr_en] = value
-                if attr_en in ['yibao_status', 'get_prob', 'easy_get', 'get_way', "cure_lasttime", "cured_prob"]:
-                    data_modify[attr_en] = value.replace(' ','').replace('\t','')
-                elif attr_en in ['cure_department', 'cure_way', 'common_drug']:
-                    data_modify[attr_en] = [i for i in value.split(' ') if i]
-                elif attr_en in ['acompany']:
-                    acompany = [i for i in self.cuter.max_biward_cut(data_modify[attr_en]) if len(i) > 1]
-                    data_modify[attr_en] = acompany
-
-            try:
-                self.db['medical'].insert(data_modify)
-                count += 1
-                print(count)
-            except Exception as e:
-                print(e)
-
-        return
-
-
-    def get_inspect(self, url):
-        res = self.db['jc'].find_one({'url':url})
-        if not res:
-            return ''
-        else:
-            return res['name']
-
-    def modify_jc(self):
-        for item in self.db['jc'].find():
-            url = item['url']
-            content = item['html']
-            selector = etree.HTML(content)
-            name = selector.xpath('//title/text()')[0].split('结果分析')[0]
-            desc = selector.xpath('//meta[@name="description"]/@content')[0].replace('\r\n\t','')
-            self.db['jc'].update({'url':url}, {'$set':{'name':name, 'desc':desc}})
+            requests.append(UpdateOne({'_id': _id}, {'$set': fields}))
+        if not requests:
+            return
+        try:
+            result['parsed'] += self.db['jc'].bulk_write(requests, ordered=False).matched_count
+        except BulkWriteError as e:
+            result['parsed'] += e.details['nMatched']
+            result['failed'] += len(e.details['writeErrors'])
+            logging.warning('%d jc updates failed: %s', len(e.details['writeErrors']), e.details['writeErrors'][:3])
+
 
+def parse_jc(html):
+    '''
+    :return: 检查项页面的名称与简介
+    '''
+    selector = etree.HTML(html)
+    name = selector.xpath('//title/text()')[0].split('结果分析')[0]
+    desc = selector.xpath('//meta[@name="description"]/@content')[0].replace('\r\n\t','')
+    return name, desc
+
+
+def parse_jc_batch(batch):
+    '''
+    在进程池中执行
+    :param batch: [(_id, html, html_hash)]
+    :return: [(_id, 要写回的字段)]，解析失败的字段为 None，下次运行时重试
+    '''
+    parsed = []
+    for _id, html, html_hash in batch:
+        try:
+            name, desc = parse_jc(html)
+        except Exception as e:
+            logging.warning('jc %s parse failed: %r', _id, e)
+            parsed.append((_id, None))
+            continue
+        parsed.append((_id, {'name': name, 'desc': desc, 'html_hash': html_hash}))
+    return parsed
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--modify-jc', action='store_true', help='先解析检查项页面')
+    parser.add_argument('--workers', type=int, help='解析检查项页面的进程数，默认为 CPU 数')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
     handler = MedicalGraph()
+    if args.modify_jc:
+        logging.info('jc pages: %s', handler.modify_jc(args.workers))
+    logging.info('%d records collected', handler.collect_medical(args.batch_size))
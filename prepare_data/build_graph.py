@@ -0,0 +1,440 @@
+# coding: utf-8
+'''
+由 medical.medical 中的疾病记录（build_data.py 生成）构建知识图谱，并从同一次遍历重新生成领域词表
+
+    python build_graph.py [--csv data/graph_csv] [--batch-size 1000] [--region-dir data/region_words]
+    python build_graph.py --incremental [--notify http://127.0.0.1:5000] [--changes changes.json]
+
+默认用 UNWIND ... MERGE 按批写入 Neo4j（每批一个事务，可重复执行），连接参数与问答服务相同
+（NEO4J_URI / NEO4J_USER / NEO4J_PASSWORD）；--csv 则写出 neo4j-admin import 使用的 CSV，用于离线导入空库。
+写入后把各疾病的记录及其哈希保存为状态文件（--state），--incremental 时与之对比，
+只把有变化的节点、属性和关系写入图谱，只重写有变化的词表文件，并给出变化的实体，
+--notify 时据此通知问答服务按实体更新领域词典、使查询缓存失效，而不必整体重新加载。
+'''
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+import urllib.request
+
+# 节点标签 -> 领域词表文件（与 QuestionClassifier.REGION_FILES 对应）
+LABEL_FILES = [
+    ('Disease', 'diseases.txt'),
+    ('Department', 'departments.txt'),
+    ('Check', 'checks.txt'),
+    ('Drug', 'drugs.txt'),
+    ('Food', 'foods.txt'),
+    ('Symptom', 'symptoms.txt'),
+]
+LABELS = [label for label, _ in LABEL_FILES]
+# 与标签不同的实体类型（QuestionClassifier.ENTITYTYPE 的值）
+LABEL_ENTITY_TYPES = {'Drug': 'drug', 'Food': 'food'}
+
+STATE_PATH = 'data/graph_state.pkl'
+STATE_VERSION = 1
+
+# 疾病节点的属性
+DISEASE_PROPS = ['desc', 'prevent', 'cause', 'easy_get', 'cure_lasttime', 'cure_department', 'cure_way', 'cured_prob']
+DISEASE_LIST_PROPS = ['cure_department', 'cure_way']
+
+# (起点标签, 关系类型, 终点标签, 关系名, 疾病记录中的字段)，科室关系由 cure_department 单独处理
+RELATIONS = [
+    ('Disease', 'has_symptom', 'Symptom', '症状', 'symptom'),
+    ('Disease', 'acompany_with', 'Disease', '并发症', 'acompany'),
+    ('Disease', 'common_drug', 'Drug', '常用药品', 'common_drug'),
+    ('Disease', 'no_eat', 'Food', '忌吃', 'not_eat'),
+    ('Disease', 'do_eat', 'Food', '宜吃', 'do_eat'),
+    ('Disease', 'recommand_eat', 'Food', '推荐食谱', 'recommand_eat'),
+    ('Disease', 'need_check', 'Check', '诊断检查', 'check'),
+    ('Disease', 'belongs_to', 'Department', '所属科室', None),
+    ('Department', 'belongs_to', 'Department', '属于', None),
+]
+
+# neo4j-admin import 默认的数组分隔符
+ARRAY_DELIMITER = ';'
+
+
+def clean_names(values):
+    if isinstance(values, str):
+        values = [values]
+    return [value.strip() for value in values or [] if value and value.strip()]
+
+
+class GraphData:
+    '''
+    内存中的图：节点按标签去重，关系按 (起点, 终点) 去重
+    '''
+    def __init__(self):
+        # 标签 -> 节点名 -> 属性
+        self.nodes = {label: {} for label in LABELS}
+        # (起点标签, 关系类型, 终点标签, 关系名) -> {(起点名, 终点名)}
+        self.edges = {relation[:4]: set() for relation in RELATIONS}
+
+    def add_record(self, record):
+        name = (record.get('name') or '').strip()
+        if not name:
+            return
+        props = {}
+        for prop in DISEASE_PROPS:
+            value = record.get(prop)
+            if prop in DISEASE_LIST_PROPS:
+                value = clean_names(value)
+            if value:
+                props[prop] = value
+        self.nodes['Disease'].setdefault(name, {}).update(props)
+
+        for src_label, rel_type, dst_label, rel_name, field in RELATIONS:
+            if field is None:
+                continue
+            edges = self.edges[(src_label, rel_type, dst_label, rel_name)]
+            for dst in clean_names(record.get(field)):
+                if dst_label != 'Disease':
+                    self.nodes[dst_label].setdefault(dst, {})
+                edges.add((name, dst))
+
+        # 科室由大到小排列：疾病属于最后一个科室，每个科室属于前一个
+        departments = clean_names(record.get('cure_department'))
+        for department in departments:
+            self.nodes['Department'].setdefault(department, {})
+        if departments:
+            self.edges[('Disease', 'belongs_to', 'Department', '所属科室')].add((name, departments[-1]))
+        for big, small in zip(departments, departments[1:]):
+            if big != small:
+                self.edges[('Department', 'belongs_to', 'Department', '属于')].add((small, big))
+
+    def finish(self):
+        '''
+        全部记录加入后调用：去掉指向没有记录的疾病的并发症关系
+        '''
+        diseases = self.nodes['Disease']
+        for relation, edges in self.edges.items():
+            if relation[2] == 'Disease':
+                self.edges[relation] = {(src, dst) for src, dst in edges if dst in diseases}
+
+    def counts(self):
+        return {'nodes': sum(len(nodes) for nodes in self.nodes.values()),
+                'edges': sum(len(edges) for edges in self.edges.values())}
+
+    def node_rows(self, label):
+        return [dict(props, name=name) for name, props in sorted(self.nodes[label].items())]
+
+    def edge_rows(self, relation):
+        return sorted(self.edges[relation])
+
+    def feed(self, sink):
+        '''
+        逐个节点和关系交给 sink.add_node / sink.add_edge（如 FakeGraphBackend、graph_snapshot.SnapshotWriter）
+        '''
+        for label in LABELS:
+            for name, props in sorted(self.nodes[label].items()):
+                sink.add_node(label, name, **props)
+        for (src_label, rel_type, dst_label, rel_name) in self.edges:
+            for src, dst in self.edge_rows((src_label, rel_type, dst_label, rel_name)):
+                sink.add_edge(src_label, src, rel_type, rel_name, dst_label, dst)
+
+
+def read_records(col, batch_size=1000):
+    '''
+    :param col: medical.medical 集合
+    :return: 疾病名 -> 该疾病的记录列表（只含建图用到的字段），按读取顺序
+    '''
+    projection = dict.fromkeys(['name', 'cure_department'] + DISEASE_PROPS +
+                               [relation[4] for relation in RELATIONS if relation[4]], 1)
+    projection['_id'] = 0
+    records = {}
+    for record in col.find({}, projection, batch_size=batch_size):
+        name = (record.get('name') or '').strip()
+        if name:
+            records.setdefault(name, []).append(record)
+    return records
+
+
+def build_graph(records):
+    '''
+    :param records: read_records 的结果
+    '''
+    graph = GraphData()
+    for disease_records in records.values():
+        for record in disease_records:
+            graph.add_record(record)
+    graph.finish()
+    return graph
+
+
+def read_graph(col, batch_size=1000):
+    return build_graph(read_records(col, batch_size))
+
+
+def record_hash(disease_records):
+    return hashlib.md5(json.dumps(disease_records, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_state(path):
+    '''
+    上次写入图谱时的记录
+    :return: 疾病名 -> (记录哈希, 记录列表)，没有状态文件时为空
+    '''
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    if state.get('version') != STATE_VERSION:
+        logging.warning('ignoring graph state %s with version %s', path, state.get('version'))
+        return {}
+    return state['records']
+
+
+def save_state(path, records):
+    '''
+    :param records: read_records 的结果
+    '''
+    state = {'version': STATE_VERSION,
+             'records': {name: (record_hash(disease_records), disease_records) for name, disease_records in records.items()}}
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def changed_records(state, records):
+    '''
+    :return: (记录有变化或新增的疾病名, 已删除的疾病名)
+    '''
+    changed = sorted(name for name, disease_records in records.items()
+                     if name not in state or state[name][0] != record_hash(disease_records))
+    removed = sorted(set(state) - set(records))
+    return changed, removed
+
+
+class GraphDiff:
+    '''
+    两个 GraphData 之间的差异
+    '''
+    def __init__(self, old, new):
+        self.new = new
+        self.added_nodes = {label: sorted(new.nodes[label].keys() - old.nodes[label].keys()) for label in LABELS}
+        self.removed_nodes = {label: sorted(old.nodes[label].keys() - new.nodes[label].keys()) for label in LABELS}
+        # 属性有变化的已有节点
+        self.changed_nodes = {label: sorted(name for name in new.nodes[label].keys() & old.nodes[label].keys()
+                                            if new.nodes[label][name] != old.nodes[label][name]) for label in LABELS}
+        self.added_edges = {relation: sorted(new.edges[relation] - old.edges[relation]) for relation in new.edges}
+        self.removed_edges = {relation: sorted(old.edges[relation] - new.edges[relation]) for relation in new.edges}
+
+    def counts(self):
+        return {key: sum(len(values) for values in getattr(self, key).values())
+                for key in ('added_nodes', 'removed_nodes', 'changed_nodes', 'added_edges', 'removed_edges')}
+
+    def changed_entities(self):
+        '''
+        增删或属性变化的节点，以及增删的关系两端的节点：以它们为查询实体的答案可能变化
+        '''
+        entities = set()
+        for nodes in (self.added_nodes, self.removed_nodes, self.changed_nodes):
+            for names in nodes.values():
+                entities.update(names)
+        for edges in (self.added_edges, self.removed_edges):
+            for relation_edges in edges.values():
+                for src, dst in relation_edges:
+                    entities.add(src)
+                    entities.add(dst)
+        return sorted(entities)
+
+    def region_words(self):
+        '''
+        :return: 与 /admin/region/words 请求体相同的 {'add': {实体类型: [词]}, 'remove': {...}}
+        '''
+        return {key: {LABEL_ENTITY_TYPES.get(label, label): names for label, names in nodes.items() if names}
+                for key, nodes in (('add', self.added_nodes), ('remove', self.removed_nodes))}
+
+    def changed_labels(self):
+        return [label for label in LABELS if self.added_nodes[label] or self.removed_nodes[label]]
+
+
+def write_region_words(graph, region_dir, labels=None):
+    '''
+    每个标签的节点名写入对应的领域词表文件（先写临时文件再替换，运行中的服务 reload 时不会读到一半）
+    :param labels: 只写这些标签，为空时全部
+    '''
+    os.makedirs(region_dir, exist_ok=True)
+    for label, file_name in LABEL_FILES:
+        if labels is not None and label not in labels:
+            continue
+        path = os.path.join(region_dir, file_name)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(''.join(name + '\n' for name in sorted(graph.nodes[label])))
+        os.replace(tmp_path, path)
+
+
+def write_csv(graph, csv_dir):
+    '''
+    写出 neo4j-admin import 使用的 CSV，每个标签和每种 (起点标签, 关系, 终点标签) 一个文件，
+    节点名作为各标签自己的 ID 空间
+    :return: neo4j-admin import 的参数列表
+    '''
+    os.makedirs(csv_dir, exist_ok=True)
+    args = []
+    for label in LABELS:
+        path = os.path.join(csv_dir, 'nodes-%s.csv' % label)
+        props = DISEASE_PROPS if label == 'Disease' else []
+        header = ['name:ID(%s)' % label] + [prop + (':string[]' if prop in DISEASE_LIST_PROPS else '') for prop in props]
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for name, node in sorted(graph.nodes[label].items()):
+                row = [name]
+                for prop in props:
+                    value = node.get(prop, '')
+                    if prop in DISEASE_LIST_PROPS:
+                        value = ARRAY_DELIMITER.join(item.replace(ARRAY_DELIMITER, '；') for item in value)
+                    row.append(value)
+                writer.writerow(row)
+        args.append('--nodes=%s=%s' % (label, path))
+    for relation in graph.edges:
+        src_label, rel_type, dst_label, rel_name = relation
+        path = os.path.join(csv_dir, 'rels-%s-%s-%s.csv' % (src_label, rel_type, dst_label))
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([':START_ID(%s)' % src_label, ':END_ID(%s)' % dst_label, 'name'])
+            for src, dst in graph.edge_rows(relation):
+                writer.writerow([src, dst, rel_name])
+        args.append('--relationships=%s=%s' % (rel_type, path))
+    return ['--multiline-fields=true'] + args
+
+
+def batches(rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
+def load_cypher(run, graph, batch_size=1000):
+    '''
+    用 UNWIND ... MERGE 按批写入，每条语句（batch_size 行）一个事务；先建唯一约束，MERGE 才能走索引
+    :param run: run(cypher, params)，如 py2neo.Graph.run
+    :return: dict 执行的语句数 statements 与写入的行数 rows
+    '''
+    for label in LABELS:
+        run('CREATE CONSTRAINT IF NOT EXISTS FOR (n:%s) REQUIRE n.name IS UNIQUE' % label, {})
+    return apply_diff(run, GraphDiff(GraphData(), graph), batch_size)
+
+
+def apply_diff(run, diff, batch_size=1000):
+    '''
+    把差异按批写入图谱：先删关系和节点，再写入新增和属性有变化的节点，最后加关系
+    :return: dict 执行的语句数 statements 与涉及的行数 rows
+    '''
+    result = {'statements': 0, 'rows': 0}
+
+    def execute(cypher, rows, **params):
+        for batch in batches(rows, batch_size):
+            run(cypher, dict(params, rows=batch))
+            result['statements'] += 1
+            result['rows'] += len(batch)
+
+    for (src_label, rel_type, dst_label, rel_name), edges in diff.removed_edges.items():
+        cypher = ('UNWIND $rows AS row MATCH (m:%s {name: row[0]})-[r:%s]->(n:%s {name: row[1]}) DELETE r'
+                  % (src_label, rel_type, dst_label))
+        execute(cypher, [list(edge) for edge in edges])
+    for label, names in diff.removed_nodes.items():
+        execute('UNWIND $rows AS name MATCH (n:%s {name: name}) DETACH DELETE n' % label, names)
+    for label in LABELS:
+        nodes = diff.new.nodes[label]
+        rows = [dict(nodes[name], name=name) for name in sorted(diff.added_nodes[label] + diff.changed_nodes[label])]
+        execute('UNWIND $rows AS row MERGE (n:%s {name: row.name}) SET n = row' % label, rows)
+    for (src_label, rel_type, dst_label, rel_name), edges in diff.added_edges.items():
+        cypher = ('UNWIND $rows AS row MATCH (m:%s {name: row[0]}) MATCH (n:%s {name: row[1]}) '
+                  'MERGE (m)-[r:%s]->(n) SET r.name = $name') % (src_label, dst_label, rel_type)
+        execute(cypher, [list(edge) for edge in edges], name=rel_name)
+    return result
+
+
+def notify_server(url, diff, token=None, timeout=30):
+    '''
+    通知问答服务：/admin/region/words 增删领域词并写回词表文件，/admin/graph/changed 使变化实体的查询缓存失效；
+    两者都经问答服务的变更日志作用于全部 worker
+    '''
+    token = token or os.environ.get('QA_ADMIN_TOKEN', '')
+    requests = [('/admin/graph/changed', {'entities': diff.changed_entities()})]
+    words = diff.region_words()
+    if words['add'] or words['remove']:
+        requests.insert(0, ('/admin/region/words', dict(words, persist=True)))
+    for path, payload in requests:
+        request = urllib.request.Request(url.rstrip('/') + path, data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json', 'X-Admin-Token': token})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            logging.info('%s: %s', path, response.read().decode('utf-8'))
+
+
+def connect_graph():
+    from py2neo import Graph
+    return Graph(os.environ.get('NEO4J_URI', 'bolt://localhost:7687'),
+                 auth=(os.environ.get('NEO4J_USER', 'neo4j'), os.environ.get('NEO4J_PASSWORD', '0314')))
+
+
+def update_incremental(records, state, run, region_dir=None, batch_size=1000):
+    '''
+    :param records: read_records 的结果
+    :param state: load_state 的结果
+    :param run: run(cypher, params)，为空时不写入图谱
+    :return: GraphDiff，没有记录变化时为 None
+    '''
+    changed, removed = changed_records(state, records)
+    logging.info('%d diseases changed, %d removed', len(changed), len(removed))
+    if not changed and not removed:
+        return None
+    old = build_graph({name: disease_records for name, (_, disease_records) in state.items()})
+    diff = GraphDiff(old, build_graph(records))
+    logging.info('graph diff: %s', diff.counts())
+    if run is not None:
+        logging.info('applied %s', apply_diff(run, diff, batch_size))
+    if region_dir:
+        write_region_words(diff.new, region_dir, diff.changed_labels())
+    return diff
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', help='写出 neo4j-admin import 的 CSV 到该目录，而不写入 Neo4j')
+    parser.add_argument('--batch-size', type=int, default=1000, help='每个事务写入的节点或关系数')
+    parser.add_argument('--region-dir', default='data/region_words', help='重新生成的领域词表目录，为空时不生成')
+    parser.add_argument('--state', default=STATE_PATH, help='上次写入图谱的记录及其哈希')
+    parser.add_argument('--incremental', action='store_true', help='只写入与 --state 相比的变化')
+    parser.add_argument('--notify', help='问答服务地址，增量更新后通知其更新领域词典和查询缓存（需要 QA_ADMIN_TOKEN）')
+    parser.add_argument('--changes', help='增量更新时把变化的实体和领域词写入该 JSON 文件')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    import pymongo
+    start = time.perf_counter()
+    records = read_records(pymongo.MongoClient()['medical']['medical'])
+    logging.info('read %d diseases in %.1fs', len(records), time.perf_counter() - start)
+    start = time.perf_counter()
+    if args.incremental:
+        # 通知服务时由服务写回词表文件
+        diff = update_incremental(records, load_state(args.state), connect_graph().run,
+                                  None if args.notify else args.region_dir, args.batch_size)
+        if diff is not None:
+            if args.changes:
+                with open(args.changes, 'w', encoding='utf-8') as f:
+                    json.dump({'entities': diff.changed_entities(), 'region_words': diff.region_words()}, f,
+                              ensure_ascii=False)
+            if args.notify:
+                notify_server(args.notify, diff)
+        logging.info('incremental update done in %.1fs', time.perf_counter() - start)
+    else:
+        graph = build_graph(records)
+        logging.info('graph %s', graph.counts())
+        if args.region_dir:
+            write_region_words(graph, args.region_dir)
+        if args.csv:
+            import_args = write_csv(graph, args.csv)
+            logging.info('csv written in %.1fs, import into an empty database with:\nneo4j-admin import %s',
+                         time.perf_counter() - start, ' '.join(import_args))
+        else:
+            result = load_cypher(connect_graph().run, graph, args.batch_size)
+            logging.info('loaded %s in %.1fs', result, time.perf_counter() - start)
+    save_state(args.state, records)
@@ -1,28 +1,278 @@
 # coding: utf-8
+'''
+并发、可断点续爬的疾病页面采集
 
+    python data_spider.py [--base-url http://jib.xywy.com] [--workers 8] [--rate 4] [--checkpoint spider.checkpoint]
+    python data_spider.py --inspect [--jc-url http://jck.xywy.com] [--checkpoint inspect.checkpoint]
+    python data_spider.py --recrawl [--inspect] [--checkpoint recrawl.checkpoint]
 
+每个页面（一种疾病的 8 个子页面）作为一个任务交给线程池；同一 host 的请求按 --rate（次/秒）限速，
+每个线程对每个 host 复用一个 keep-alive 连接，网络错误、429 和 5xx 按指数退避重试。
+完成的页面 ID 逐行追加到检查点文件，中断后重新运行会跳过这些页面；文档按 url upsert，重复抓取不会产生重复记录。
+每个子页面的 ETag / Last-Modified 和内容哈希保存在文档的 fetch_meta 中；--recrawl 时据此发条件请求，
+304 或内容哈希相同的子页面不再解析，整个页面都未变化时不写库。
+--recrawl 默认使用单独的检查点文件（recrawl.checkpoint / inspect-recrawl.checkpoint），不受首次抓取的检查点影响，
+中断后可续爬；一轮重新抓取完成后删除该文件，下一轮才会重新检查全部页面。
+base_url 可以指向本地的测试服务器（见 benchmarks/spider_fixture.py）。
+'''
 
-import urllib.request
+import argparse
+import hashlib
+import http.client
+import logging
+import os
+import random
+import threading
+import time
 import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from lxml import etree
 import pymongo
 import re
 
-'''基于司法网的犯罪案件采集'''
+
+# crawl_page 的返回值：页面内容与上次抓取时相同，没有解析和写入
+UNCHANGED = 'unchanged'
+
+# 未指定 --checkpoint 时的检查点文件：(--inspect, --recrawl) -> 路径
+DEFAULT_CHECKPOINTS = {
+    (False, False): 'spider.checkpoint',
+    (True, False): 'inspect.checkpoint',
+    (False, True): 'recrawl.checkpoint',
+    (True, True): 'inspect-recrawl.checkpoint',
+}
+
+# 一种疾病的子页面：(子页面名, 文档字段, 解析方法)
+PAGE_SECTIONS = [
+    ('gaishu', 'basic_info', 'basicinfo_spider'),
+    ('cause', 'cause_info', 'common_spider'),
+    ('prevent', 'prevent_info', 'common_spider'),
+    ('symptom', 'symptom_info', 'symptom_spider'),
+    ('inspect', 'inspect_info', 'inspect_spider'),
+    ('treat', 'treat_info', 'treat_spider'),
+    ('food', 'food_info', 'food_spider'),
+    ('drug', 'drug_info', 'drug_spider'),
+]
+
+
+class FetchError(Exception):
+    '''请求失败，status 为最后一次响应的状态码，网络错误时为 None'''
+    def __init__(self, url, status=None, reason=''):
+        Exception.__init__(self, '%s: %s %s' % (url, status, reason))
+        self.url = url
+        self.status = status
+
+
+class RateLimiter:
+    '''按 host 限速，同一 host 相邻两次请求的发出时间至少间隔 1/rate 秒，rate 为 0 时不限速'''
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_time = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time.get(host, now))
+            self.next_time[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class HttpFetcher:
+    '''
+    复用连接的 HTTP 客户端：每个线程对每个 host 保持一个 keep-alive 连接
+    网络错误、429 和 5xx 按指数退避重试（backoff * 2^n，加随机抖动），其他非 200 响应直接失败
+    '''
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, rate=0, retries=3, backoff=0.5, timeout=10, headers=None):
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'connections': 0, 'bytes': 0, 'not_modified': 0}
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def connection(self, scheme, netloc):
+        connections = self.local.__dict__.setdefault('connections', {})
+        conn = connections.get((scheme, netloc))
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conn = connections[(scheme, netloc)] = conn_class(netloc, timeout=self.timeout)
+            self.count('connections')
+        return conn
+
+    def close_connection(self, scheme, netloc):
+        conn = self.local.__dict__.get('connections', {}).pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def request(self, url, headers=None):
+        '''
+        发送一次请求
+        :param headers: 附加的请求头
+        :return: (状态码, 响应头, 响应体)
+        '''
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        self.limiter.wait(parts.netloc)
+        self.count('requests')
+        conn = self.connection(parts.scheme, parts.netloc)
+        try:
+            conn.request('GET', path, headers=dict(self.headers, **headers) if headers else self.headers)
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            # 服务端关闭了 keep-alive 连接等情况，下次重新建立连接
+            self.close_connection(parts.scheme, parts.netloc)
+            raise
+        if response.will_close:
+            self.close_connection(parts.scheme, parts.netloc)
+        self.count('bytes', len(body))
+        return response.status, response.headers, body
+
+    def get(self, url, max_redirects=3):
+        '''
+        :return: 响应体 bytes
+        '''
+        return self.fetch(url, max_redirects=max_redirects)[2]
+
+    def fetch(self, url, headers=None, max_redirects=3):
+        '''
+        :param headers: 附加的请求头，如条件请求的 If-None-Match / If-Modified-Since
+        :return: (状态码 200 或 304, 响应头, 响应体 bytes)
+        '''
+        attempt = 0
+        while True:
+            status, reason = None, ''
+            try:
+                status, response_headers, body = self.request(url, headers)
+                if status == 200:
+                    return status, response_headers, body
+                if status == 304:
+                    self.count('not_modified')
+                    return status, response_headers, body
+                if status in (301, 302, 303, 307, 308) and response_headers.get('Location') and max_redirects > 0:
+                    url = urllib.parse.urljoin(url, response_headers['Location'])
+                    max_redirects -= 1
+                    continue
+            except (OSError, http.client.HTTPException) as e:
+                reason = repr(e)
+            if (status is not None and status not in self.RETRY_STATUS) or attempt >= self.retries:
+                raise FetchError(url, status, reason)
+            self.count('retries')
+            time.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+            attempt += 1
+
+
+class Checkpoint:
+    '''已完成的页面 ID，每完成一页追加一行并立即写盘，重新运行时跳过'''
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.done = set(int(line) for line in f if line.strip())
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+        self.lock = threading.Lock()
+
+    def __contains__(self, page):
+        return page in self.done
+
+    def add(self, page):
+        with self.lock:
+            self.done.add(page)
+            if self.file is not None:
+                self.file.write('%d\n' % page)
+                self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+'''基于寻医问药网的疾病页面采集'''
 class CrimeSpider:
-    def __init__(self):
-        self.conn = pymongo.MongoClient()
-        self.db = self.conn['medical'] # 创建数据库
+    def __init__(self, base_url='http://jib.xywy.com', jc_url='http://jck.xywy.com', db=None,
+                 workers=8, rate=4, retries=3, backoff=0.5, timeout=10, recrawl=False):
+        '''
+        :param db: mongo 数据库，为空时连接本机的 medical 库
+        :param rate: 每个 host 每秒的请求数上限，0 为不限速
+        :param recrawl: 按上次保存的 ETag / Last-Modified 发条件请求，内容（哈希）未变化的子页面不再解析，
+                        整个页面都未变化时不写库
+        '''
+        if db is None:
+            self.conn = pymongo.MongoClient()
+            db = self.conn['medical'] # 创建数据库
+        self.db = db
         self.col = self.db['data'] # 获取collection，类似于关系数据库的表
+        self.base_url = base_url.rstrip('/')
+        self.jc_url = jc_url.rstrip('/')
+        self.workers = workers
+        self.recrawl = recrawl
+        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                                 'Chrome/51.0.2704.63 Safari/537.36'}
+        self.fetcher = HttpFetcher(rate, retries, backoff, timeout, headers)
 
     '''根据url，请求html'''
     def get_html(self, url):
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                                 'Chrome/51.0.2704.63 Safari/537.36'}
-        req = urllib.request.Request(url=url, headers=headers)
-        res = urllib.request.urlopen(req)
-        html = res.read().decode('gbk')
-        return html
+        return self.fetcher.get(url).decode('gbk')
+
+    def fetch_html(self, url, meta=None):
+        '''
+        :param meta: 上次抓取时保存的 {'etag', 'last_modified', 'hash'}，有则发条件请求
+        :return: (html，未变化（304 或哈希相同）时为 None, 本次的 meta)
+        '''
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        status, response_headers, body = self.fetcher.fetch(url, headers)
+        if status == 304:
+            return None, meta
+        new_meta = {'hash': hashlib.md5(body).hexdigest()}
+        for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+            if response_headers.get(header):
+                new_meta[key] = response_headers[header]
+        if meta and meta.get('hash') == new_meta['hash']:
+            return None, new_meta
+        return body.decode('gbk'), new_meta
+
+    def fetch_meta(self, col, url):
+        '''
+        :return: 上次抓取时保存的 fetch_meta，非 recrawl 或没有时为空
+        '''
+        if not self.recrawl:
+            return {}
+        doc = col.find_one({'url': url}, {'_id': 0, 'fetch_meta': 1})
+        return (doc or {}).get('fetch_meta') or {}
+
+    def save_page(self, col, url, data, meta, old_meta, full):
+        '''
+        :param full: data 包含全部字段，整篇替换；否则只更新有变化的字段
+        :return: 整个页面都未变化时为 UNCHANGED
+        '''
+        if not data:
+            # 内容相同但校验信息变化（如服务端开始返回 ETag）时只更新 fetch_meta
+            if meta != old_meta:
+                col.update_one({'url': url}, {'$set': {'fetch_meta': meta}})
+            return UNCHANGED
+        if full:
+            col.replace_one({'url': url}, dict(data, url=url, fetch_meta=meta), upsert=True)
+        else:
+            col.update_one({'url': url}, {'$set': dict(data, fetch_meta=meta)})
 
     '''url解析'''
     def url_parser(self, content):
@@ -30,38 +280,77 @@ class CrimeSpider:
         urls = ['http://www.anliguan.com' + i for i in  selector.xpath('//h2[@class="item-title"]/a/@href')]
         return urls
 
-    '''测试'''
-    def spider_main(self):
-        for page in range(1, 11000):
-            try:
-                basic_url = 'http://jib.xywy.com/il_sii/gaishu/%s.htm'%page
-                cause_url = 'http://jib.xywy.com/il_sii/cause/%s.htm'%page
-                prevent_url = 'http://jib.xywy.com/il_sii/prevent/%s.htm'%page
-                symptom_url = 'http://jib.xywy.com/il_sii/symptom/%s.htm'%page
-                inspect_url = 'http://jib.xywy.com/il_sii/inspect/%s.htm'%page
-                treat_url = 'http://jib.xywy.com/il_sii/treat/%s.htm'%page
-                food_url = 'http://jib.xywy.com/il_sii/food/%s.htm'%page
-                drug_url = 'http://jib.xywy.com/il_sii/drug/%s.htm'%page
-                data = {}
-                data['url'] = basic_url
-                data['basic_info'] = self.basicinfo_spider(basic_url)
-                data['cause_info'] =  self.common_spider(cause_url)
-                data['prevent_info'] =  self.common_spider(prevent_url)
-                data['symptom_info'] = self.symptom_spider(symptom_url)
-                data['inspect_info'] = self.inspect_spider(inspect_url)
-                data['treat_info'] = self.treat_spider(treat_url)
-                data['food_info'] = self.food_spider(food_url)
-                data['drug_info'] = self.drug_spider(drug_url)
-                print(page, basic_url)
-                self.col.insert(data)
+    def crawl(self, pages, crawl_page, checkpoint_path=None):
+        '''
+        并发抓取 pages 中尚未完成的页面，crawl_page(page) 抓取并保存一页（内容未变化时返回 UNCHANGED），
+        成功或页面不存在（404）时记入检查点，其他失败的页面下次运行时重试；同时在途的页面数不超过 workers 的两倍
+        :return: dict 各结果的页面数 done / unchanged / missing / failed / skipped
+        '''
+        checkpoint = Checkpoint(checkpoint_path)
+        result = {'done': 0, 'unchanged': 0, 'missing': 0, 'failed': 0, 'skipped': 0}
+        pending = {}
 
+        def finish(future):
+            page = pending.pop(future)
+            try:
+                result['unchanged' if future.result() == UNCHANGED else 'done'] += 1
+            except FetchError as e:
+                if e.status != 404:
+                    result['failed'] += 1
+                    logging.warning('page %s failed: %s', page, e)
+                    return
+                result['missing'] += 1
             except Exception as e:
-                print(e, page)
-        return
+                result['failed'] += 1
+                logging.warning('page %s failed: %r', page, e)
+                return
+            checkpoint.add(page)
+
+        try:
+            with ThreadPoolExecutor(self.workers) as executor:
+                for page in pages:
+                    if page in checkpoint:
+                        result['skipped'] += 1
+                        continue
+                    if len(pending) >= self.workers * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            finish(future)
+                    pending[executor.submit(crawl_page, page)] = page
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future)
+        finally:
+            checkpoint.close()
+        return result
+
+    '''一种疾病的 8 个子页面'''
+    def page_urls(self, page):
+        return {name: '%s/il_sii/%s/%s.htm' % (self.base_url, name, page)
+                for name in ['gaishu', 'cause', 'prevent', 'symptom', 'inspect', 'treat', 'food', 'drug']}
+
+    '''抓取并保存一种疾病'''
+    def crawl_page(self, page):
+        urls = self.page_urls(page)
+        url = urls['gaishu']
+        old_meta = self.fetch_meta(self.col, url)
+        data = {}
+        meta = {}
+        for name, field, parser in PAGE_SECTIONS:
+            html, meta[name] = self.fetch_html(urls[name], old_meta.get(name))
+            if html is not None:
+                data[field] = getattr(self, parser)(html)
+        outcome = self.save_page(self.col, url, data, meta, old_meta, len(data) == len(PAGE_SECTIONS))
+        logging.info('%s %s %s', page, url, outcome or '')
+        return outcome
+
+    '''测试'''
+    def spider_main(self, start=1, end=11000, checkpoint_path=None):
+        return self.crawl(range(start, end), self.crawl_page, checkpoint_path)
 
     '''基本信息解析'''
-    def basicinfo_spider(self, url):
-        html = self.get_html(url)
+    def basicinfo_spider(self, html):
         selector = etree.HTML(html)
         title = selector.xpath('//title/text()')[0]
         category = selector.xpath('//div[@class="wrap mt10 nav-bar"]/a/text()')
@@ -79,8 +368,7 @@ class CrimeSpider:
         return basic_data
 
     '''treat_infobox治疗解析'''
-    def treat_spider(self, url):
-        html = self.get_html(url)
+    def treat_spider(self, html):
         selector = etree.HTML(html)
         ps = selector.xpath('//div[starts-with(@class,"mt20 articl-know")]/p')
         infobox = []
@@ -90,15 +378,13 @@ class CrimeSpider:
         return infobox
 
     '''treat_infobox治疗解析'''
-    def drug_spider(self, url):
-        html = self.get_html(url)
+    def drug_spider(self, html):
         selector = etree.HTML(html)
         drugs = [i.replace('\n','').replace('\t', '').replace(' ','') for i in selector.xpath('//div[@class="fl drug-pic-rec mr30"]/p/a/text()')]
         return drugs
 
     '''food治疗解析'''
-    def food_spider(self, url):
-        html = self.get_html(url)
+    def food_spider(self, html):
         selector = etree.HTML(html)
         divs = selector.xpath('//div[@class="diet-img clearfix mt20"]')
         try:
@@ -112,8 +398,7 @@ class CrimeSpider:
         return food_data
 
     '''症状信息解析'''
-    def symptom_spider(self, url):
-        html = self.get_html(url)
+    def symptom_spider(self, html):
         selector = etree.HTML(html)
         symptoms = selector.xpath('//a[@class="gre" ]/text()')
         ps = selector.xpath('//p')
@@ -127,15 +412,13 @@ class CrimeSpider:
         return symptoms, detail
 
     '''检查信息解析'''
-    def inspect_spider(self, url):
-        html = self.get_html(url)
+    def inspect_spider(self, html):
         selector = etree.HTML(html)
         inspects  = selector.xpath('//li[@class="check-item"]/a/@href')
         return inspects
 
     '''通用解析模块'''
-    def common_spider(self, url):
-        html = self.get_html(url)
+    def common_spider(self, html):
         selector = etree.HTML(html)
         ps = selector.xpath('//p')
         infobox = []
@@ -147,20 +430,40 @@ class CrimeSpider:
 
         
     '''检查项抓取模块'''
-    def inspect_crawl(self):
-        for page in range(1, 3685):
-            try:
-                url = 'http://jck.xywy.com/jc_%s.html'%page
-                html = self.get_html(url)
-                data = {}
-                data['url']= url
-                data['html'] = html
-                self.db['jc'].insert(data)
-                print(url)
-            except Exception as e:
-                print(e)
+    def inspect_page(self, page):
+        url = '%s/jc_%s.html' % (self.jc_url, page)
+        col = self.db['jc']
+        old_meta = self.fetch_meta(col, url)
+        html, meta = self.fetch_html(url, old_meta.get('html'))
+        outcome = self.save_page(col, url, {'html': html} if html is not None else {}, {'html': meta},
+                                 old_meta, True)
+        logging.info('%s %s', url, outcome or '')
+        return outcome
+
+    def inspect_crawl(self, start=1, end=3685, checkpoint_path=None):
+        return self.crawl(range(start, end), self.inspect_page, checkpoint_path)
+
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://jib.xywy.com')
+    parser.add_argument('--jc-url', default='http://jck.xywy.com')
+    parser.add_argument('--inspect', action='store_true', help='抓取检查项页面')
+    parser.add_argument('--start', type=int, default=1)
+    parser.add_argument('--end', type=int, help='不含，默认疾病 11000、检查项 3685')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=4, help='每个 host 每秒的请求数上限，0 为不限速')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--checkpoint', help='检查点文件，默认见 DEFAULT_CHECKPOINTS，--recrawl 时与首次抓取分开')
+    parser.add_argument('--recrawl', action='store_true', help='条件请求，跳过未变化的页面')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
 
-handler = CrimeSpider()
-# handler.inspect_crawl()
-handler.spider_main()
\ No newline at end of file
+    handler = CrimeSpider(args.base_url, args.jc_url, workers=args.workers, rate=args.rate, retries=args.retries,
+                          recrawl=args.recrawl)
+    checkpoint = args.checkpoint or DEFAULT_CHECKPOINTS[args.inspect, args.recrawl]
+    if args.inspect:
+        result = handler.inspect_crawl(args.start, args.end or 3685, checkpoint)
+    else:
+        result = handler.spider_main(args.start, args.end or 11000, checkpoint)
+    logging.info('%s %s', result, handler.fetcher.stats)
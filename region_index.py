@@ -0,0 +1,416 @@
+# -*- coding:utf-8 -*-
+'''
+领域词典的离线编译与加载
+
+把 data/region_words 下的六个实体词表、实体类型字典和 actree 一次性编译成
+带版本号的 pickle 文件，worker 启动时直接反序列化，不再逐词重建自动机。
+
+离线构建：
+    python region_index.py [region_dir] [index_path]
+
+运行中更新词典见 QuestionClassifier.reload / update_words：新索引在子进程中构建并写入文件
+（make_automaton 执行期间一直持有 GIL，放在本进程的线程中会阻塞所有请求），本进程只反序列化结果后整体替换。
+子进程由 forkserver 产生而不是直接从 worker fork：worker 有多个线程，fork 时其他线程持有的锁会在子进程中永远无法释放。
+'''
+from array import array
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+
+import ahocorasick
+
+# 索引文件格式版本，结构变化时递增，旧版本文件会触发重建
+INDEX_VERSION = 3
+
+REGION_DIR = 'data/region_words'
+INDEX_PATH = 'data/region_index.pkl'
+
+
+def region_checksum(region_dir, region_files):
+    '''
+    计算实体词表的校验和，用于判断索引文件是否过期
+    '''
+    sha1 = hashlib.sha1()
+    for file_name in region_files:
+        sha1.update(file_name.encode('utf-8'))
+        with open(os.path.join(region_dir, file_name), 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+def load_words(path):
+    return [word.strip() for word in open(path, encoding='utf-8') if word.strip()]
+
+
+def file_stamps(paths):
+    '''
+    :return: 路径 -> (修改时间, 大小)，文件不存在时为 None，用于轮询词表是否变化
+    '''
+    stamps = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps[path] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamps[path] = None
+    return stamps
+
+
+class WordPool(object):
+    '''
+    全部领域词拼接成的一个字符串，词 ID 为词的序号，第 i 个词为 text[offsets[i]:offsets[i + 1]]
+    相比每个词一个 str 对象（另有列表、字典中的引用），每个词只多 4 字节的偏移
+    '''
+    def __init__(self, text, offsets):
+        self.text = text
+        self.offsets = offsets
+
+    @classmethod
+    def from_words(cls, words):
+        return cls(''.join(words), array('I', itertools.accumulate((len(word) for word in words), initial=0)))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, ind):
+        return self.text[self.offsets[ind]:self.offsets[ind + 1]]
+
+    def __iter__(self):
+        text, offsets = self.text, self.offsets
+        return (text[offsets[ind]:offsets[ind + 1]] for ind in range(len(offsets) - 1))
+
+    def word_length(self, ind):
+        return self.offsets[ind + 1] - self.offsets[ind]
+
+    def extend(self, words):
+        '''
+        :return: 追加了 words 的新词池，原词池不变
+        '''
+        offsets = array('I', self.offsets)
+        end = offsets[-1]
+        for word in words:
+            end += len(word)
+            offsets.append(end)
+        return WordPool(self.text + ''.join(words), offsets)
+
+
+def build_word_pool(type_words):
+    '''
+    一次线性扫描构建词池与实体类型位掩码
+    :param type_words: 按实体类型位置排列的词列表，第 i 个列表中的词置第 i 位
+    :return: (WordPool, array('B') 第 i 个词的实体类型位掩码)
+    '''
+    word_ids = {}
+    words = []
+    word_types = array('B')
+    for type_ind, type_list in enumerate(type_words):
+        bit = 1 << type_ind
+        for word in type_list:
+            ind = word_ids.get(word)
+            if ind is None:
+                word_ids[word] = len(words)
+                words.append(word)
+                word_types.append(bit)
+            else:
+                word_types[ind] |= bit
+    return WordPool.from_words(words), word_types
+
+
+class EntityIndex(object):
+    '''
+    实体类型索引，一个词可能对应多种类型 (eg. 肺栓塞 [Disease, Symptom])
+    词存放在 WordPool 中，类型以位掩码存放在 word_types 中（第 i 位对应 types[i]），
+    词 -> 词 ID 的查找直接使用 actree（值为词 ID）；位掩码为 0 的词已被删除，不在 actree 中
+    '''
+    def __init__(self, pool, word_types, actree, types):
+        self.pool = pool
+        self.word_types = word_types
+        self.actree = actree
+        self.types = list(types)
+        # 位掩码 -> 实体类型元组，类型数很少，全部预先展开
+        self.mask_types = [tuple(t for i, t in enumerate(self.types) if mask >> i & 1)
+                           for mask in range(1 << len(self.types))]
+        self.type_bits = {t: 1 << i for i, t in enumerate(self.types)}
+
+    def __len__(self):
+        return len(self.actree)
+
+    def __contains__(self, word):
+        return self.actree.exists(word)
+
+    def __iter__(self):
+        pool = self.pool
+        return (pool[ind] for ind, mask in enumerate(self.word_types) if mask)
+
+    def mask(self, word):
+        ind = self.actree.get(word, -1)
+        return self.word_types[ind] if ind >= 0 else 0
+
+    def types_of(self, ind):
+        '''
+        :return: 词 ID 对应的实体类型元组
+        '''
+        return self.mask_types[self.word_types[ind]]
+
+    def lookup(self, word):
+        '''
+        :return: 词对应的实体类型元组，不在词典中返回空元组
+        '''
+        return self.mask_types[self.mask(word)]
+
+    def has_type(self, word, entity_type):
+        return bool(self.mask(word) & self.type_bits[entity_type])
+
+    def words_of(self, entity_type):
+        return type_words(self.pool, self.word_types, self.type_bits[entity_type])
+
+
+def type_words(pool, word_types, bit):
+    return [pool[ind] for ind, mask in enumerate(word_types) if mask & bit]
+
+
+class RegionState(object):
+    '''
+    一个版本的领域词典，更新时整体替换；使用方先取出 state，再使用其中的 actree 与 entity_index，两者版本一致
+    '''
+    def __init__(self, region_index, types):
+        self.region_index = region_index
+        self.checksum = region_index.get('checksum')
+        self.entity_index = EntityIndex(region_index['words'], region_index['types'], region_index['actree'], types)
+        self.actree = region_index['actree']
+
+
+def build_actree(pool, word_types):
+    '''
+    构建actree，值为词 ID（STORE_INTS，不为每个词保存 Python 对象），所有词加入后只调用一次 make_automaton
+    '''
+    actree = ahocorasick.Automaton(ahocorasick.STORE_INTS)
+    for ind, word in enumerate(pool):
+        if word_types[ind]:
+            actree.add_word(word, ind)
+    actree.make_automaton()
+    return actree
+
+
+def build_trigger_tree(category_words):
+    '''
+    构建触发词actree，词的值为其所属类别的集合（同一个词可能出现在多个类别，或在同一类别中重复）
+    :param category_words: 类别 -> 触发词列表
+    '''
+    word_categories = {}
+    for category, words in category_words.items():
+        for word in words:
+            word_categories.setdefault(word, set()).add(category)
+    actree = ahocorasick.Automaton()
+    for word, categories in word_categories.items():
+        actree.add_word(word, frozenset(categories))
+    actree.make_automaton()
+    return actree
+
+
+def build_region_index(region_dir, region_files):
+    '''
+    :param region_files: 实体词表文件名列表，实体类型用其在列表中的位置表示
+    :return: dict
+    version : 索引格式版本
+    checksum : 源词表校验和
+    words : WordPool 去重后的全部领域词
+    types : array('B') 各词的实体类型位掩码，见 EntityIndex
+    actree : 领域词 actree，值为词 ID
+    '''
+    pool, word_types = build_word_pool([load_words(os.path.join(region_dir, file_name)) for file_name in region_files])
+
+    return {
+        'version': INDEX_VERSION,
+        'checksum': region_checksum(region_dir, region_files),
+        'words': pool,
+        'types': word_types,
+        'actree': build_actree(pool, word_types),
+    }
+
+
+def update_region_index(region_index, add=None, remove=None):
+    '''
+    在已有索引上增删词，返回新索引，原索引不做修改（读取中的请求继续使用原索引）
+    新词追加到词池末尾，删除的词只清空类型位掩码，重新从词表构建索引时才移出词池；
+    只改变已有词的类型时沿用原 actree，否则新索引的 actree 为 None，由 finish_region_update 构建
+    :param add: 实体类型位置 -> 要加入的词列表
+    :param remove: 实体类型位置 -> 要删除的词列表
+    '''
+    actree = region_index['actree']
+    pool = region_index['words']
+    word_types = array('B', region_index['types'])
+    # 新词 -> 词 ID
+    new_ids = {}
+    removed = []
+
+    for type_ind, type_list in (remove or {}).items():
+        bit = 1 << type_ind
+        for word in type_list:
+            ind = actree.get(word.strip(), -1)
+            if ind >= 0 and word_types[ind] & bit:
+                word_types[ind] &= ~bit
+                removed.append(ind)
+
+    for type_ind, type_list in (add or {}).items():
+        bit = 1 << type_ind
+        for word in type_list:
+            word = word.strip()
+            if not word:
+                continue
+            ind = actree.get(word, -1)
+            if ind < 0:
+                ind = new_ids.setdefault(word, len(word_types))
+                if ind == len(word_types):
+                    word_types.append(0)
+            word_types[ind] |= bit
+
+    same_words = not new_ids and all(word_types[ind] for ind in removed)
+    return {
+        'version': INDEX_VERSION,
+        'checksum': None,
+        'words': pool.extend(list(new_ids)) if new_ids else pool,
+        'types': word_types,
+        'actree': actree if same_words else None,
+    }
+
+
+def save_region_words(region_dir, region_files, region_index, type_inds):
+    '''
+    把 type_inds 中各实体类型的词写回对应的词表文件
+    '''
+    for type_ind in type_inds:
+        path = os.path.join(region_dir, region_files[type_ind])
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        words = type_words(region_index['words'], region_index['types'], 1 << type_ind)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(''.join(word + '\n' for word in words))
+        os.replace(tmp_path, path)
+
+
+def finish_region_update(region_index, type_inds, region_dir=None, region_files=None, index_path=None):
+    '''
+    在子进程中执行（见 build_in_child）：actree 为 None 时重建；给出 region_dir 时把 type_inds 中各类型的词表写回文件，
+    并把完整索引写入 index_path，供其他进程直接加载
+    :return: (新建的 actree，未重建时为 None, 词表校验和)
+    '''
+    actree = None
+    if region_index['actree'] is None:
+        actree = build_actree(region_index['words'], region_index['types'])
+        region_index = dict(region_index, actree=actree)
+    checksum = None
+    if region_dir is not None:
+        save_region_words(region_dir, region_files, region_index, type_inds)
+        checksum = region_checksum(region_dir, region_files)
+        save_region_index(dict(region_index, checksum=checksum), index_path)
+    return actree, checksum
+
+
+def rebuild_region_index(region_dir, region_files, index_path):
+    '''
+    在子进程中执行：从词表文件构建索引并写入 index_path
+    '''
+    region_index = build_region_index(region_dir, region_files)
+    try:
+        save_region_index(region_index, index_path)
+    except OSError as e:
+        logging.warning('failed to save region index %s: %s', index_path, e)
+    return region_index
+
+
+def save_region_index(region_index, index_path):
+    '''
+    先写临时文件再替换，避免其他 worker 读到写了一半的索引
+    '''
+    tmp_path = '%s.%d.tmp' % (index_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(region_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_path)
+
+
+def read_region_index(index_path):
+    with open(index_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _run_in_child(build, args, result_path):
+    with open(result_path, 'wb') as f:
+        pickle.dump(build(*args), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def child_context():
+    '''
+    build_in_child 使用的进程上下文：forkserver 由单线程的服务进程 fork 子进程，预先导入本模块（及 ahocorasick），
+    不支持 forkserver 的平台使用 spawn
+    '''
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def build_in_child(build, args):
+    '''
+    在子进程中执行 build(*args)，结果经临时文件传回；build 须为模块级函数，args 须可序列化
+    构建期间本进程的其他线程不受 GIL 影响，本进程只在序列化参数和读入结果时持有 GIL
+    '''
+    fd, result_path = tempfile.mkstemp(suffix='.pkl')
+    os.close(fd)
+    try:
+        process = child_context().Process(target=_run_in_child, args=(build, args, result_path))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError('building region index failed with exit code %s' % process.exitcode)
+        with open(result_path, 'rb') as f:
+            return pickle.load(f)
+    finally:
+        os.remove(result_path)
+
+
+def load_region_index(region_dir, index_path, region_files):
+    '''
+    加载预编译索引；文件缺失、版本不符或与源词表校验和不一致时，从源词表重建并回写
+    源词表不存在时（只部署了索引文件）直接使用索引
+    '''
+    try:
+        checksum = region_checksum(region_dir, region_files)
+    except FileNotFoundError:
+        checksum = None
+
+    region_index = None
+    if os.path.exists(index_path):
+        try:
+            region_index = read_region_index(index_path)
+        except Exception as e:
+            logging.warning('failed to load region index %s: %s', index_path, e)
+
+    if region_index is not None and region_index.get('version') == INDEX_VERSION:
+        if checksum is None or region_index.get('checksum') == checksum:
+            return region_index
+        logging.info('region index %s is out of date, rebuilding', index_path)
+
+    region_index = build_region_index(region_dir, region_files)
+    try:
+        save_region_index(region_index, index_path)
+    except OSError as e:
+        logging.warning('failed to save region index %s: %s', index_path, e)
+    return region_index
+
+
+if __name__ == '__main__':
+    # 通过模块名引用，使索引中的 WordPool 以 region_index.WordPool 而不是 __main__.WordPool 保存
+    import region_index
+    from QuestionClassifier import REGION_FILES
+
+    region_dir = sys.argv[1] if len(sys.argv) > 1 else REGION_DIR
+    index_path = sys.argv[2] if len(sys.argv) > 2 else INDEX_PATH
+    region_files = [file_name for _, file_name in REGION_FILES]
+    region_index.save_region_index(region_index.build_region_index(region_dir, region_files), index_path)
+    print('region index saved to', index_path)
@@ -0,0 +1,74 @@
+# -*- coding:utf-8 -*-
+from answer_cache import AnswerCache, estimate_size
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def rows(name, count=3):
+    return [{'m.name': name, 'n.name': '%s%d' % (name, i)} for i in range(count)]
+
+
+def test_lru_eviction_by_bytes():
+    size = estimate_size(rows('甲'))
+    cache = AnswerCache(max_bytes=size * 3, ttl=None)
+    for name in ('甲', '乙', '丙'):
+        cache.put(('disease_symptom', name), rows(name))
+    assert cache.stats()['bytes'] == size * 3
+    # 访问过的条目移到末尾，淘汰最久未使用的
+    assert cache.get(('disease_symptom', '甲')) == rows('甲')
+    cache.put(('disease_symptom', '丁'), rows('丁'))
+    assert cache.get(('disease_symptom', '乙')) is None
+    assert cache.get(('disease_symptom', '甲')) == rows('甲')
+    stats = cache.stats()
+    assert (stats['entries'], stats['evictions']) == (3, 1)
+    assert stats['bytes'] <= cache.max_bytes
+    # 超过容量的单个结果不缓存，也不挤掉其他条目
+    cache.put(('disease_symptom', '戊'), rows('戊', 100))
+    assert cache.get(('disease_symptom', '戊')) is None
+    assert cache.stats()['entries'] == 3
+
+
+def test_empty_rows_are_cached():
+    cache = AnswerCache(ttl=None)
+    cache.put(('disease_symptom', '甲'), [])
+    assert cache.get(('disease_symptom', '甲')) == []
+    assert cache.stats()['hits'] == 1
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = AnswerCache(ttl=10, clock=clock)
+    cache.put(('disease_symptom', '甲'), rows('甲'))
+    clock.now = 9.9
+    assert cache.get(('disease_symptom', '甲')) == rows('甲')
+    clock.now = 10.0
+    assert cache.get(('disease_symptom', '甲')) is None
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['expirations']) == (0, 0, 1)
+    # 重新写入时重新计时
+    cache.put(('disease_symptom', '甲'), rows('甲'))
+    clock.now = 19.0
+    assert cache.get(('disease_symptom', '甲')) == rows('甲')
+
+
+def test_invalidate_entities():
+    cache = AnswerCache(ttl=None)
+    for question_type in ('disease_symptom', 'disease_drug'):
+        for name in ('甲', '乙'):
+            cache.put((question_type, name), rows(name))
+    cache.invalidate_entities(['甲', '不存在'])
+    assert cache.get(('disease_symptom', '甲')) is None
+    assert cache.get(('disease_drug', '甲')) is None
+    assert cache.get(('disease_symptom', '乙')) == rows('乙')
+    assert cache.get(('disease_drug', '乙')) == rows('乙')
+    assert cache.stats()['bytes'] == estimate_size(rows('乙')) * 2
+    cache.invalidate([('disease_drug', '乙')])
+    assert cache.stats()['entries'] == 1
+    cache.clear()
+    assert cache.stats()['entries'] == cache.stats()['bytes'] == 0
@@ -0,0 +1,122 @@
+# -*- coding:utf-8 -*-
+import logging
+import random
+
+import mongomock
+import pytest
+
+from build_data import MedicalGraph, parse_jc
+from mongomock_compat import BulkCompatDatabase
+from synthetic import make_raw_records, random_word
+
+
+class SplitCutter:
+    '''代替 max_cut.CutWords：按空格切分'''
+    def max_biward_cut(self, text):
+        return text.split(' ')
+
+
+def make_db(docs, jc=40, seed=0):
+    rng = random.Random(seed)
+    db = mongomock.MongoClient()['medical']
+    jc_urls = ['http://jck.xywy.com/jc_%d.html' % i for i in range(jc)]
+    db['jc'].insert_many([{'url': url, 'name': random_word(rng, 4, 4), 'html': ''} for url in jc_urls])
+    db['data'].insert_many(list(make_raw_records(docs, jc_urls, seed)))
+    return db
+
+
+def make_graph(db):
+    return MedicalGraph(db=db, stop_words=[], cuter=SplitCutter())
+
+
+def legacy_collect(graph):
+    '''改造前的 collect_medical：每个检查项一次 find_one，每条记录一次写入'''
+    for item in graph.col.find():
+        if not item['basic_info']['name']:
+            continue
+        jc_names = {}
+        for url in item['inspect_info']:
+            res = graph.db['jc'].find_one({'url': url})
+            jc_names[url] = res['name'] if res else ''
+        graph.db['medical'].insert_one(graph.build_record(item, jc_names))
+
+
+def records(db):
+    return sorted((sorted((k, repr(v)) for k, v in record.items() if k != '_id') for record in db['medical'].find()))
+
+
+@pytest.fixture(scope='module')
+def legacy_records():
+    db = make_db(60)
+    legacy_collect(make_graph(db))
+    return records(db)
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 500])
+def test_collect_matches_legacy(legacy_records, batch_size):
+    db = make_db(60)
+    # 名称为空的原始记录被跳过
+    db['data'].insert_one({'basic_info': {'name': ''}, 'inspect_info': []})
+    assert make_graph(db).collect_medical(batch_size) == 60
+    assert records(db) == legacy_records
+    # 第一条原始记录另外引用了不存在的检查项，只保留存在的 3 个
+    first = db['data'].find_one({'url': {'$regex': '/0.htm$'}})
+    assert len(first['inspect_info']) == 4
+    assert len(db['medical'].find_one({'name': first['basic_info']['name']})['check']) == 3
+
+
+def test_collect_partial_insert(caplog):
+    db = make_db(30)
+    db['medical'].create_index('name', unique=True)
+    names = [item['basic_info']['name'] for item in db['data'].find()]
+    db['medical'].insert_many([{'name': names[3]}, {'name': names[17]}])
+    with caplog.at_level(logging.WARNING):
+        assert make_graph(db).collect_medical(batch_size=10) == 28
+    assert db['medical'].count_documents({}) == 30
+    assert sum('failed to insert' in record.getMessage() for record in caplog.records) == 2
+
+
+def jc_page(name, desc):
+    return ('<html><head><title>%s结果分析</title><meta name="description" content="%s"></head>'
+            '<body><p>%s</p></body></html>' % (name, desc, desc))
+
+
+def make_jc_db(pages):
+    db = mongomock.MongoClient()['medical']
+    db['jc'].insert_many([{'url': 'http://jck.xywy.com/jc_%d.html' % i, 'html': jc_page('检查%d' % i, '简介%d' % i)}
+                          for i in range(pages)])
+    return db
+
+
+def jc_fields(db):
+    return {item['url']: (item.get('name'), item.get('desc')) for item in db['jc'].find()}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_modify_jc(workers):
+    db = make_jc_db(25)
+    graph = MedicalGraph(db=BulkCompatDatabase(db), stop_words=[])
+    assert graph.modify_jc(workers, batch_size=4) == {'parsed': 25, 'skipped': 0, 'failed': 0}
+    assert jc_fields(db) == {'http://jck.xywy.com/jc_%d.html' % i: ('检查%d' % i, '简介%d' % i) for i in range(25)}
+    assert parse_jc(jc_page('血常规', '检查血液')) == ('血常规', '检查血液')
+
+    # 页面未变化时不再解析，修改过的页面重新解析
+    assert graph.modify_jc(workers, batch_size=4) == {'parsed': 0, 'skipped': 25, 'failed': 0}
+    db['jc'].update_one({'url': 'http://jck.xywy.com/jc_3.html'}, {'$set': {'html': jc_page('新检查', '新简介')}})
+    assert graph.modify_jc(workers, batch_size=4) == {'parsed': 1, 'skipped': 24, 'failed': 0}
+    assert jc_fields(db)['http://jck.xywy.com/jc_3.html'] == ('新检查', '新简介')
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_modify_jc_retries_failures(workers):
+    db = make_jc_db(10)
+    broken = 'http://jck.xywy.com/jc_5.html'
+    db['jc'].update_one({'url': broken}, {'$set': {'html': '<html><body>没有标题</body></html>'}})
+    graph = MedicalGraph(db=BulkCompatDatabase(db), stop_words=[])
+    assert graph.modify_jc(workers, batch_size=3) == {'parsed': 9, 'skipped': 0, 'failed': 1}
+    assert 'html_hash' not in db['jc'].find_one({'url': broken})
+    # 解析失败的页面没有记录哈希，下次运行时重试
+    assert graph.modify_jc(workers, batch_size=3) == {'parsed': 0, 'skipped': 9, 'failed': 1}
+    db['jc'].update_one({'url': broken}, {'$set': {'html': jc_page('检查5', '简介5')}})
+    assert graph.modify_jc(workers, batch_size=3) == {'parsed': 1, 'skipped': 9, 'failed': 0}
+    assert jc_fields(db)[broken] == ('检查5', '简介5')
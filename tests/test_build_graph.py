@@ -0,0 +1,108 @@
+# -*- coding:utf-8 -*-
+import csv
+import os
+
+import pytest
+
+from build_graph import LABELS, build_graph, load_cypher, write_csv, write_region_words
+
+RECORDS = {
+    '感冒': [{'name': '感冒', 'desc': '简介', 'cure_department': ['内科', '呼吸内科'], 'cure_way': ['药物治疗', '支持;治疗'],
+              'cured_prob': '90%', 'symptom': ['发热', ' 咳嗽 ', ''], 'common_drug': ['布洛芬'],
+              'acompany': ['肺炎', '不存在的病'], 'check': ['血常规'], 'do_eat': ['鸡蛋']}],
+    # 同名疾病的多条记录合并
+    '肺炎': [{'name': '肺炎', 'desc': '第一行\n"第二行"', 'cure_department': ['内科'], 'symptom': ['咳嗽']},
+             {'name': '肺炎', 'not_eat': ['辣椒'], 'symptom': '胸痛'}],
+}
+
+
+@pytest.fixture
+def graph():
+    return build_graph(RECORDS)
+
+
+def test_nodes_and_edges(graph):
+    assert {label: sorted(graph.nodes[label]) for label in LABELS} == {
+        'Disease': ['感冒', '肺炎'], 'Department': ['内科', '呼吸内科'], 'Check': ['血常规'], 'Drug': ['布洛芬'],
+        'Food': ['辣椒', '鸡蛋'], 'Symptom': ['发热', '咳嗽', '胸痛']}
+    assert graph.nodes['Disease']['感冒'] == {'desc': '简介', 'cure_department': ['内科', '呼吸内科'],
+                                              'cure_way': ['药物治疗', '支持;治疗'], 'cured_prob': '90%'}
+    edges = {relation[:3]: sorted(edges) for relation, edges in graph.edges.items() if edges}
+    assert edges == {
+        ('Disease', 'has_symptom', 'Symptom'): [('感冒', '发热'), ('感冒', '咳嗽'), ('肺炎', '咳嗽'), ('肺炎', '胸痛')],
+        # 指向没有记录的疾病的并发症被去掉
+        ('Disease', 'acompany_with', 'Disease'): [('感冒', '肺炎')],
+        ('Disease', 'common_drug', 'Drug'): [('感冒', '布洛芬')],
+        ('Disease', 'no_eat', 'Food'): [('肺炎', '辣椒')],
+        ('Disease', 'do_eat', 'Food'): [('感冒', '鸡蛋')],
+        ('Disease', 'need_check', 'Check'): [('感冒', '血常规')],
+        # 疾病属于最小的科室，小科室属于大科室
+        ('Disease', 'belongs_to', 'Department'): [('感冒', '呼吸内科'), ('肺炎', '内科')],
+        ('Department', 'belongs_to', 'Department'): [('呼吸内科', '内科')],
+    }
+    assert graph.counts() == {'nodes': 11, 'edges': 12}
+
+
+def test_load_cypher(graph):
+    statements = []
+    result = load_cypher(lambda cypher, params: statements.append((cypher, params)), graph, batch_size=2)
+    assert [cypher for cypher, _ in statements[:len(LABELS)]] == [
+        'CREATE CONSTRAINT IF NOT EXISTS FOR (n:%s) REQUIRE n.name IS UNIQUE' % label for label in LABELS]
+    statements = statements[len(LABELS):]
+    assert result == {'statements': len(statements), 'rows': 23}
+    assert all(len(params['rows']) <= 2 for _, params in statements)
+    nodes = [row for cypher, params in statements if 'MERGE (n:Disease' in cypher for row in params['rows']]
+    assert nodes == [dict(graph.nodes['Disease']['感冒'], name='感冒'), dict(graph.nodes['Disease']['肺炎'], name='肺炎')]
+    # 节点写完后再写关系
+    first_edge = next(ind for ind, (cypher, _) in enumerate(statements) if 'MERGE (m)-' in cypher)
+    assert all('MERGE (m)-' in cypher for cypher, _ in statements[first_edge:])
+    symptom_edges = [(params['name'], row) for cypher, params in statements
+                     if cypher.endswith('MERGE (m)-[r:has_symptom]->(n) SET r.name = $name') for row in params['rows']]
+    assert symptom_edges == [('症状', ['感冒', '发热']), ('症状', ['感冒', '咳嗽']), ('症状', ['肺炎', '咳嗽']),
+                             ('症状', ['肺炎', '胸痛'])]
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_write_csv(graph, tmp_path):
+    csv_dir = str(tmp_path / 'csv')
+    args = write_csv(graph, csv_dir)
+    assert args[0] == '--multiline-fields=true'
+    assert '--nodes=Disease=%s' % os.path.join(csv_dir, 'nodes-Disease.csv') in args
+    assert '--relationships=has_symptom=%s' % os.path.join(csv_dir, 'rels-Disease-has_symptom-Symptom.csv') in args
+    assert len(args) == 1 + len(LABELS) + len(graph.edges)
+
+    rows = read_csv(os.path.join(csv_dir, 'nodes-Disease.csv'))
+    assert rows[0] == ['name:ID(Disease)', 'desc', 'prevent', 'cause', 'easy_get', 'cure_lasttime',
+                       'cure_department:string[]', 'cure_way:string[]', 'cured_prob']
+    # 数组以 ; 分隔，元素中的 ; 换成全角；多行与引号由 csv 转义
+    assert rows[1] == ['感冒', '简介', '', '', '', '', '内科;呼吸内科', '药物治疗;支持；治疗', '90%']
+    assert rows[2] == ['肺炎', '第一行\n"第二行"', '', '', '', '', '内科', '', '']
+    assert read_csv(os.path.join(csv_dir, 'nodes-Symptom.csv')) == [['name:ID(Symptom)'], ['发热'], ['咳嗽'], ['胸痛']]
+    assert read_csv(os.path.join(csv_dir, 'rels-Department-belongs_to-Department.csv')) == [
+        [':START_ID(Department)', ':END_ID(Department)', 'name'], ['呼吸内科', '内科', '属于']]
+    assert read_csv(os.path.join(csv_dir, 'rels-Disease-acompany_with-Disease.csv')) == [
+        [':START_ID(Disease)', ':END_ID(Disease)', 'name'], ['感冒', '肺炎', '并发症']]
+
+
+def test_write_region_words(graph, tmp_path):
+    region_dir = str(tmp_path / 'region_words')
+    write_region_words(graph, region_dir)
+    files = sorted(os.listdir(region_dir))
+    assert files == sorted(['diseases.txt', 'departments.txt', 'checks.txt', 'drugs.txt', 'foods.txt', 'symptoms.txt'])
+    with open(os.path.join(region_dir, 'symptoms.txt'), encoding='utf-8') as f:
+        assert f.read() == '发热\n咳嗽\n胸痛\n'
+
+    # 只重写指定标签的词表
+    with open(os.path.join(region_dir, 'drugs.txt'), 'w', encoding='utf-8') as f:
+        f.write('旧药\n')
+    graph.nodes['Disease']['哮喘'] = {}
+    write_region_words(graph, region_dir, labels=['Disease'])
+    with open(os.path.join(region_dir, 'diseases.txt'), encoding='utf-8') as f:
+        assert f.read() == '哮喘\n感冒\n肺炎\n'
+    with open(os.path.join(region_dir, 'drugs.txt'), encoding='utf-8') as f:
+        assert f.read() == '旧药\n'
+    assert sorted(os.listdir(region_dir)) == files
@@ -0,0 +1,37 @@
+# -*- coding:utf-8 -*-
+from change_feed import ChangeFeed
+
+
+def test_poll(tmp_path):
+    path = str(tmp_path / 'changes.log')
+    writer, reader = ChangeFeed(path), ChangeFeed(path)
+    assert reader.poll() == []
+    writer.append({'kind': 'graph', 'entities': ['感冒']})
+    reader.append({'kind': 'graph', 'entities': None})
+    # 不返回自己写入的变更
+    assert reader.poll() == [{'kind': 'graph', 'entities': ['感冒']}]
+    assert writer.poll() == [{'kind': 'graph', 'entities': None}]
+    assert reader.poll() == []
+
+
+def test_starts_at_end_and_waits_for_full_lines(tmp_path):
+    path = str(tmp_path / 'changes.log')
+    ChangeFeed(path).append({'kind': 'region'})
+    reader = ChangeFeed(path)
+    assert reader.poll() == []
+    with open(path, 'ab') as f:
+        f.write(b'{"kind": "graph", "entities": ')
+    assert reader.poll() == []
+    with open(path, 'ab') as f:
+        f.write(b'null}\n')
+    assert reader.poll() == [{'kind': 'graph', 'entities': None}]
+
+
+def test_truncated(tmp_path):
+    path = str(tmp_path / 'changes.log')
+    writer, reader = ChangeFeed(path), ChangeFeed(path)
+    writer.append({'kind': 'graph', 'entities': ['感冒', '肺炎']})
+    assert len(reader.poll()) == 1
+    open(path, 'w').close()
+    writer.append({'kind': 'region'})
+    assert reader.poll() == [{'kind': 'region'}]
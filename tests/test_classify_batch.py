@@ -0,0 +1,60 @@
+# -*- coding:utf-8 -*-
+import gc
+import threading
+
+import pytest
+
+from QuestionClassifier import QuestionClassifier
+from synthetic import make_region_words, make_questions, write_region_dir
+
+
+def make_classifier(tmp_path, seed):
+    words = make_region_words(300, seed=seed)
+    region_dir = str(tmp_path / ('region_words_%d' % seed))
+    write_region_dir(region_dir, words)
+    return QuestionClassifier(region_dir, str(tmp_path / ('region_index_%d.pkl' % seed))), words
+
+
+@pytest.fixture(scope='module')
+def classifiers(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('classify_batch')
+    return [make_classifier(tmp_path, seed) for seed in (0, 1)]
+
+
+def test_parallel_matches_sequential(classifiers):
+    classifier, words = classifiers[0]
+    questions = make_questions(words, 500) + ['', '今天天气怎么样']
+    expected = list(classifier.classify_batch(questions))
+    assert expected == [classifier.classify_main(question) for question in questions]
+    # 输入为迭代器且超过一个提交窗口时仍按输入顺序返回
+    assert list(classifier.classify_batch(iter(questions), processes=2, chunksize=16)) == expected
+
+
+def test_concurrent_batches(classifiers):
+    '''两个线程同时用不同的分类器批量分类，子进程各自使用自己的分类器'''
+    questions = [make_questions(words, 200, seed=seed) for seed, (_, words) in enumerate(classifiers)]
+    expected = [list(classifier.classify_batch(batch)) for (classifier, _), batch in zip(classifiers, questions)]
+    results = [None, None]
+
+    def run(ind):
+        results[ind] = list(classifiers[ind][0].classify_batch(questions[ind], processes=2, chunksize=8))
+
+    threads = [threading.Thread(target=run, args=(ind,)) for ind in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == expected
+
+
+def test_keeps_caller_frozen_objects(classifiers):
+    classifier, words = classifiers[0]
+    gc.freeze()
+    try:
+        frozen = gc.get_freeze_count()
+        list(classifier.classify_batch(make_questions(words, 20), processes=2))
+        assert gc.get_freeze_count() >= frozen
+    finally:
+        gc.unfreeze()
+    list(classifier.classify_batch(make_questions(words, 20), processes=2))
+    assert gc.get_freeze_count() == 0
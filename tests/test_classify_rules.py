@@ -0,0 +1,117 @@
+# -*- coding:utf-8 -*-
+import pytest
+
+from QuestionClassifier import QuestionClassifier, ENTITYTYPE, QUESTIONTYPE
+from synthetic import make_region_words, make_questions, make_trigger_questions, write_region_dir
+
+
+def legacy_question_types(classifier, question, types):
+    '''改造前 classify_main 中逐个扫描触发词列表的问题类型判断，作为 QUESTION_RULES 的对照'''
+    def check(words):
+        for word in words:
+            if word in question:
+                return True
+        return False
+
+    question_types = []
+    if check(classifier.symptom_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_TO_SYMPTOM)
+    if check(classifier.symptom_qwds) and (ENTITYTYPE.SYMPTOM in types):
+        question_types.append(QUESTIONTYPE.SYMPTOM_TO_DISEASE)
+    if check(classifier.cause_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_CAUSE)
+    if check(classifier.complication_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_COMLICATION)
+    if check(classifier.drug_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_DRUG)
+    if check(classifier.food_qwds) and (ENTITYTYPE.DISEASE in types):
+        if check(classifier.deny_words):
+            question_types.append(QUESTIONTYPE.DISEASE_AOID_FOOD)
+        else:
+            question_types.append(QUESTIONTYPE.DISEASE_GOOD_FOOD)
+    if check(classifier.check_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_DO_CHECK)
+    if check(classifier.prevent_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_PREVENT)
+    if check(classifier.treat_way_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_TREAT_WAY)
+    if check(classifier.treat_cycle_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_TREAT_CYCLE)
+    if check(classifier.cure_prob_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_CURED_PRO)
+    if check(classifier.belong_qwds) and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_TO_DEPARTMENT)
+    if question_types == [] and (ENTITYTYPE.DISEASE in types):
+        question_types.append(QUESTIONTYPE.DISEASE_DESC)
+    if question_types == [] and (ENTITYTYPE.SYMPTOM in types):
+        question_types.append(QUESTIONTYPE.SYMPTOM_TO_DISEASE)
+    return question_types
+
+
+def entity_types(classifier, question):
+    types = set()
+    for _, _, _, word_types in classifier.get_entity_spans(question):
+        types.update(word_types)
+    return types
+
+
+@pytest.fixture(scope='module')
+def words():
+    words = make_region_words(2000)
+    for entity_type, fixed in ((ENTITYTYPE.DISEASE, '感冒'), (ENTITYTYPE.SYMPTOM, '头晕'), (ENTITYTYPE.DRUG, '布洛芬')):
+        words[entity_type].append(fixed)
+    return words
+
+
+@pytest.fixture(scope='module')
+def classifier(tmp_path_factory, words):
+    tmp_path = tmp_path_factory.mktemp('rules')
+    write_region_dir(str(tmp_path / 'region_words'), words)
+    return QuestionClassifier(str(tmp_path / 'region_words'), str(tmp_path / 'region_index.pkl'))
+
+
+@pytest.mark.parametrize('question, expected', [
+    ('感冒有什么症状', [QUESTIONTYPE.DISEASE_TO_SYMPTOM]),
+    ('最近头晕是怎么回事', [QUESTIONTYPE.SYMPTOM_TO_DISEASE]),
+    ('头晕', [QUESTIONTYPE.SYMPTOM_TO_DISEASE]),
+    ('感冒', [QUESTIONTYPE.DISEASE_DESC]),
+    ('感冒吃什么好', [QUESTIONTYPE.DISEASE_GOOD_FOOD]),
+    ('感冒不能吃什么', [QUESTIONTYPE.DISEASE_AOID_FOOD]),
+    # 否定词只影响饮食类问题
+    ('感冒不要用什么药', [QUESTIONTYPE.DISEASE_DRUG]),
+    # “吃”同时是饮食类触发词
+    ('感冒有什么症状，吃什么药，挂什么科室',
+     [QUESTIONTYPE.DISEASE_TO_SYMPTOM, QUESTIONTYPE.DISEASE_DRUG, QUESTIONTYPE.DISEASE_GOOD_FOOD,
+      QUESTIONTYPE.DISEASE_TO_DEPARTMENT]),
+    ('感冒的原因和并发症', [QUESTIONTYPE.DISEASE_CAUSE, QUESTIONTYPE.DISEASE_COMLICATION]),
+    ('感冒怎么治疗，治疗周期多久，能治好吗',
+     [QUESTIONTYPE.DISEASE_TREAT_WAY, QUESTIONTYPE.DISEASE_TREAT_CYCLE, QUESTIONTYPE.DISEASE_CURED_PRO]),
+    ('感冒怎么预防，要做什么检查', [QUESTIONTYPE.DISEASE_DO_CHECK, QUESTIONTYPE.DISEASE_PREVENT]),
+    # 只有药品实体时没有对应的问题类型
+    ('布洛芬有什么症状', []),
+    ('今天天气怎么样', []),
+])
+def test_known_questions(classifier, question, expected):
+    types = entity_types(classifier, question)
+    assert classifier.classify_question_types(question, types) == expected
+    assert legacy_question_types(classifier, question, types) == expected
+
+
+def test_regression_corpus(classifier, words):
+    questions = make_questions(words, 1000) + make_trigger_questions(words, classifier.trigger_words, 3000)
+    mismatches = []
+    for question in questions:
+        types = entity_types(classifier, question)
+        if classifier.classify_question_types(question, types) != legacy_question_types(classifier, question, types):
+            mismatches.append(question)
+    assert mismatches == []
+
+
+def test_every_trigger_word(classifier):
+    '''每个触发词分别与疾病、症状实体组合，覆盖 trigger_tree 中的全部词'''
+    for category, words in classifier.trigger_words.items():
+        for word in words:
+            for question in ('感冒' + word, word + '头晕', '感冒' + word + '头晕'):
+                types = entity_types(classifier, question)
+                assert classifier.classify_question_types(question, types) == \
+                    legacy_question_types(classifier, question, types), (category, question)
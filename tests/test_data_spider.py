@@ -0,0 +1,140 @@
+# -*- coding:utf-8 -*-
+import os
+
+import mongomock
+import pytest
+
+import data_spider
+from data_spider import CrimeSpider, FetchError, HttpFetcher, PAGE_SECTIONS
+from spider_fixture import generate_pages, start_server
+
+PAGES = 20
+
+
+@pytest.fixture
+def site(tmp_path):
+    root = str(tmp_path / 'pages')
+    server, base_url = start_server(root)
+    written = generate_pages(root, PAGES, jc_url=base_url)
+    yield server, base_url, written
+    server.shutdown()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    '''记录退避等待的时长而不真正等待；抖动固定为 1 倍'''
+    sleeps = []
+    monkeypatch.setattr(data_spider.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(data_spider.random, 'random', lambda: 0.5)
+    return sleeps
+
+
+def make_spider(base_url, db, retries=3):
+    return CrimeSpider(base_url, db=db, workers=4, rate=0, retries=retries, backoff=0.001)
+
+
+def test_retry_backoff(site, sleeps):
+    server, base_url, written = site
+    path = '/il_sii/gaishu/%d.htm' % written[0]
+    url = base_url + path
+    server.faults[path] = [429, 500, 503]
+    fetcher = HttpFetcher(retries=3, backoff=0.5)
+    assert fetcher.get(url).startswith(b'<html>')
+    assert sleeps == [0.5, 1.0, 2.0]
+    assert fetcher.stats['retries'] == 3 and fetcher.stats['requests'] == 4
+
+    # 超过重试次数后失败，状态码为最后一次响应的
+    server.faults[path] = [502, 504, 503, 500]
+    with pytest.raises(FetchError) as e:
+        fetcher.get(url)
+    assert e.value.status == 500
+    assert sleeps[3:] == [0.5, 1.0, 2.0]
+
+    # 其他错误状态码不重试
+    for status in (404, 403):
+        server.faults[path] = [status]
+        with pytest.raises(FetchError) as e:
+            fetcher.get(url)
+        assert e.value.status == status
+    assert fetcher.stats['retries'] == 6 and len(sleeps) == 6
+
+
+def test_redirects(site, sleeps):
+    server, base_url, written = site
+    fetcher = HttpFetcher()
+    with open(os.path.join(server.root, 'il_sii', 'cause', '%d.htm' % written[0]), 'rb') as f:
+        body = f.read()
+    server.redirects['/old/2.htm'] = (301, '/moved/2.htm')
+    server.redirects['/moved/2.htm'] = (302, base_url + '/il_sii/cause/%d.htm' % written[0])
+    assert fetcher.get(base_url + '/old/2.htm') == body
+    assert fetcher.stats['requests'] == 3 and fetcher.stats['retries'] == 0
+
+    # 重定向次数超过 max_redirects 时失败，不重试
+    server.redirects['/loop'] = (307, '/loop')
+    with pytest.raises(FetchError) as e:
+        fetcher.get(base_url + '/loop', max_redirects=2)
+    assert e.value.status == 307
+    assert fetcher.stats['requests'] == 6 and sleeps == []
+
+
+def test_random_errors(site):
+    server, base_url, written = site
+    server.error_rate = 0.3
+    db = mongomock.MongoClient()['medical']
+    spider = make_spider(base_url, db, retries=20)
+    result = spider.spider_main(1, PAGES + 1)
+    assert result == {'done': len(written), 'unchanged': 0, 'missing': PAGES - len(written), 'failed': 0, 'skipped': 0}
+    assert server.stats['errors'] > 0
+    # 每个 503 都被重试一次
+    assert spider.fetcher.stats['retries'] == server.stats['errors']
+    assert spider.fetcher.stats['requests'] == server.stats['requests']
+    assert db['data'].count_documents({}) == len(written)
+
+
+def test_checkpoint_resume(site, tmp_path):
+    server, base_url, written = site
+    checkpoint = str(tmp_path / 'spider.checkpoint')
+    db = mongomock.MongoClient()['medical']
+
+    # 一个页面的子页面持续出错，其他页面正常完成
+    failing = written[len(written) // 2]
+    server.faults['/il_sii/symptom/%d.htm' % failing] = [503] * 100
+    result = make_spider(base_url, db, retries=1).spider_main(1, PAGES + 1, checkpoint)
+    assert result['failed'] == 1 and result['done'] == len(written) - 1
+    with open(checkpoint, encoding='utf-8') as f:
+        done = set(int(line) for line in f)
+    assert done == set(range(1, PAGES + 1)) - {failing}
+
+    # 续爬只抓取失败的页面
+    server.faults.clear()
+    requests = server.stats['requests']
+    spider = make_spider(base_url, db)
+    assert spider.spider_main(1, PAGES + 1, checkpoint) == {
+        'done': 1, 'unchanged': 0, 'missing': 0, 'failed': 0, 'skipped': PAGES - 1}
+    assert server.stats['requests'] - requests == len(PAGE_SECTIONS)
+    assert db['data'].count_documents({}) == len(written)
+
+
+def test_resume_after_interrupt(site, tmp_path):
+    server, base_url, written = site
+    checkpoint = str(tmp_path / 'spider.checkpoint')
+    db = mongomock.MongoClient()['medical']
+
+    def interrupted():
+        yield from range(1, PAGES // 2 + 1)
+        raise KeyboardInterrupt()
+
+    # 中途退出：已完成的页面已写入检查点，在途的页面没有记入
+    spider = make_spider(base_url, db)
+    with pytest.raises(KeyboardInterrupt):
+        spider.crawl(interrupted(), spider.crawl_page, checkpoint)
+    with open(checkpoint, encoding='utf-8') as f:
+        done = set(int(line) for line in f)
+    assert done <= set(range(1, PAGES // 2 + 1))
+
+    result = make_spider(base_url, db).spider_main(1, PAGES + 1, checkpoint)
+    assert result['skipped'] == len(done)
+    assert result['done'] + result['missing'] == PAGES - len(done)
+    # 按 url upsert，重复抓取的页面不产生重复记录
+    assert db['data'].count_documents({}) == len(written)
+    assert len(set(doc['url'] for doc in db['data'].find())) == len(written)
@@ -0,0 +1,64 @@
+# -*- coding:utf-8 -*-
+import os
+import random
+
+import pytest
+
+from QuestionClassifier import QuestionClassifier, ENTITYTYPE, REGION_FILES
+from synthetic import write_region_dir
+
+
+def make_classifier(tmp_path, type_words):
+    words = {entity_type: [] for entity_type, _ in REGION_FILES}
+    for entity_type, entity_words in type_words.items():
+        words[entity_type].extend(entity_words)
+    region_dir = str(tmp_path / 'region_words')
+    write_region_dir(region_dir, words)
+    return QuestionClassifier(region_dir, os.path.join(str(tmp_path), 'region_index.pkl'))
+
+
+def leftmost_longest(question, words):
+    '''逐位置取最长词的朴素实现'''
+    spans, pos = [], 0
+    while pos < len(question):
+        match = max((word for word in words if question.startswith(word, pos)), key=len, default=None)
+        if match is None:
+            pos += 1
+        else:
+            spans.append((match, pos, pos + len(match)))
+            pos += len(match)
+    return spans
+
+
+@pytest.mark.parametrize('type_words, question, expected', [
+    # CDE 与 ABC 重叠被丢弃后，D 仍应保留，ABC 不能被弹出
+    ({ENTITYTYPE.DISEASE: ['甲乙丙', '丙丁戊'], ENTITYTYPE.SYMPTOM: ['丁']}, '甲乙丙丁戊', ['甲乙丙', '丁']),
+    # 嵌套：长词覆盖其中的短词
+    ({ENTITYTYPE.DISEASE: ['头痛', '剧烈头痛'], ENTITYTYPE.SYMPTOM: ['痛']}, '剧烈头痛怎么办', ['剧烈头痛']),
+    ({ENTITYTYPE.SYMPTOM: ['乙', '丙', '甲乙丙丁']}, '甲乙丙丁', ['甲乙丙丁']),
+    # 起点相同取最长，之后的词正常匹配
+    ({ENTITYTYPE.DISEASE: ['甲乙', '甲乙丙'], ENTITYTYPE.DRUG: ['丁戊', '丙丁']}, '甲乙丙丁戊', ['甲乙丙', '丁戊']),
+    # 多个较短命中先被保留，随后被更靠左的长词整体覆盖
+    ({ENTITYTYPE.DISEASE: ['乙', '丙', '甲乙丙丁'], ENTITYTYPE.SYMPTOM: ['丁戊']}, '甲乙丙丁戊', ['甲乙丙丁']),
+])
+def test_overlapping_and_nested_spans(tmp_path, type_words, question, expected):
+    classifier = make_classifier(tmp_path, type_words)
+    assert [span[0] for span in classifier.get_entity_spans(question)] == expected
+
+
+def test_span_types(tmp_path):
+    classifier = make_classifier(tmp_path, {ENTITYTYPE.DISEASE: ['甲乙丙', '丙丁戊'], ENTITYTYPE.SYMPTOM: ['丁']})
+    spans = classifier.get_entity_spans('甲乙丙丁戊')
+    assert [(start, end, types) for _, start, end, types in spans] == [
+        (0, 3, (ENTITYTYPE.DISEASE,)), (3, 4, (ENTITYTYPE.SYMPTOM,))]
+
+
+def test_matches_brute_force(tmp_path):
+    rng = random.Random(0)
+    chars = '甲乙丙丁戊'
+    words = sorted({''.join(rng.choice(chars) for _ in range(rng.randint(1, 4))) for _ in range(12)})
+    classifier = make_classifier(tmp_path, {ENTITYTYPE.SYMPTOM: words})
+    for _ in range(500):
+        question = ''.join(rng.choice(chars + '的') for _ in range(rng.randint(1, 20)))
+        spans = [span[:3] for span in classifier.get_entity_spans(question)]
+        assert spans == leftmost_longest(question, words), question
@@ -0,0 +1,142 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+from graph_client import FakeGraphBackend, GraphBusy, GraphClient, GraphConfig, GraphTimeout
+from QuestionClassifier import AnswerSearcher, QUERY_TEMPLATES, QUESTIONTYPE
+from tracing import COUNTERS
+
+QUERY = QUERY_TEMPLATES[QUESTIONTYPE.DISEASE_TO_SYMPTOM]
+
+
+class SlowBackend(object):
+    '''
+    每个查询固定耗时，记录执行过的查询与后端收到的超时
+    '''
+    def __init__(self, latency):
+        self.latency = latency
+        self.started = []
+        self.timeouts = []
+
+    def run(self, cypher, params, timeout=None):
+        self.started.append(cypher)
+        self.timeouts.append(timeout)
+        time.sleep(self.latency)
+        return [{'cypher': cypher}]
+
+
+def make_graph(latency=0.0):
+    graph = FakeGraphBackend(latency)
+    graph.add_edge('Disease', '感冒', 'has_symptom', '症状', 'Symptom', '发热')
+    graph.add_edge('Disease', '感冒', 'has_symptom', '症状', 'Symptom', '咳嗽')
+    graph.add_edge('Disease', '肺炎', 'has_symptom', '症状', 'Symptom', '咳嗽')
+    return graph
+
+
+def test_fake_backend():
+    graph = make_graph()
+    rows = graph.run(QUERY, {'names': ['感冒', '肺炎', '不存在']})
+    assert rows == [{'m.name': '感冒', 'r.name': '症状', 'n.name': '发热'},
+                    {'m.name': '感冒', 'r.name': '症状', 'n.name': '咳嗽'},
+                    {'m.name': '肺炎', 'r.name': '症状', 'n.name': '咳嗽'}]
+    rows = graph.run('MATCH (m:Symptom) RETURN m.name', {})
+    assert sorted(row['m.name'] for row in rows) == ['发热', '咳嗽']
+    with pytest.raises(GraphTimeout):
+        make_graph(latency=0.2).run(QUERY, {'names': ['感冒']}, timeout=0.01)
+
+
+def test_run_many_order():
+    client = GraphClient(SlowBackend(0.01), pool_size=4)
+    queries = [('q%d' % i, {}) for i in range(10)]
+    assert client.run_many(queries) == [[{'cypher': 'q%d' % i}] for i in range(10)]
+    client.close()
+
+
+def test_max_pending():
+    backend = SlowBackend(0.3)
+    client = GraphClient(backend, pool_size=1, max_pending=2)
+    busy = COUNTERS.snapshot().get('graph_busy', 0)
+    futures = [client.submit('q1'), client.submit('q2')]
+    assert client.saturated()
+    with pytest.raises(GraphBusy):
+        client.submit('q3')
+    with pytest.raises(GraphBusy):
+        client.run_many([('q4', {}), ('q5', {})])
+    assert COUNTERS.snapshot().get('graph_busy', 0) == busy + 2
+    for future in futures:
+        client.result(future)
+    # 完成的查询归还名额
+    assert client.pending == 0 and not client.saturated()
+    assert client.run('q6') == [{'cypher': 'q6'}]
+    client.close()
+
+
+def test_timeout():
+    backend = SlowBackend(0.3)
+    client = GraphClient(backend, pool_size=1, timeout=5)
+    timeouts = COUNTERS.snapshot().get('graph_timeouts', 0)
+    start = time.monotonic()
+    with pytest.raises(GraphTimeout):
+        client.run_many([('q1', {}), ('q2', {}), ('q3', {})], timeout=0.1)
+    assert time.monotonic() - start < 0.3
+    assert COUNTERS.snapshot().get('graph_timeouts', 0) == timeouts + 1
+    time.sleep(0.5)
+    # 排队中的查询随超时取消，执行中的查询收到的是剩余时间而不是默认超时
+    assert backend.started == ['q1']
+    assert 0 < backend.timeouts[0] <= 0.1
+    assert client.pending == 0
+    client.close()
+
+
+def test_expired_in_queue():
+    backend = SlowBackend(0.2)
+    client = GraphClient(backend, pool_size=1)
+    first = client.submit('q1')
+    second = client.submit('q2', timeout=0.05)
+    assert client.result(first) == [{'cypher': 'q1'}]
+    with pytest.raises(GraphTimeout):
+        second.result()
+    assert backend.started == ['q1']
+    client.close()
+
+
+def test_server_timeout():
+    client = GraphClient(make_graph(latency=0.5), pool_size=1)
+    start = time.monotonic()
+    with pytest.raises(GraphTimeout):
+        client.run(QUERY, {'names': ['感冒']}, timeout=0.05)
+    # 后端在截止时间终止查询，连接随即空出
+    assert client.run(QUERY, {'names': ['肺炎']}, timeout=5) == [
+        {'m.name': '肺炎', 'r.name': '症状', 'n.name': '咳嗽'}]
+    assert time.monotonic() - start < 1.0
+    client.close()
+
+
+def test_run_async():
+    client = GraphClient(make_graph(), pool_size=2)
+    searcher = AnswerSearcher(client)
+    sql_list = [{'question_type': QUESTIONTYPE.DISEASE_TO_SYMPTOM, 'sql': QUERY, 'params': {'names': ['感冒']}}]
+
+    async def main():
+        rows = await client.run_async(QUERY, {'names': ['肺炎']})
+        slow = GraphClient(SlowBackend(0.5), pool_size=1)
+        with pytest.raises(GraphTimeout):
+            await slow.run_async('q1', timeout=0.05)
+        slow.close()
+        return rows, await searcher.search_main_async(sql_list), searcher.search_main(sql_list)
+
+    rows, async_answers, answers = asyncio.run(main())
+    assert rows == [{'m.name': '肺炎', 'r.name': '症状', 'n.name': '咳嗽'}]
+    assert async_answers == answers and answers
+    client.close()
+
+
+def test_config():
+    environ = {'NEO4J_POOL_SIZE': '3', 'NEO4J_TIMEOUT': '2.5'}
+    config = GraphConfig(environ=environ)
+    assert (config.pool_size, config.timeout, config.max_pending) == (3, 2.5, 12)
+    # 显式传入的 0 不被环境变量覆盖
+    config = GraphConfig(timeout=0, max_pending=0, environ=environ)
+    assert (config.timeout, config.max_pending) == (0.0, 0)
@@ -0,0 +1,117 @@
+# -*- coding:utf-8 -*-
+import re
+
+import mongomock
+
+from synthetic import make_disease_records, modify_disease_records
+from build_graph import (LABELS, GraphDiff, apply_diff, build_graph, load_cypher, read_records, save_state,
+                         load_state, update_incremental)
+
+
+class CypherStore(object):
+    '''
+    执行 load_cypher / apply_diff 生成的语句的内存图，MATCH 不到节点时与 Neo4j 一样不写入
+    '''
+    DELETE_EDGES = re.compile(r'UNWIND \$rows AS row MATCH \(m:(\w+) \{name: row\[0\]\}\)-\[r:(\w+)\]->'
+                              r'\(n:(\w+) \{name: row\[1\]\}\) DELETE r$')
+    DELETE_NODES = re.compile(r'UNWIND \$rows AS name MATCH \(n:(\w+) \{name: name\}\) DETACH DELETE n$')
+    MERGE_NODES = re.compile(r'UNWIND \$rows AS row MERGE \(n:(\w+) \{name: row.name\}\) SET n = row$')
+    MERGE_EDGES = re.compile(r'UNWIND \$rows AS row MATCH \(m:(\w+) \{name: row\[0\]\}\) MATCH \(n:(\w+) '
+                             r'\{name: row\[1\]\}\) MERGE \(m\)-\[r:(\w+)\]->\(n\) SET r.name = \$name$')
+
+    def __init__(self):
+        self.nodes = {label: {} for label in LABELS}
+        # (起点标签, 关系类型, 终点标签) -> (起点名, 终点名) -> 关系名
+        self.edges = {}
+
+    def __call__(self, cypher, params):
+        rows = params.get('rows', [])
+        if cypher.startswith('CREATE CONSTRAINT'):
+            return
+        match = self.DELETE_EDGES.match(cypher)
+        if match:
+            for src, dst in rows:
+                self.edges.get(match.groups(), {}).pop((src, dst), None)
+            return
+        match = self.DELETE_NODES.match(cypher)
+        if match:
+            label = match.group(1)
+            for name in rows:
+                self.nodes[label].pop(name, None)
+            for (src_label, _, dst_label), edges in self.edges.items():
+                for src, dst in list(edges):
+                    if (src_label == label and src in rows) or (dst_label == label and dst in rows):
+                        del edges[(src, dst)]
+            return
+        match = self.MERGE_NODES.match(cypher)
+        if match:
+            for row in rows:
+                self.nodes[match.group(1)][row['name']] = {key: value for key, value in row.items() if key != 'name'}
+            return
+        match = self.MERGE_EDGES.match(cypher)
+        if match:
+            src_label, dst_label, rel_type = match.groups()
+            for src, dst in rows:
+                if src in self.nodes[src_label] and dst in self.nodes[dst_label]:
+                    self.edges.setdefault((src_label, rel_type, dst_label), {})[(src, dst)] = params['name']
+            return
+        raise ValueError('unexpected statement: %s' % cypher)
+
+    def same_as(self, graph):
+        edges = {}
+        for (src_label, rel_type, dst_label, rel_name), relation_edges in graph.edges.items():
+            for edge in relation_edges:
+                edges.setdefault((src_label, rel_type, dst_label), {})[edge] = rel_name
+        return self.nodes == graph.nodes and {key: value for key, value in self.edges.items() if value} == edges
+
+
+def test_diff_matches_full_rebuild(tmp_path):
+    records = make_disease_records(300)
+    db = mongomock.MongoClient()['medical']
+    db['medical'].insert_many([dict(record) for record in records])
+    old_records = read_records(db['medical'])
+    store = CypherStore()
+    load_cypher(store, build_graph(old_records), batch_size=50)
+    assert store.same_as(build_graph(old_records))
+
+    state_path = str(tmp_path / 'graph_state.pkl')
+    save_state(state_path, old_records)
+    modify_disease_records(db, records, 0.1)
+    # 科室与并发症也发生变化
+    db['medical'].update_one({'name': records[0]['name']}, {'$set': {'cure_department': ['新科室', '新小科'],
+                                                                     'acompany': [records[1]['name']]}})
+    new_records = read_records(db['medical'])
+    diff = update_incremental(new_records, load_state(state_path), store, batch_size=50)
+    assert diff is not None and diff.counts()['removed_nodes'] and diff.counts()['added_edges']
+    rebuilt = build_graph(new_records)
+    assert diff.new.nodes == rebuilt.nodes and diff.new.edges == rebuilt.edges
+    assert store.same_as(rebuilt)
+
+    # 没有变化时不产生差异
+    save_state(state_path, new_records)
+    assert update_incremental(new_records, load_state(state_path), store) is None
+
+
+def test_changed_entities():
+    def record(name, **fields):
+        return {name: [dict(fields, name=name)]}
+
+    old = build_graph(dict(**record('感冒', desc='旧简介', symptom=['发热', '咳嗽'], common_drug=['布洛芬']),
+                           **record('肺炎', desc='简介', symptom=['咳嗽'], acompany=['感冒']),
+                           **record('胃炎', desc='简介', symptom=['腹痛'])))
+    new = build_graph(dict(**record('感冒', desc='新简介', symptom=['发热', '头痛'], common_drug=['布洛芬']),
+                           **record('肺炎', desc='简介', symptom=['咳嗽'], acompany=['感冒']),
+                           **record('哮喘', desc='简介', symptom=['咳嗽'])))
+    diff = GraphDiff(old, new)
+    # 感冒属性变化；咳嗽、头痛的关系有增删；胃炎与腹痛被删除，哮喘新增
+    assert diff.changed_entities() == sorted(['感冒', '咳嗽', '头痛', '胃炎', '腹痛', '哮喘'])
+    assert '肺炎' not in diff.changed_entities() and '布洛芬' not in diff.changed_entities()
+    assert diff.changed_nodes['Disease'] == ['感冒']
+    assert diff.region_words() == {'add': {'Disease': ['哮喘'], 'Symptom': ['头痛']},
+                                   'remove': {'Disease': ['胃炎'], 'Symptom': ['腹痛']}}
+    assert sorted(diff.changed_labels()) == ['Disease', 'Symptom']
+
+    store = CypherStore()
+    load_cypher(store, old)
+    apply_diff(store, diff)
+    assert store.same_as(new)
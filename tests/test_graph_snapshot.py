@@ -0,0 +1,49 @@
+# -*- coding:utf-8 -*-
+from collections import Counter
+
+import pytest
+
+from build_graph import build_graph
+from graph_client import FakeGraphBackend
+from graph_snapshot import SnapshotBackend, export_snapshot, compare_backends, template_names
+from QuestionClassifier import QUERY_TEMPLATES
+from synthetic import make_region_words, make_fake_graph, make_disease_records
+
+
+def records_graph():
+    '''由 build_data 格式的疾病记录建图，含科室层级、列表属性等'''
+    backend = FakeGraphBackend()
+    build_graph({record['name']: [record] for record in make_disease_records(200)}).feed(backend)
+    return backend
+
+
+@pytest.fixture(scope='module', params=['synthetic', 'records'])
+def backends(request, tmp_path_factory):
+    graph = make_fake_graph(make_region_words(2000)) if request.param == 'synthetic' else records_graph()
+    path = str(tmp_path_factory.mktemp('snapshot') / 'graph_snapshot.bin')
+    export_snapshot(graph, path, QUERY_TEMPLATES.values())
+    snapshot = SnapshotBackend(path)
+    yield graph, snapshot, template_names(graph, QUERY_TEMPLATES)
+    snapshot.close()
+
+
+def freeze(rows):
+    return Counter(tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in row.items())) for row in rows)
+
+
+@pytest.mark.parametrize('question_type', list(QUERY_TEMPLATES), ids=lambda question_type: question_type.value)
+def test_parity(backends, question_type):
+    graph, snapshot, names = backends
+    cypher = QUERY_TEMPLATES[question_type]
+    assert names[question_type]
+    assert compare_backends(graph, snapshot, {question_type: cypher}, names, batch_size=97) == {}
+    # 逐个实体、整批与不存在的实体
+    rows = 0
+    for name in names[question_type][:50]:
+        expected = graph.run(cypher, {'names': [name]})
+        assert freeze(snapshot.run(cypher, {'names': [name]})) == freeze(expected)
+        rows += len(expected)
+    assert rows
+    batch = names[question_type][:200] + ['不存在的实体']
+    assert freeze(snapshot.run(cypher, {'names': batch})) == freeze(graph.run(cypher, {'names': batch}))
+    assert snapshot.run(cypher, {'names': ['不存在的实体']}) == []
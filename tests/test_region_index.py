@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+import os
+import threading
+
+import pytest
+
+from QuestionClassifier import QuestionClassifier, QuestionParser, ENTITYTYPE, QUESTIONTYPE, REGION_FILES
+from region_index import build_in_child
+from synthetic import write_region_dir
+
+# 模拟 worker 中其他线程持有的锁
+HELD_LOCK = threading.Lock()
+
+WORDS = {
+    ENTITYTYPE.DISEASE: ['感冒', '头痛'],
+    ENTITYTYPE.SYMPTOM: ['头痛', '发热'],
+    ENTITYTYPE.CHECK: ['胃镜', '血常规'],
+    ENTITYTYPE.DEPARTMENT: ['胃镜', '内科'],
+    ENTITYTYPE.DRUG: ['布洛芬'],
+    ENTITYTYPE.FOOD: ['鸡蛋'],
+}
+
+
+@pytest.fixture(params=['build', 'load'])
+def classifier(request, tmp_path):
+    '''build: 由词表编译索引；load: 从已保存的索引文件加载'''
+    region_dir = str(tmp_path / 'region_words')
+    write_region_dir(region_dir, WORDS)
+    index_path = str(tmp_path / 'region_index.pkl')
+    classifier = QuestionClassifier(region_dir, index_path)
+    if request.param == 'load':
+        assert os.path.exists(index_path)
+        classifier = QuestionClassifier(region_dir, index_path)
+    return classifier
+
+
+def test_all_types_kept(classifier):
+    index = classifier.entity_index
+    assert set(index.lookup('头痛')) == {ENTITYTYPE.DISEASE, ENTITYTYPE.SYMPTOM}
+    assert set(index.lookup('胃镜')) == {ENTITYTYPE.CHECK, ENTITYTYPE.DEPARTMENT}
+    assert index.lookup('感冒') == (ENTITYTYPE.DISEASE,)
+    for entity_type, file_name in REGION_FILES:
+        assert sorted(index.words_of(entity_type)) == sorted(WORDS[entity_type])
+
+
+def test_disease_and_symptom(classifier):
+    res = classifier.classify_main('头痛有什么症状')
+    assert set(res['keywords']['头痛']) == {ENTITYTYPE.DISEASE, ENTITYTYPE.SYMPTOM}
+    assert set(res['question_types']) == {QUESTIONTYPE.DISEASE_TO_SYMPTOM, QUESTIONTYPE.SYMPTOM_TO_DISEASE}
+    sql_types = [sql['question_type'] for sql in QuestionParser().parser_main(res)]
+    assert sorted(sql_types, key=lambda t: t.value) == sorted(res['question_types'], key=lambda t: t.value)
+
+
+def test_check_and_department(classifier):
+    res = classifier.classify_main('感冒要做胃镜检查吗，挂什么科室')
+    assert set(res['keywords']['胃镜']) == {ENTITYTYPE.CHECK, ENTITYTYPE.DEPARTMENT}
+    assert set(res['question_types']) == {QUESTIONTYPE.DISEASE_DO_CHECK, QUESTIONTYPE.DISEASE_TO_DEPARTMENT}
+    entity_dict = QuestionParser().extract_entity(res['keywords'])
+    assert entity_dict[ENTITYTYPE.CHECK] == ['胃镜']
+    assert entity_dict[ENTITYTYPE.DEPARTMENT] == ['胃镜']
+    assert entity_dict[ENTITYTYPE.DISEASE] == ['感冒']
+
+
+def test_update_words_keeps_types(classifier):
+    classifier.update_words(add={ENTITYTYPE.SYMPTOM: ['感冒']}, persist=False)
+    assert set(classifier.entity_index.lookup('感冒')) == {ENTITYTYPE.DISEASE, ENTITYTYPE.SYMPTOM}
+    assert set(classifier.classify_main('感冒有什么症状')['question_types']) == {
+        QUESTIONTYPE.DISEASE_TO_SYMPTOM, QUESTIONTYPE.SYMPTOM_TO_DISEASE}
+
+
+def acquire_held_lock():
+    '''在子进程中执行：直接 fork 时锁的状态被复制为已持有，永远等不到释放'''
+    return HELD_LOCK.acquire(timeout=2)
+
+
+def test_build_in_child_does_not_inherit_locks():
+    HELD_LOCK.acquire()
+    try:
+        assert build_in_child(acquire_held_lock, ())
+    finally:
+        HELD_LOCK.release()
@@ -0,0 +1,70 @@
+# -*- coding:utf-8 -*-
+import os
+
+import mongomock
+import pytest
+
+from spider_fixture import generate_pages, start_server, change_pages
+from data_spider import CrimeSpider, DEFAULT_CHECKPOINTS, PAGE_SECTIONS
+
+PAGES = 20
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    # 检查点使用默认的相对路径
+    monkeypatch.chdir(tmp_path)
+    root = str(tmp_path / 'pages')
+    server, base_url = start_server(root)
+    written = generate_pages(root, PAGES, jc_url=base_url)
+    yield server, base_url, root, written
+    server.shutdown()
+
+
+def crawl(base_url, db, recrawl):
+    spider = CrimeSpider(base_url, db=db, workers=4, rate=0, recrawl=recrawl)
+    return spider, spider.spider_main(1, PAGES + 1, DEFAULT_CHECKPOINTS[False, recrawl])
+
+
+def test_default_checkpoints_are_separate():
+    assert len(set(DEFAULT_CHECKPOINTS.values())) == len(DEFAULT_CHECKPOINTS)
+
+
+def test_recrawl(site):
+    server, base_url, root, written = site
+    db = mongomock.MongoClient()['medical']
+    spider, result = crawl(base_url, db, False)
+    assert result['done'] == len(written)
+    full_bytes = spider.fetcher.stats['bytes']
+    assert full_bytes > 0
+
+    # 首次抓取的检查点不影响重新抓取；页面都未变化时全部为 304，不传输内容
+    spider, result = crawl(base_url, db, True)
+    assert result['skipped'] == 0
+    assert result['unchanged'] == len(written) and result['done'] == 0
+    assert spider.fetcher.stats['not_modified'] == len(written) * len(PAGE_SECTIONS)
+    assert spider.fetcher.stats['bytes'] == 0
+
+    # 重新抓取的检查点使中断后续爬时跳过已完成的页面
+    _, result = crawl(base_url, db, True)
+    assert result['skipped'] == PAGES
+    os.remove(DEFAULT_CHECKPOINTS[False, True])
+
+    changed = change_pages(root, written, 0.2)
+    before = {doc['url']: doc for doc in db['data'].find()}
+    spider, result = crawl(base_url, db, True)
+    assert result['done'] == len(changed)
+    assert result['unchanged'] == len(written) - len(changed)
+    assert spider.fetcher.stats['not_modified'] == len(written) * len(PAGE_SECTIONS) - len(changed)
+    assert 0 < spider.fetcher.stats['bytes'] < full_bytes / 10
+    for page in written:
+        url = spider.page_urls(page)['gaishu']
+        doc = db['data'].find_one({'url': url})
+        if page in changed:
+            with open(os.path.join(root, 'il_sii', 'symptom', '%d.htm' % page), encoding='gbk') as f:
+                html = f.read()
+            assert doc['symptom_info'][0] and all(symptom in html for symptom in doc['symptom_info'][0])
+            assert doc['symptom_info'] != before[url]['symptom_info']
+            assert doc['basic_info'] == before[url]['basic_info']
+        else:
+            assert doc == before[url]
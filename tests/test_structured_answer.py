@@ -0,0 +1,68 @@
+# -*- coding:utf-8 -*-
+import pytest
+
+from answer_cache import AnswerCache
+from graph_client import FakeGraphBackend, GraphClient
+from QA_main import QuestionAnswerSystem
+from QuestionClassifier import QuestionClassifier, ENTITYTYPE, REGION_FILES
+from synthetic import write_region_dir
+
+NO_ANSWER = "非常抱歉，这个问题超出小医的能力范围！"
+
+
+@pytest.fixture(scope='module')
+def handler(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('structured')
+    words = {entity_type: [] for entity_type, _ in REGION_FILES}
+    words[ENTITYTYPE.DISEASE] = ['感冒', '肺炎', '罕见病']
+    words[ENTITYTYPE.SYMPTOM] = ['发热', '咳嗽']
+    words[ENTITYTYPE.DRUG] = ['阿莫西林']
+    write_region_dir(str(tmp_path / 'region_words'), words)
+    classifier = QuestionClassifier(str(tmp_path / 'region_words'), str(tmp_path / 'region_index.pkl'))
+    graph = FakeGraphBackend()
+    graph.add_edge('Disease', '感冒', 'has_symptom', '症状', 'Symptom', '发热')
+    graph.add_edge('Disease', '感冒', 'has_symptom', '症状', 'Symptom', '咳嗽')
+    graph.add_edge('Disease', '肺炎', 'has_symptom', '症状', 'Symptom', '咳嗽')
+    graph.add_edge('Disease', '肺炎', 'common_drug', '常用药品', 'Drug', '阿莫西林')
+    graph.add_node('Disease', '罕见病')
+    client = GraphClient(graph, pool_size=2)
+    yield QuestionAnswerSystem(client, AnswerCache(max_bytes=0), classifier)
+    client.close()
+
+
+def test_entities_and_results(handler):
+    question = '请问感冒和肺炎有什么症状'
+    res = handler.question_answer_structured(question)
+    assert res['answered']
+    assert res['question_types'] == ['disease_symptom']
+    assert res['entities'] == [{'name': '感冒', 'start': 2, 'end': 4, 'types': ['Disease']},
+                               {'name': '肺炎', 'start': 5, 'end': 7, 'types': ['Disease']}]
+    for entity in res['entities']:
+        assert question[entity['start']:entity['end']] == entity['name']
+    assert res['answers'] == [{'question_type': 'disease_symptom', 'results': [
+        {'entity': '感冒', 'relation': '症状', 'values': ['发热', '咳嗽']},
+        {'entity': '肺炎', 'relation': '症状', 'values': ['咳嗽']}]}]
+    # 模板回答只在 render_text 时生成
+    assert 'text' not in res and 'text' not in res['answers'][0]
+
+
+def test_render_text(handler):
+    question = '肺炎有什么症状，吃什么药'
+    res = handler.question_answer_structured(question, render_text=True)
+    assert [answer['question_type'] for answer in res['answers']] == ['disease_symptom', 'disease_drug']
+    assert res['text'] == '\n'.join(answer['text'] for answer in res['answers'])
+    assert res['text'] == handler.question_answer_main(question)
+
+
+@pytest.mark.parametrize('question, entities', [
+    ('今天天气怎么样', []),
+    # 识别出实体但图谱中没有结果
+    ('罕见病有什么症状', [{'name': '罕见病', 'start': 0, 'end': 3, 'types': ['Disease']}]),
+])
+def test_unanswerable(handler, question, entities):
+    res = handler.question_answer_structured(question, render_text=True)
+    assert res['answered'] is False
+    assert res['answers'] == []
+    assert res['entities'] == entities
+    assert res['text'] == NO_ANSWER
+    assert set(handler.question_answer_structured(question)) == {'answered', 'question_types', 'entities', 'answers'}
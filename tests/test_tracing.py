@@ -0,0 +1,133 @@
+# -*- coding:utf-8 -*-
+import json
+import logging
+
+import pytest
+
+import tracing
+from answer_cache import AnswerCache
+from graph_client import FakeGraphBackend, GraphClient
+from QA_main import QuestionAnswerSystem
+from QuestionClassifier import QuestionClassifier, ENTITYTYPE, REGION_FILES
+from synthetic import write_region_dir
+from tracing import COUNTERS
+
+
+@pytest.fixture
+def traces(caplog, monkeypatch):
+    '''
+    :return: 返回已输出的追踪记录的函数
+    '''
+    monkeypatch.setattr(tracing, '_sample_rate', 1.0)
+    caplog.set_level(logging.INFO, logger='qa.trace')
+    return lambda: [json.loads(record.getMessage()) for record in caplog.records if record.name == 'qa.trace']
+
+
+@pytest.fixture(scope='module')
+def handler(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('tracing')
+    words = {entity_type: [] for entity_type, _ in REGION_FILES}
+    words[ENTITYTYPE.DISEASE] = ['感冒', '肺炎', '胃炎']
+    words[ENTITYTYPE.SYMPTOM] = ['发热', '咳嗽']
+    words[ENTITYTYPE.DRUG] = ['阿莫西林']
+    write_region_dir(str(tmp_path / 'region_words'), words)
+    classifier = QuestionClassifier(str(tmp_path / 'region_words'), str(tmp_path / 'region_index.pkl'))
+    graph = FakeGraphBackend()
+    for disease in words[ENTITYTYPE.DISEASE]:
+        graph.add_edge('Disease', disease, 'has_symptom', '症状', 'Symptom', '发热')
+        graph.add_edge('Disease', disease, 'common_drug', '常用药品', 'Drug', '阿莫西林')
+    client = GraphClient(graph, pool_size=2)
+    yield QuestionAnswerSystem(client, AnswerCache(max_bytes=0), classifier)
+    client.close()
+
+
+def test_trace_fields(traces):
+    with tracing.trace('request', question='q') as request_trace:
+        with tracing.span('parse', size=3) as span:
+            span.set(rows=2)
+        request_trace.set(entities=['甲'])
+    [record] = traces()
+    assert record['name'] == 'request' and record['question'] == 'q' and record['entities'] == ['甲']
+    assert isinstance(record['trace'], int) and record['duration_ms'] >= 0
+    [span] = record['spans']
+    assert span['name'] == 'parse' and span['size'] == 3 and span['rows'] == 2
+    assert span['start_ms'] >= 0 and span['duration_ms'] >= 0
+    assert span['start_ms'] + span['duration_ms'] <= record['duration_ms']
+
+
+def test_error_recorded(traces):
+    with pytest.raises(ValueError):
+        with tracing.trace('request'):
+            with tracing.span('parse'):
+                raise ValueError()
+    [record] = traces()
+    assert record['error'] == 'ValueError'
+    assert record['spans'][0]['error'] == 'ValueError'
+
+
+def test_sampling(traces, monkeypatch):
+    monkeypatch.setattr(tracing.random, 'random', lambda: 0.5)
+    for rate, sampled in ((0, False), (0.4, False), (0.6, True), (1.0, True)):
+        monkeypatch.setattr(tracing, '_sample_rate', rate)
+        with tracing.trace('request') as request_trace:
+            assert request_trace.sampled is sampled
+            assert tracing.current() is request_trace
+            # 未采样时 span 什么都不记录
+            with tracing.span('parse'):
+                pass
+    assert len(traces()) == 2
+    assert tracing.current() is tracing.NULL_TRACE
+
+
+def test_nested_trace_reuses_outer(traces):
+    with tracing.trace('outer') as outer:
+        with tracing.trace('inner') as inner:
+            assert inner is outer
+            with tracing.span('parse'):
+                pass
+    [record] = traces()
+    assert record['name'] == 'outer' and [span['name'] for span in record['spans']] == ['parse']
+
+
+def test_question_answer_spans(traces, handler):
+    handler.question_answer_main('感冒有什么症状，用什么药')
+    [record] = traces()
+    assert record['name'] == 'question_answer'
+    assert record['question'] == '感冒有什么症状，用什么药'
+    assert record['entities'] == ['感冒']
+    assert record['question_types'] == ['disease_symptom', 'disease_drug']
+    names = [span['name'] for span in record['spans']]
+    for stage in ('entity_match', 'trigger_classify', 'parse', 'prettify'):
+        assert stage in names
+    # 每个问题类型一个图数据库查询，在线程池中执行也记录在本次请求的追踪中
+    queries = [span for span in record['spans'] if span['name'] == 'graph_query']
+    assert len(queries) == 2 and all(span['names'] == 1 for span in queries)
+
+
+def test_batch_chunks(traces, handler):
+    questions = ['感冒有什么症状', '肺炎有什么症状', '胃炎有什么症状', '今天天气怎么样', '感冒用什么药']
+    before = COUNTERS.snapshot()
+    answers = list(handler.question_answer_batch(questions, chunksize=2))
+    assert [answered for _, answered in answers] == [True, True, True, False, True]
+    records = traces()
+    # 每个分块一个追踪，各分块的 span 不混在一起
+    assert [(record['name'], record['questions']) for record in records] == [('question_answer_batch', 2)] * 2 + \
+        [('question_answer_batch', 1)]
+    assert len({record['trace'] for record in records}) == 3
+    # 同一分块中同一问题类型的实体合并为一个查询
+    for record, names in zip(records, ([2], [1], [1])):
+        assert [span['names'] for span in record['spans'] if span['name'] == 'graph_query'] == names
+    after = COUNTERS.snapshot()
+    assert after.get('questions', 0) - before.get('questions', 0) == 5
+    assert after.get('unanswerable_no_entity', 0) - before.get('unanswerable_no_entity', 0) == 1
+    assert after.get('graph_queries', 0) - before.get('graph_queries', 0) == 3
+
+
+def test_counters():
+    counters = tracing.Counters()
+    counters.incr('a')
+    counters.incr('a', 2)
+    counters.incr('b')
+    assert counters.snapshot() == {'a': 3, 'b': 1}
+    counters.reset()
+    assert counters.snapshot() == {}
@@ -0,0 +1,215 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import json
+import time
+
+import pytest
+
+import metrics
+from synthetic import make_region_words, write_region_dir, make_fake_graph
+from answer_cache import AnswerCache
+from graph_client import GraphClient, GraphTimeout
+from QA_main import QuestionAnswerSystem
+from QuestionClassifier import QuestionClassifier, ENTITYTYPE
+import web_server
+from web_server import create_app
+
+
+@pytest.fixture(scope='module')
+def words():
+    return make_region_words(200)
+
+
+@pytest.fixture(scope='module')
+def classifier(tmp_path_factory, words):
+    tmp_path = tmp_path_factory.mktemp('region')
+    write_region_dir(str(tmp_path / 'region_words'), words)
+    return QuestionClassifier(str(tmp_path / 'region_words'), str(tmp_path / 'region_index.pkl'))
+
+
+def make_client(classifier, words, latency=0.0, max_pending=0, graph=None, cache_bytes=0, changes_path=None):
+    graph = graph if graph is not None else make_fake_graph(words, latency)
+    graph_client = GraphClient(graph, pool_size=2, timeout=5, max_pending=max_pending)
+    handler = QuestionAnswerSystem(graph_client, AnswerCache(max_bytes=cache_bytes), classifier)
+    return create_app(handler, changes_path).test_client(), graph_client
+
+
+def test_answer(classifier, words):
+    client, graph_client = make_client(classifier, words)
+    disease = words[ENTITYTYPE.DISEASE][0]
+    response = client.post('/', data={'question': disease + '有什么症状'})
+    assert response.status_code == 200
+    assert response.get_json()['valid_answer'] == 'true'
+    response = client.get('/answer', query_string={'question': disease + '有什么症状'})
+    assert response.get_json()['answered']
+    graph_client.close()
+
+
+def test_deadline(classifier, words):
+    client, graph_client = make_client(classifier, words, latency=0.5)
+    disease = words[ENTITYTYPE.DISEASE][0]
+    for path in ('/', '/answer'):
+        response = client.post(path, data={'question': disease + '有什么症状，吃什么药'},
+                               headers={'X-Request-Timeout': '0.05'})
+        assert response.status_code == 504
+    graph_client.close()
+
+
+def test_answer_async(classifier, words):
+    graph_client = GraphClient(make_fake_graph(words), pool_size=2, timeout=5)
+    handler = QuestionAnswerSystem(graph_client, AnswerCache(max_bytes=0), classifier)
+    question = words[ENTITYTYPE.DISEASE][0] + '有什么症状'
+    assert asyncio.run(handler.question_answer_main_async(question)) == handler.question_answer_main(question)
+    graph_client.backend.latency = 0.5
+    with pytest.raises(GraphTimeout):
+        asyncio.run(handler.question_answer_main_async(question, timeout=0.05))
+    graph_client.close()
+
+
+def test_shed_load(classifier, words):
+    client, graph_client = make_client(classifier, words, latency=0.5, max_pending=1)
+    graph_client.submit('MATCH (n:Disease) RETURN n.name')
+    response = client.post('/', data={'question': words[ENTITYTYPE.DISEASE][0] + '有什么症状'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    graph_client.close()
+
+
+def read_batch(client, questions, headers=None):
+    response = client.post('/batch', json={'questions': questions}, headers=headers, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    chunks = [chunk.decode('utf-8') for chunk in response.response]
+    return chunks, [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+
+
+def test_batch(classifier, words, monkeypatch):
+    monkeypatch.setattr(web_server, 'BATCH_CHUNK', 2)
+    client, graph_client = make_client(classifier, words)
+    diseases = words[ENTITYTYPE.DISEASE]
+    questions = [diseases[0] + '有什么症状', '今天天气怎么样', diseases[1] + '吃什么药', diseases[2] + '挂什么科室',
+                 diseases[0] + '有什么症状']
+    chunks, lines = read_batch(client, questions)
+    # 每两行输出一次，按输入顺序
+    assert [chunk.count('\n') for chunk in chunks] == [2, 2, 1]
+    assert [line['index'] for line in lines] == list(range(len(questions)))
+    handler = client.application.extensions['qa_handler']()
+    for question, line in zip(questions, lines):
+        assert line['answer'] == handler.question_answer_main(question)
+    assert [line['valid_answer'] for line in lines] == ['true', 'false', 'true', 'true', 'true']
+    graph_client.close()
+
+
+def test_batch_busy(classifier, words, monkeypatch):
+    monkeypatch.setattr(web_server, 'BATCH_CHUNK', 2)
+    client, graph_client = make_client(classifier, words, max_pending=1)
+    diseases = words[ENTITYTYPE.DISEASE]
+    # 第二个分块有两个问题类型，需要两个查询，超过 max_pending
+    questions = [diseases[0] + '有什么症状', diseases[1] + '有什么症状', diseases[2] + '有什么症状',
+                 diseases[3] + '吃什么药']
+    _, lines = read_batch(client, questions)
+    assert lines[-1] == {'index': 2, 'error': 'busy'}
+    assert [line['index'] for line in lines[:-1]] == [0, 1]
+    graph_client.close()
+
+
+def test_batch_timeout(classifier, words, monkeypatch):
+    monkeypatch.setattr(web_server, 'BATCH_CHUNK', 1)
+    client, graph_client = make_client(classifier, words, latency=0.2)
+    diseases = words[ENTITYTYPE.DISEASE]
+    questions = [disease + '有什么症状' for disease in diseases[:4]]
+    # 第一个分块在截止时间内完成，第二个分块超过整批的截止时间
+    _, lines = read_batch(client, questions, {'X-Request-Timeout': '0.3'})
+    assert lines[0]['index'] == 0 and lines[0]['valid_answer'] == 'true'
+    assert lines[1:] == [{'index': 1, 'error': 'timeout'}]
+    graph_client.close()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def workers(tmp_path, words, monkeypatch):
+    '''
+    两个共享词表目录与变更日志、各有自己的分类器和缓存的 app，模拟两个 worker
+    '''
+    monkeypatch.setattr(web_server, 'ADMIN_TOKEN', 'secret')
+    region_dir = str(tmp_path / 'region_words')
+    write_region_dir(region_dir, words)
+    graph = make_fake_graph(words)
+    changes_path = str(tmp_path / 'changes.log')
+    clients = []
+    for _ in range(2):
+        classifier = QuestionClassifier(region_dir, str(tmp_path / 'region_index.pkl'))
+        client, graph_client = make_client(classifier, words, graph=graph, cache_bytes=1 << 20,
+                                           changes_path=changes_path)
+        clients.append((client, classifier, graph_client))
+    yield graph, clients
+    for _, _, graph_client in clients:
+        graph_client.close()
+
+
+def test_graph_changed_reaches_all_workers(workers, words):
+    graph, [(first, _, _), (second, _, _)] = workers
+    disease = words[ENTITYTYPE.DISEASE][0]
+    question = disease + '有什么症状'
+    before = second.post('/', data={'question': question}).get_json()['answer']
+    graph.add_edge('Disease', disease, 'has_symptom', '症状', 'Symptom', '新症状')
+    # 缓存未失效时仍是旧回答
+    assert second.post('/', data={'question': question}).get_json()['answer'] == before
+
+    response = first.post('/admin/graph/changed', json={'entities': [disease]}, headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200
+    assert '新症状' in second.post('/', data={'question': question}).get_json()['answer']
+    assert '新症状' in first.post('/', data={'question': question}).get_json()['answer']
+
+
+@pytest.mark.parametrize('persist', [True, False])
+def test_region_words_reach_all_workers(workers, persist):
+    _, [(first, first_classifier, _), (second, second_classifier, _)] = workers
+    response = first.post('/admin/region/words', json={'add': {'Disease': ['新病']}, 'persist': persist},
+                          headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200
+    assert '新病' in first_classifier.entity_index
+    assert '新病' not in second_classifier.entity_index
+    second.post('/', data={'question': '新病有什么症状'})
+    wait_for(lambda: '新病' in second_classifier.entity_index)
+    assert second_classifier.entity_index.lookup('新病') == (ENTITYTYPE.DISEASE,)
+
+
+def test_region_changes_apply_in_order(workers):
+    _, [(first, first_classifier, _), (second, second_classifier, _)] = workers
+    for _ in range(3):
+        for key in ('add', 'remove'):
+            response = first.post('/admin/region/words', json={key: {'Disease': ['新病']}, 'persist': False},
+                                  headers={'X-Admin-Token': 'secret'})
+            assert response.status_code == 200
+    assert '新病' not in first_classifier.entity_index
+    # 另一个 worker 一次读到全部六个变更，按写入顺序应用后该词不存在
+    second.post('/', data={'question': '新病有什么症状'})
+    second.application.extensions['qa_region_updates'].join()
+    assert '新病' not in second_classifier.entity_index
+    first.post('/admin/region/words', json={'add': {'Disease': ['新病']}, 'persist': False},
+               headers={'X-Admin-Token': 'secret'})
+    second.post('/', data={'question': '新病有什么症状'})
+    second.application.extensions['qa_region_updates'].join()
+    assert '新病' in second_classifier.entity_index
+
+
+@pytest.mark.parametrize('value, module_default, server_default', [(None, False, True), ('1', True, True),
+                                                                    ('0', False, False)])
+def test_metrics_default(monkeypatch, classifier, words, value, module_default, server_default):
+    if value is None:
+        monkeypatch.delenv('QA_METRICS', raising=False)
+    else:
+        monkeypatch.setenv('QA_METRICS', value)
+    # 脚本导入时默认只计数，web 服务默认计时
+    monkeypatch.setattr(metrics, 'enabled', not server_default)
+    assert metrics.enabled_from_env() is module_default
+    client, graph_client = make_client(classifier, words)
+    assert metrics.enabled is server_default
+    graph_client.close()
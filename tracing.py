@@ -0,0 +1,220 @@
+# -*- coding:utf-8 -*-
+'''
+问答流程的计数与追踪
+
+计数器始终开启；逐请求的追踪默认关闭，按采样比例开启。采样到的请求结束时输出一行 JSON 到 logger 'qa.trace'，
+包含各阶段的 span：entity_match, trigger_classify, parse, graph_query（每个查询一个）, prettify。
+未采样的请求只多一次 ContextVar 读取和空的 with 块；开启 metrics 时各阶段与整体耗时另外计入 metrics 的直方图。
+
+    tracing.configure(sample_rate=0.01, log_path='qa.log')   # 或环境变量 QA_TRACE_SAMPLE, QA_LOG_PATH
+
+    with tracing.trace('question_answer', question=question):
+        with tracing.span('parse'):
+            ...
+'''
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import metrics
+from utils import set_logger
+
+logger = logging.getLogger('qa.trace')
+logger.setLevel(logging.INFO)
+
+
+class Counters(object):
+    '''
+    线程安全的计数器
+    '''
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+COUNTERS = Counters()
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class StageTimer(object):
+    '''
+    未采样的请求在开启 metrics 时使用，只计时
+    '''
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - self.start, self.name)
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+class NullTrace(object):
+    '''
+    未采样的请求使用的空追踪
+    '''
+    sampled = False
+
+    def span(self, name, **attrs):
+        return StageTimer(name) if metrics.enabled else NULL_SPAN
+
+    def set(self, **attrs):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class Span(object):
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.record = dict(attrs, name=name)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if metrics.enabled:
+            metrics.STAGE_SECONDS.observe(end - self.start, self.record['name'])
+        self.record['start_ms'] = round((self.start - self.trace.start) * 1000, 3)
+        self.record['duration_ms'] = round((end - self.start) * 1000, 3)
+        if exc_type is not None:
+            self.record['error'] = exc_type.__name__
+        # 图数据库查询在线程池中执行，list.append 是原子的
+        self.trace.spans.append(self.record)
+        return False
+
+    def set(self, **attrs):
+        self.record.update(attrs)
+
+
+class Trace(object):
+    sampled = True
+
+    def __init__(self, trace_id, name, attrs):
+        self.record = dict(attrs, trace=trace_id, name=name)
+        self.spans = []
+        self.start = time.perf_counter()
+
+    def span(self, name, **attrs):
+        return Span(self, name, attrs)
+
+    def set(self, **attrs):
+        self.record.update(attrs)
+
+    def finish(self, error=None):
+        self.record['duration_ms'] = round((time.perf_counter() - self.start) * 1000, 3)
+        if error is not None:
+            self.record['error'] = error
+        self.record['spans'] = sorted(self.spans, key=lambda span: span['start_ms'])
+        logger.info(json.dumps(self.record, ensure_ascii=False, default=str))
+
+
+_current = contextvars.ContextVar('qa_trace', default=NULL_TRACE)
+_trace_ids = itertools.count(1)
+_sample_rate = float(os.environ.get('QA_TRACE_SAMPLE', 0))
+
+
+def configure(sample_rate=None, log_path=None):
+    '''
+    :param sample_rate: 追踪的请求比例 0~1
+    :param log_path: 日志文件，通过 utils.set_logger 同时输出到终端和文件；
+                     未指定且日志尚未配置时，追踪记录只输出到终端
+    '''
+    global _sample_rate
+    if sample_rate is not None:
+        _sample_rate = float(sample_rate)
+    if log_path:
+        set_logger(log_path)
+    elif _sample_rate > 0 and not logging.getLogger().handlers:
+        logging.basicConfig(format='%(message)s')
+
+
+def configure_from_env(environ=None):
+    '''
+    QA_TRACE_SAMPLE, QA_LOG_PATH
+    '''
+    environ = os.environ if environ is None else environ
+    configure(environ.get('QA_TRACE_SAMPLE'), environ.get('QA_LOG_PATH'))
+
+
+def current():
+    return _current.get()
+
+
+def span(name, **attrs):
+    '''
+    当前请求中的一个阶段，请求未被采样时什么都不做
+    '''
+    return _current.get().span(name, **attrs)
+
+
+@contextlib.contextmanager
+def trace(name, **attrs):
+    '''
+    追踪一次请求，按采样比例决定是否记录；已在追踪中时沿用外层的追踪
+    '''
+    start = time.perf_counter()
+    outer = _current.get()
+    if _sample_rate <= 0 or outer.sampled or random.random() >= _sample_rate:
+        try:
+            yield outer
+        finally:
+            if metrics.enabled:
+                metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, name)
+        return
+
+    request_trace = Trace(next(_trace_ids), name, attrs)
+    token = _current.set(request_trace)
+    error = None
+    try:
+        yield request_trace
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        if metrics.enabled:
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, name)
+        request_trace.finish(error)
@@ -1,24 +1,249 @@
 # -*- coding:utf-8 -*-
+'''
+问答 HTTP 服务
 
+开发模式：
+    python web_server.py
+生产模式（多 worker，--preload 使 actree 与实体索引在 fork 前加载，worker 间写时复制共享）：
+    gunicorn -c gunicorn.conf.py "web_server:create_app()"
+
+问答接口是普通的同步视图，每个请求占用 worker 的一个线程直到图数据库查询返回或超过截止时间。
+不使用 Flask 的 async 视图：WSGI 下 async 视图在处理请求的线程中运行自己的事件循环，等待图数据库时
+线程同样被占用，并发不会增加，只多了事件循环的开销；真正限制负载的是下面的排队上限与截止时间。
+需要 await 图数据库查询的 asyncio 调用方使用 QuestionAnswerSystem.question_answer_main_async。
+图数据库查询队列已满时返回 503 + Retry-After（在进入视图前检查，拒绝请求的开销很小），
+超过请求截止时间返回 504，尚未开始执行的查询随之取消。
+截止时间默认为 QA_REQUEST_TIMEOUT 秒，客户端可用请求头 X-Request-Timeout（秒）缩短。
+
+/batch 接口一次提交多个问句，按输入顺序以 NDJSON 逐行返回。
+/answer 接口返回结构化回答（问题类型、实体及位置、各问题类型的相关实体），模板回答仅在 text=1 时生成。
+
+日志与追踪：QA_LOG_PATH 指定日志文件，QA_TRACE_SAMPLE 为逐请求追踪的采样比例（默认 0，只保留计数），见 tracing.py。
+/metrics 以 Prometheus 文本格式输出本 worker 的指标，服务默认开启计时（QA_METRICS=0 时只有计数），见 metrics.py。
+
+领域词典热更新：QA_REGION_WATCH 秒（默认 0 不开启）检查一次词表文件，有变化时各 worker 各自重新加载；
+/admin/region/reload、/admin/region/words 接口需要请求头 X-Admin-Token 与 QA_ADMIN_TOKEN 一致，未设置时不开放。
+图谱增量更新后（prepare_data/build_graph.py --incremental --notify）由 /admin/graph/changed 按实体使查询缓存失效。
+管理接口只由一个 worker 处理，变更经 QA_CHANGES_PATH（默认 data/changes.log）通知其他 worker，
+各 worker 在处理下一个问答请求前应用，见 change_feed.py。
+'''
+import gc
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+
+import metrics
+import tracing
+from change_feed import ChangeFeed
 from QA_main import QuestionAnswerSystem
+from QuestionClassifier import QuestionClassifier, ENTITYTYPE
+from graph_client import GraphBusy, GraphTimeout
 
-from flask import Flask,request,make_response,jsonify
+from flask import Blueprint, Flask, Response, current_app, request, make_response, jsonify
 from flask_cors import * # 解决ajax 跨域问题请求
 
-app = Flask(__name__)
-# r'/*' 是通配符，让本服务器所有的URL 都允许跨域请求
-# CORS(app, resources=r'/*',supports_credentials=True) # supports_credentials=True 多加会报错，暂时不知道原因
-CORS(app, resources=r'/*')
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+qa = Blueprint('qa', __name__)
+# 运维接口，不受过载保护影响
+ops = Blueprint('ops', __name__)
+# 管理接口，需要 QA_ADMIN_TOKEN
+admin = Blueprint('admin', __name__, url_prefix='/admin')
+
+REQUEST_TIMEOUT = float(os.environ.get('QA_REQUEST_TIMEOUT', 10))
+RETRY_AFTER = int(os.environ.get('QA_RETRY_AFTER', 1))
+# /batch 单次请求的问句数上限，以及合并查询图数据库的分块大小
+BATCH_MAX = int(os.environ.get('QA_BATCH_MAX', 1000))
+BATCH_CHUNK = int(os.environ.get('QA_BATCH_CHUNK', 256))
+# 检查词表文件变化的间隔（秒），0 为不检查
+REGION_WATCH = float(os.environ.get('QA_REGION_WATCH', 0))
+ADMIN_TOKEN = os.environ.get('QA_ADMIN_TOKEN')
+# 各 worker 共享的变更日志
+CHANGES_PATH = os.environ.get('QA_CHANGES_PATH', 'data/changes.log')
+
+
+class HandlerFactory(object):
+    '''
+    每个 worker 进程一个 QuestionAnswerSystem
+
+    分类器只读且加载耗时，在创建 app 时（gunicorn --preload 下即 master 进程中）加载，由 fork 出的 worker 共享；
+    图数据库连接和线程池不能跨 fork 使用，在每个进程第一次处理请求时创建；检查词表文件的线程同样每个进程各自启动。
+    '''
+    def __init__(self, classifier=None):
+        self.classifier = classifier
+        self.handler = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.handler = QuestionAnswerSystem(classifier=self.classifier)
+                    if REGION_WATCH > 0:
+                        self.handler.classifier.watch(REGION_WATCH)
+                    self.pid = os.getpid()
+        return self.handler
+
+
+class RegionUpdates(object):
+    '''
+    按变更日志中的顺序逐个应用领域词典的变更
+
+    更新可能需要重建 actree，在后台线程中执行，完成前请求继续使用旧版本；每个进程只有一个线程，
+    先写入日志的变更先应用，同一个词先加后删不会颠倒。线程不能跨 fork 使用，在每个进程第一次使用时启动。
+    '''
+    def __init__(self):
+        self.changes = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def put(self, classifier, change):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.changes = queue.Queue()
+                threading.Thread(target=self.run, args=(self.changes,), name='region-update', daemon=True).start()
+                self.pid = os.getpid()
+            self.changes.put((classifier, change))
 
-@app.route("/",methods=('GET', 'POST'))
+    def join(self):
+        '''
+        等待已提交的变更全部应用
+        '''
+        if self.pid == os.getpid():
+            self.changes.join()
+
+    def run(self, changes):
+        while True:
+            classifier, change = changes.get()
+            try:
+                apply_region_change(classifier, change)
+            finally:
+                changes.task_done()
+
+
+def create_app(handler=None, changes_path=None):
+    '''
+    :param handler: QuestionAnswerSystem，为空时每个 worker 进程各自创建
+    :param changes_path: 变更日志，为空时为 QA_CHANGES_PATH
+    '''
+    tracing.configure_from_env()
+    metrics.configure(metrics.enabled_from_env(default='1'))
+    app = Flask(__name__)
+    app.extensions['qa_changes'] = ChangeFeed(changes_path or CHANGES_PATH)
+    app.extensions['qa_region_updates'] = RegionUpdates()
+    # r'/*' 是通配符，让本服务器所有的URL 都允许跨域请求
+    # CORS(app, resources=r'/*',supports_credentials=True) # supports_credentials=True 多加会报错，暂时不知道原因
+    CORS(app, resources=r'/*')
+
+    if handler is not None:
+        app.extensions['qa_handler'] = lambda: handler
+    else:
+        factory = HandlerFactory(QuestionClassifier())
+        app.extensions['qa_handler'] = factory.get
+        # 启动阶段加载的对象不再参与 gc，避免 fork 后 gc 改写引用计数使共享页被复制
+        gc.freeze()
+
+    app.register_blueprint(qa)
+    app.register_blueprint(ops)
+    app.register_blueprint(admin)
+    return app
+
+
+def get_handler():
+    return current_app.extensions['qa_handler']()
+
+
+def get_changes():
+    return current_app.extensions['qa_changes']
+
+
+def apply_changes():
+    '''
+    应用其他 worker 通过管理接口写入变更日志的变更：查询缓存失效在本线程完成，
+    领域词典的更新交给 RegionUpdates 按顺序在后台应用
+    '''
+    changes = get_changes().poll()
+    if not changes:
+        return
+    handler = get_handler()
+    for change in changes:
+        if change.get('kind') == 'graph':
+            handler.graph_reloaded(change.get('entities'))
+        elif change.get('kind') == 'region':
+            current_app.extensions['qa_region_updates'].put(handler.classifier, change)
+
+
+def apply_region_change(classifier, change):
+    try:
+        if change.get('persist', True) is not False:
+            # 词表与索引文件已由处理请求的 worker 写好，reload 直接读入
+            classifier.reload()
+        else:
+            classifier.update_words(*[{ENTITYTYPE(entity_type): words for entity_type, words in change[key].items()}
+                                      for key in ('add', 'remove')], persist=False)
+    except Exception:
+        logging.exception('failed to apply region change from change log')
+
+
+def request_timeout():
+    '''
+    本次请求的截止时间（秒），客户端给出的值不能超过服务端上限
+    '''
+    try:
+        timeout = float(request.headers.get('X-Request-Timeout', REQUEST_TIMEOUT))
+    except ValueError:
+        return REQUEST_TIMEOUT
+    return min(timeout, REQUEST_TIMEOUT) if timeout > 0 else REQUEST_TIMEOUT
+
+
+def dumps(obj):
+    '''
+    序列化为 UTF-8 JSON，有 orjson 时使用 orjson
+    '''
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def error_response(status, message, headers=None):
+    response = make_response(jsonify({"statusCode": status, "answer": message, "valid_answer": "false"}), status)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    for key, value in (headers or {}).items():
+        response.headers[key] = value
+    return response
+
+
+@qa.before_request
+def sync_changes():
+    apply_changes()
+
+
+@qa.before_request
+def shed_load():
+    if request.method != 'OPTIONS' and get_handler().answer_searcher.client.saturated():
+        return error_response(503, "服务繁忙，请稍后再试", {'Retry-After': str(RETRY_AFTER)})
+
+
+@qa.route("/",methods=('GET', 'POST'))
 def index():
-    global handler
+    handler = get_handler()
+    question = request.form['question'] if request.method == 'POST' else request.args.get('question')
+
+    try:
+        answer = handler.question_answer_main(question, request_timeout())
+    except GraphBusy:
+        return error_response(503, "服务繁忙，请稍后再试", {'Retry-After': str(RETRY_AFTER)})
+    except GraphTimeout:
+        return error_response(504, "查询超时，请稍后再试")
 
     if request.method == 'POST':
-        print("get post request")
-        question = request.form['question']
-        answer = handler.question_answer_main(question)
-        print(answer)
         if answer == "非常抱歉，这个问题超出小医的能力范围！":
             valid_answer = "false"
         else:
@@ -34,14 +259,152 @@ def index():
 
         return response
 
-    else:
-        question = request.args.get('question')
-        answer =  handler.question_answer_main(question)
     return answer
 
-if __name__ == '__main__':
+@qa.route("/answer",methods=('GET', 'POST'))
+def answer():
+    '''
+    问句与选项可以放在 JSON 请求体 {"question": ..., "text": true}、表单或查询参数中，
+    返回结果见 QuestionAnswerSystem.structured_answer
+    '''
+    handler = get_handler()
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        question, render_text = payload.get('question'), bool(payload.get('text'))
+    else:
+        question = request.values.get('question')
+        render_text = request.values.get('text', '').lower() in ('1', 'true')
+    if not isinstance(question, str):
+        return error_response(400, "缺少问句")
+
+    try:
+        res = handler.question_answer_structured(question, render_text, request_timeout())
+    except GraphBusy:
+        return error_response(503, "服务繁忙，请稍后再试", {'Retry-After': str(RETRY_AFTER)})
+    except GraphTimeout:
+        return error_response(504, "查询超时，请稍后再试")
+    return Response(dumps(res), mimetype='application/json', headers={'Access-Control-Allow-Origin': '*'})
+
+
+@qa.route("/batch",methods=('POST',))
+def batch():
+    '''
+    请求体为 {"questions": [问句, ...]} 或问句数组，每个问句返回一行：
+        {"index": 0, "answer": "...", "valid_answer": "true"}
+    中途图数据库繁忙或超过请求截止时间时，输出一行 {"index": 第一个未回答的下标, "error": "busy" | "timeout"} 后结束
+    '''
+    payload = request.get_json(silent=True)
+    questions = payload.get('questions') if isinstance(payload, dict) else payload
+    if not isinstance(questions, list) or not all(isinstance(question, str) for question in questions):
+        return error_response(400, "请求体应为问句数组")
+    if len(questions) > BATCH_MAX:
+        return error_response(413, "一次最多提交%d个问句" % BATCH_MAX)
+    handler = get_handler()
+    # 生成器在请求上下文之外执行，截止时间需要先取出
+    timeout = request_timeout()
+
+    def generate():
+        lines = []
+        index = 0
+        try:
+            for answer, answered in handler.question_answer_batch(questions, BATCH_CHUNK, timeout):
+                lines.append(json.dumps({"index": index, "answer": answer, "valid_answer": "true" if answered else "false"},
+                                        ensure_ascii=False))
+                index += 1
+                # 每个分块输出一次，减少写入次数
+                if len(lines) == BATCH_CHUNK:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+        except GraphBusy:
+            lines.append(json.dumps({"index": index, "error": "busy"}))
+        except GraphTimeout:
+            lines.append(json.dumps({"index": index, "error": "timeout"}))
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={'Access-Control-Allow-Origin': '*'})
+
+@ops.route("/metrics",methods=('GET',))
+def metrics_view():
+    searcher = get_handler().answer_searcher
+    extra = metrics.counter_metrics(tracing.COUNTERS.snapshot()) + metrics.pool_metrics(searcher.client)
+    if searcher.cache is not None:
+        extra += metrics.cache_metrics(searcher.cache)
+    return Response(metrics.REGISTRY.render(extra), mimetype='text/plain; version=0.0.4')
 
-    handler = QuestionAnswerSystem()
-    print('load sucess!')
-    app.run(debug=True,host='0.0.0.0',port=5000)
+@admin.before_request
+def check_admin_token():
+    token = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        return error_response(403, "无权访问")
+
+def region_response(classifier, **extra):
+    return jsonify(dict(extra, statusCode=200, words=len(classifier.entity_index)))
+
+@admin.route("/region/reload",methods=('POST',))
+def region_reload():
+    '''
+    重新读取词表文件，其他 worker 经变更日志随之 reload
+    '''
+    classifier = get_handler().classifier
+    try:
+        changed = classifier.reload()
+    except RuntimeError as e:
+        return error_response(500, str(e))
+    get_changes().append({'kind': 'region'})
+    return region_response(classifier, changed=changed)
+
+@admin.route("/region/words",methods=('POST',))
+def region_words():
+    '''
+    请求体 {"add": {"Disease": [词, ...]}, "remove": {"drug": [...]}, "persist": true}，
+    实体类型为 ENTITYTYPE 的值；persist 为 true（默认）时写回词表文件，其他 worker 经变更日志读入新的索引文件，
+    否则其他 worker 各自应用同样的增删
+    '''
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return error_response(400, "请求体应为 JSON 对象")
+    changes = {}
+    try:
+        for key in ('add', 'remove'):
+            changes[key] = {ENTITYTYPE(entity_type): words for entity_type, words in (payload.get(key) or {}).items()}
+    except (AttributeError, ValueError):
+        return error_response(400, "未知的实体类型")
+    if not all(isinstance(words, list) and all(isinstance(word, str) for word in words)
+               for type_words in changes.values() for words in type_words.values()):
+        return error_response(400, "词应为字符串数组")
+
+    classifier = get_handler().classifier
+    persist = payload.get('persist', True) is not False
+    try:
+        classifier.update_words(changes['add'], changes['remove'], persist=persist)
+    except (OSError, RuntimeError) as e:
+        return error_response(500, str(e))
+    get_changes().append({'kind': 'region', 'persist': persist,
+                          'add': {entity_type.value: words for entity_type, words in changes['add'].items()},
+                          'remove': {entity_type.value: words for entity_type, words in changes['remove'].items()}})
+    return region_response(classifier)
+
+@admin.route("/graph/changed",methods=('POST',))
+def graph_changed():
+    '''
+    图谱更新后调用，请求体 {"entities": [实体名, ...]} 只使这些实体的查询缓存失效，没有 entities 时全部失效；
+    其他 worker 经变更日志在处理下一个问答请求前失效
+    '''
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return error_response(400, "请求体应为 JSON 对象")
+    entities = payload.get('entities')
+    if entities is not None and not (isinstance(entities, list) and all(isinstance(entity, str) for entity in entities)):
+        return error_response(400, "entities 应为字符串数组")
+    get_handler().graph_reloaded(entities)
+    get_changes().append({'kind': 'graph', 'entities': entities})
+    return jsonify(statusCode=200, invalidated=len(entities) if entities is not None else 'all')
+
+if __name__ == '__main__':
 
+    app = create_app()
+    # 未通过 QA_LOG_PATH 配置日志时输出到终端
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logging.info('load sucess!')
+    app.run(debug=os.environ.get('QA_DEBUG') == '1',host='0.0.0.0',port=5000)